@@ -5,3 +5,13 @@ from django.apps import AppConfig
 class MultitenantConfig(AppConfig):
     name = "django_multitenant"
     verbose_name = "Multitenant"
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel
+        from . import registry
+        from .patches import install_patches
+
+        # Computes the tenant metadata of all the models once, so that the
+        # queries don't have to inspect the models again.
+        registry.populate()
+        install_patches()
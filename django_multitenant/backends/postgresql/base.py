@@ -5,6 +5,13 @@ from django.db.backends.postgresql.base import (
     DatabaseWrapper as PostgresqlDatabaseWrapper,
     DatabaseSchemaEditor as PostgresqlDatabaseSchemaEditor,
 )
+
+try:
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+except ImportError:
+    # Django < 4.2 only supports psycopg2
+    is_psycopg3 = False
+
 from django_multitenant.fields import TenantForeignKey
 from django_multitenant.utils import get_model_by_db_table, get_tenant_column
 
@@ -142,6 +149,81 @@ class TenantDatabaseFeatures(PostgresqlDatabaseFeatures):
 
 
 class DatabaseWrapper(PostgresqlDatabaseWrapper):
+    """
+    Setting the prepared_statements_cache_size option of the database to a positive
+    number enables the server-side prepared statements, see prepared.py:
+
+        "OPTIONS": {"prepared_statements_cache_size": 200}
+
+    Setting the tenant_predicate_check option to True, or to the arguments of
+    TenantPredicateChecker, reports the queries without tenant predicate, see
+    predicates.py:
+
+        "OPTIONS": {"tenant_predicate_check": {"sample_rate": 0.1}}
+    """
+
     # Override
     SchemaEditorClass = DatabaseSchemaEditor
     features_class = TenantDatabaseFeatures
+
+    # Cache of the prepared statements of the current connection, None if the
+    # prepared statements are not enabled.
+    prepared_statements = None
+
+    # TenantPredicateChecker of the connection, None if the check is not enabled.
+    tenant_predicate_checker = None
+
+    # Override
+    def __init__(self, settings_dict, *args, **kwargs):
+        super().__init__(settings_dict, *args, **kwargs)
+
+        check_options = self.settings_dict["OPTIONS"].get("tenant_predicate_check")
+        if check_options:
+            # pylint: disable=import-outside-toplevel
+            from .predicates import TenantPredicateChecker
+
+            if check_options is True:
+                check_options = {}
+            self.tenant_predicate_checker = TenantPredicateChecker(
+                self.alias, **check_options
+            )
+            self.execute_wrappers.append(self.tenant_predicate_checker)
+
+    # Override
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop("prepared_statements_cache_size", None)
+        conn_params.pop("tenant_predicate_check", None)
+        return conn_params
+
+    # Override
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+
+        # A new connection has no prepared statements
+        self.prepared_statements = None
+        cache_size = self.settings_dict["OPTIONS"].get(
+            "prepared_statements_cache_size", 0
+        )
+        if cache_size and is_psycopg3:
+            logger.warning(
+                "prepared_statements_cache_size is not supported with psycopg 3, "
+                "use its prepare_threshold option instead."
+            )
+        elif cache_size:
+            # pylint: disable=import-outside-toplevel
+            from .prepared import PreparedStatementCache
+
+            self.prepared_statements = PreparedStatementCache(cache_size)
+        return connection
+
+    # Override
+    def create_cursor(self, name=None):
+        cursor = super().create_cursor(name)
+        # Server-side cursors declare a cursor for the statement, they can't execute it
+        if self.prepared_statements is not None and name is None:
+            # pylint: disable=import-outside-toplevel
+            from .prepared import PreparedStatementCursor
+
+            return PreparedStatementCursor(cursor, self.prepared_statements)
+        return cursor
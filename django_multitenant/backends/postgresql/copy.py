@@ -0,0 +1,257 @@
+"""
+Bulk ingestion of rows with PostgreSQL COPY ... FROM STDIN.
+
+COPY avoids the parsing and planning of the multi-row INSERT statements of
+bulk_create, and Citus routes every row to the shard of its tenant. The rows
+are encoded in chunks of chunk_size rows which are streamed to the server one
+after the other, so that the memory used doesn't depend on the number of rows.
+
+The rows are encoded in CSV, or in the binary format of COPY which avoids the
+conversion of the values to text on the server. The binary format supports the
+types of the encoders of BINARY_ENCODERS only.
+"""
+
+import datetime
+import itertools
+import json
+import struct
+
+from django.db import transaction
+from django.db.utils import NotSupportedError
+from django.utils import timezone
+
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+NULL = struct.pack(">i", -1)
+
+POSTGRES_EPOCH_DATE = datetime.date(2000, 1, 1)
+POSTGRES_EPOCH = datetime.datetime(2000, 1, 1)
+POSTGRES_EPOCH_UTC = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _pack(fmt):
+    return struct.Struct(fmt).pack
+
+
+def _encode_text(value):
+    return str(value).encode()
+
+
+def _encode_date(value):
+    return struct.pack(">i", (value - POSTGRES_EPOCH_DATE).days)
+
+
+def _to_microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _encode_timestamp(value):
+    return struct.pack(">q", _to_microseconds(value - POSTGRES_EPOCH))
+
+
+def _encode_timestamptz(value):
+    if timezone.is_naive(value):
+        # Without USE_TZ, the naive datetimes are in the time zone of the sessions
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return struct.pack(">q", _to_microseconds(value - POSTGRES_EPOCH_UTC))
+
+
+def _encode_jsonb(value):
+    # Version of the jsonb binary format, followed by the JSON text
+    return b"\x01" + value.encode()
+
+
+# Maps the column types, as returned by Field.db_type() without their
+# modifiers, to the functions encoding their values in the binary format.
+BINARY_ENCODERS = {
+    "smallint": _pack(">h"),
+    "smallserial": _pack(">h"),
+    "integer": _pack(">i"),
+    "serial": _pack(">i"),
+    "bigint": _pack(">q"),
+    "bigserial": _pack(">q"),
+    "boolean": _pack(">?"),
+    "real": _pack(">f"),
+    "double precision": _pack(">d"),
+    "varchar": _encode_text,
+    "char": _encode_text,
+    "text": _encode_text,
+    "citext": _encode_text,
+    "date": _encode_date,
+    "timestamp": _encode_timestamp,
+    "timestamp with time zone": _encode_timestamptz,
+    "uuid": lambda value: value.bytes,
+    "jsonb": _encode_jsonb,
+    "bytea": bytes,
+}
+
+
+def get_db_type(field, connection):
+    db_type = field.db_type(connection) or ""
+    return db_type.split("(", 1)[0].strip().lower()
+
+
+def get_binary_encoders(fields, connection):
+    encoders = []
+    for field in fields:
+        encoder = BINARY_ENCODERS.get(get_db_type(field, connection))
+        if encoder is None:
+            raise NotSupportedError(
+                f"The binary format of copy_from() doesn't support the column type "
+                f"{field.db_type(connection)} of {field.model.__name__}.{field.name}. "
+                'Use format="csv" instead.'
+            )
+        encoders.append(encoder)
+    return encoders
+
+
+def prepare_value(field, value, connection):
+    """
+    Converts the value of a field to the value written in the COPY data.
+    """
+    if value is None:
+        return None
+    if field.get_internal_type() == "JSONField":
+        # get_db_prep_save() returns a driver adapter of the JSON text
+        return json.dumps(value, cls=field.encoder)
+    return field.get_db_prep_save(value, connection)
+
+
+def encode_csv_value(value):
+    if value is None:
+        # The unquoted empty strings are NULL, the quoted ones are empty strings
+        return ""
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def encode_csv_rows(rows):
+    return "".join(
+        ",".join([encode_csv_value(value) for value in row]) + "\n" for row in rows
+    ).encode()
+
+
+def encode_binary_rows(rows, encoders):
+    row_header = struct.pack(">h", len(encoders))
+    pack_length = struct.Struct(">i").pack
+    data = []
+    for row in rows:
+        data.append(row_header)
+        for encoder, value in zip(encoders, row):
+            if value is None:
+                data.append(NULL)
+            else:
+                encoded = encoder(value)
+                data.append(pack_length(len(encoded)))
+                data.append(encoded)
+    return b"".join(data)
+
+
+def iter_copy_data(rows, fields, connection, copy_format, chunk_size, counter):
+    """
+    Yields the COPY data of the rows in chunks of chunk_size rows. The number of
+    rows encoded is accumulated in counter[0].
+    """
+    if copy_format == "binary":
+        encoders = get_binary_encoders(fields, connection)
+        yield BINARY_HEADER
+    rows = iter(rows)
+    while True:
+        chunk = [
+            [
+                prepare_value(field, value, connection)
+                for field, value in zip(fields, row)
+            ]
+            for row in itertools.islice(rows, chunk_size)
+        ]
+        if not chunk:
+            break
+        counter[0] += len(chunk)
+        if copy_format == "binary":
+            yield encode_binary_rows(chunk, encoders)
+        else:
+            yield encode_csv_rows(chunk)
+    if copy_format == "binary":
+        yield BINARY_TRAILER
+
+
+class ChunkReader:
+    """
+    File-like object reading the chunks of an iterator, for psycopg2 copy_expert().
+    psycopg2 replaces the exceptions raised by read() with its own, the exception
+    raised by the iterator is kept in error.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b""
+        self._offset = 0
+        self.error = None
+
+    def read(self, size=-1):
+        while self._offset >= len(self._chunk):
+            try:
+                self._chunk = next(self._chunks, None)
+            except Exception as error:
+                self.error = error
+                raise
+            self._offset = 0
+            if self._chunk is None:
+                self._chunk = b""
+                return b""
+        if size is None or size < 0:
+            size = len(self._chunk) - self._offset
+        data = self._chunk[self._offset : self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+def get_copy_sql(connection, model, fields, copy_format):
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    return f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT {copy_format})"
+
+
+def copy_rows(connection, model, fields, rows, copy_format="csv", chunk_size=10000):
+    """
+    Inserts the rows, iterables of the values of fields, in the table of model
+    with COPY ... FROM STDIN. Returns the number of rows inserted.
+    """
+    if connection.vendor != "postgresql":
+        raise NotSupportedError(
+            f"copy_from() requires PostgreSQL, not {connection.vendor}."
+        )
+    if copy_format not in ("csv", "binary"):
+        raise ValueError(f'format must be "csv" or "binary", not {copy_format!r}.')
+
+    sql = get_copy_sql(connection, model, fields, copy_format)
+    counter = [0]
+    chunks = iter_copy_data(rows, fields, connection, copy_format, chunk_size, counter)
+
+    # The savepoint keeps the transaction usable if the rows cannot be copied
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, "copy"):
+            # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                for chunk in chunks:
+                    copy.write(chunk)
+        else:
+            reader = ChunkReader(chunks)
+            try:
+                raw_cursor.copy_expert(sql, reader)
+            except Exception:
+                if reader.error is not None:
+                    raise reader.error from None
+                raise
+    return counter[0]
@@ -0,0 +1,227 @@
+"""
+Detection of the queries which reach the database without a tenant predicate.
+
+On Citus, a query on a distributed table without a filter on its distribution
+column is sent to all the shards. TenantPredicateChecker is an execute wrapper
+which inspects the SQL of the statements, and reports the SELECT, UPDATE and
+DELETE statements on tables of tenant models none of which is filtered on its
+tenant column with "=", "= ANY(...)" or "IN (...)" values.
+
+Setting the tenant_predicate_check option of the database installs it on the
+connections of the backend:
+
+    "OPTIONS": {
+        "tenant_predicate_check": {
+            "sample_rate": 0.1,
+            "callback": "appname.monitoring.count_missing_tenant_predicate",
+        }
+    }
+
+It can also be installed for a block with connection.execute_wrapper().
+"""
+
+import hashlib
+import logging
+import random
+import re
+import sys
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from django_multitenant import registry
+from django_multitenant.exceptions import MissingTenantPredicate
+
+logger = logging.getLogger(__name__)
+
+CHECKED_STATEMENTS = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+# Tables of the FROM, JOIN and UPDATE clauses, with their alias
+TABLE_RE = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE)\s+"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE
+)
+SQL_KEYWORDS = frozenset(
+    (
+        "CROSS FULL GROUP HAVING INNER LEFT LIMIT NATURAL OFFSET ON ORDER RETURNING "
+        "RIGHT SET UNION USING WHERE WINDOW FOR EXCEPT INTERSECT"
+    ).split()
+)
+# A comparison of a column with values, which the column name is prepended to
+VALUE_PREDICATE = r'"?\s*(?:=\s*(?:ANY\s*\(|%s|\$\d|\'|-?\d)|IN\s*\(\s*(?!SELECT\b))'
+
+FINGERPRINT_RES = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%s|\$\d+|\b-?\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"ARRAY\[[^\]]*\]"), "?"),
+    (re.compile(r"\s+"), " "),
+)
+
+
+def get_fingerprint(sql):
+    """
+    Returns the SQL with the values replaced by "?", and a short hash of it which
+    identifies the statement whatever its values.
+    """
+    for pattern, replacement in FINGERPRINT_RES:
+        sql = pattern.sub(replacement, sql)
+    sql = sql.strip()
+    return sql, hashlib.md5(sql.encode()).hexdigest()[:16]
+
+
+def get_call_site():
+    """
+    Returns "file:line in function" of the innermost frame of the stack which is
+    not in Django or in this package, i.e. the code which ran the query.
+    """
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        internal = module.startswith(("django.", "django_multitenant.", "asgiref."))
+        # The test app of the package runs queries like an application
+        if not internal or module.startswith("django_multitenant.tests."):
+            code = frame.f_code
+            return f"{code.co_filename}:{frame.f_lineno} in {code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def get_tenant_tables(sql):
+    """
+    Returns the {db_table: (tenant column, names the table is referred to by)} of the
+    tenant model tables used by the statement.
+    """
+    tables = {}
+    for table, alias in TABLE_RE.findall(sql):
+        model = registry.get_model_by_db_table(table)
+        info = registry.register_model(model) if model is not None else None
+        if info is None:
+            continue
+        _, names = tables.setdefault(table, (info.tenant_field.column, {table}))
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            names.add(alias)
+    return tables
+
+
+def has_tenant_predicate(sql, tenant_column, names):
+    qualifiers = "|".join(re.escape(name) for name in names)
+    pattern = (
+        rf'(?<![\w."])(?:"?(?:{qualifiers})"?\.)?"?{re.escape(tenant_column)}'
+        + VALUE_PREDICATE
+    )
+    return re.search(pattern, sql, re.IGNORECASE) is not None
+
+
+class MissingTenantPredicateRecord:
+    """
+    A statement without tenant predicate.
+
+    - alias: alias of the database
+    - sql: the statement
+    - fingerprint: hash of the statement with its values replaced by "?"
+    - normalized_sql: the statement with its values replaced by "?"
+    - tables: the tables of tenant models used by the statement
+    - call_site: "file:line in function" of the code which ran it
+    """
+
+    __slots__ = ("alias", "sql", "fingerprint", "normalized_sql", "tables", "call_site")
+
+    def __init__(self, alias, sql, tables, call_site):
+        self.alias = alias
+        self.sql = sql
+        self.normalized_sql, self.fingerprint = get_fingerprint(sql)
+        self.tables = tables
+        self.call_site = call_site
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"<MissingTenantPredicateRecord: {self.fingerprint} at {self.call_site}>"
+
+
+class TenantPredicateChecker:
+    """
+    Execute wrapper reporting the statements without tenant predicate.
+
+    - sample_rate: share of the statements that are checked, between 0 and 1
+    - callback: callable, or its import path, called with the
+      MissingTenantPredicateRecord of every statement reported
+    - strict: raises MissingTenantPredicate instead of running the statement,
+      defaults to the TENANT_PREDICATE_CHECK_STRICT setting, read when a statement
+      is reported
+    - cache_size: number of statements whose result is remembered
+
+    checked and missing count the statements checked and reported.
+    """
+
+    def __init__(
+        self, alias=None, sample_rate=1.0, callback=None, strict=None, cache_size=1000
+    ):
+        self.alias = alias
+        self.sample_rate = sample_rate
+        if isinstance(callback, str):
+            callback = import_string(callback)
+        self.callback = callback
+        self.strict = strict
+        self.cache_size = cache_size
+        self.checked = 0
+        self.missing = 0
+        # Maps the statements to the tenant tables they use without predicate
+        self._results = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            self.check(sql, context["connection"].alias)
+        return execute(sql, params, many, context)
+
+    def get_missing_tables(self, sql):
+        """
+        Returns the tables of tenant models used by the statement if none of them
+        has a tenant predicate, or an empty list.
+        """
+        if not sql.lstrip()[:6].upper().startswith(CHECKED_STATEMENTS):
+            return []
+
+        tables = get_tenant_tables(sql)
+        if any(
+            has_tenant_predicate(sql, tenant_column, names)
+            for tenant_column, names in tables.values()
+        ):
+            return []
+        return sorted(tables)
+
+    def check(self, sql, alias=None):
+        if not isinstance(sql, str):
+            # psycopg sql.Composable
+            return
+        self.checked += 1
+
+        tables = self._results.get(sql)
+        if tables is None:
+            tables = self.get_missing_tables(sql)
+            if len(self._results) >= self.cache_size:
+                self._results.clear()
+            self._results[sql] = tables
+        if not tables:
+            return
+
+        self.missing += 1
+        record = MissingTenantPredicateRecord(
+            alias or self.alias, sql, tables, get_call_site()
+        )
+        logger.warning(
+            "Query on %s without tenant predicate (%s) at %s: %s",
+            ", ".join(tables),
+            record.fingerprint,
+            record.call_site,
+            record.normalized_sql,
+            extra={"tenant_predicate": record.as_dict()},
+        )
+        if self.callback is not None:
+            self.callback(record)
+        strict = self.strict
+        if strict is None:
+            strict = getattr(settings, "TENANT_PREDICATE_CHECK_STRICT", False)
+        if strict:
+            raise MissingTenantPredicate(record)
@@ -0,0 +1,229 @@
+"""
+Server-side prepared statements for the psycopg2 connections of the backend.
+
+The statements are prepared the first time their SQL is executed, and executed
+with EXECUTE afterwards, which skips the parsing and planning of the statement
+on the server. Since the tenant predicates are compiled to placeholders, the
+queries of all the tenants share the same prepared statements.
+"""
+
+import itertools
+import logging
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2 import errors
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR
+
+logger = logging.getLogger(__name__)
+
+PREPARABLE_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+# Statements after which the prepared statements are deallocated, as the
+# tables they use may have changed.
+DDL_STATEMENTS = ("CREATE", "ALTER", "DROP", "TRUNCATE")
+
+
+def get_statement_type(sql):
+    return sql.lstrip()[:8].split(None, 1)[0].upper() if sql.strip() else ""
+
+
+def to_positional_parameters(sql):
+    """
+    Converts the %s placeholders of sql to the $1, $2... parameters of PREPARE, and
+    the escaped %% to %. Returns the converted SQL and the number of parameters, or
+    (None, 0) if the SQL uses other placeholders.
+    """
+    parts = []
+    count = 0
+    start = 0
+    while True:
+        index = sql.find("%", start)
+        if index == -1:
+            parts.append(sql[start:])
+            break
+        parts.append(sql[start:index])
+        placeholder = sql[index + 1 : index + 2]
+        if placeholder == "s":
+            count += 1
+            parts.append(f"${count}")
+        elif placeholder == "%":
+            parts.append("%")
+        else:
+            return None, 0
+        start = index + 2
+    return "".join(parts), count
+
+
+class PreparedStatementCache:
+    """
+    Prepared statements of a connection, keyed by SQL text. Once size statements
+    are prepared, the least recently used one is deallocated to prepare a new one.
+
+    hits and misses count the executions of prepared statements and the statements
+    prepared. The SQL that cannot be prepared is remembered, so that it's not
+    prepared again. The statements which can no longer be executed are deallocated
+    before the next statement, once the transaction which failed is rolled back.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.statements = OrderedDict()
+        self.unpreparable = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._stale_names = []
+        self._names = (f"django_multitenant_{i}" for i in itertools.count(1))
+
+    def __len__(self):
+        return len(self.statements)
+
+    def execute(self, cursor, sql, params):
+        if self._stale_names:
+            self._deallocate_stale(cursor)
+
+        statement_type = get_statement_type(sql)
+        if (
+            params is None
+            or not isinstance(params, (list, tuple))
+            or statement_type not in PREPARABLE_STATEMENTS
+            # tuples are adapted to a list of values by psycopg2, e.g. for "IN %s"
+            or any(isinstance(param, tuple) for param in params)
+        ):
+            result = cursor.execute(sql, params)
+            if statement_type in DDL_STATEMENTS:
+                self.clear(cursor)
+            return result
+
+        name = self.statements.get(sql)
+        if name is not None:
+            self.statements.move_to_end(sql)
+            self.hits += 1
+            return self._execute_prepared(cursor, sql, name, params)
+
+        if sql in self.unpreparable:
+            return cursor.execute(sql, params)
+
+        name = self._prepare(cursor, sql, len(params))
+        if name is None:
+            return cursor.execute(sql, params)
+        return cursor.execute(self._execute_sql(name, len(params)), params)
+
+    def clear(self, cursor=None):
+        """
+        Forgets the prepared statements, and deallocates them if a cursor is given.
+        """
+        if cursor is not None and (self.statements or self._stale_names):
+            cursor.execute("DEALLOCATE ALL")
+        self.statements.clear()
+        self.unpreparable.clear()
+        self._stale_names.clear()
+
+    @staticmethod
+    def _execute_sql(name, param_count):
+        if not param_count:
+            return f"EXECUTE {name}"
+        return f"EXECUTE {name} ({', '.join(['%s'] * param_count)})"
+
+    @staticmethod
+    def _in_transaction(cursor):
+        connection = cursor.connection
+        return (
+            not connection.autocommit
+            or connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+        )
+
+    def _execute_prepared(self, cursor, sql, name, params):
+        try:
+            return cursor.execute(self._execute_sql(name, len(params)), params)
+        except (errors.InvalidSqlStatementName, errors.FeatureNotSupported) as error:
+            # The statement was deallocated by someone else, or the tables it uses were
+            # altered by another connection ("cached plan must not change result type"),
+            # in which case it still exists on the server and has to be deallocated.
+            del self.statements[sql]
+            if isinstance(error, errors.FeatureNotSupported):
+                self._stale_names.append(name)
+            if self._in_transaction(cursor):
+                raise
+            self._deallocate_stale(cursor)
+            return cursor.execute(sql, params)
+
+    def _deallocate_stale(self, cursor):
+        # Nothing can run in a failed transaction until it is rolled back
+        if cursor.connection.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+            return
+        while self._stale_names:
+            cursor.execute(f"DEALLOCATE {self._stale_names.pop()}")
+
+    def _prepare(self, cursor, sql, param_count):
+        prepare_sql, count = to_positional_parameters(sql)
+        if prepare_sql is None or count != param_count:
+            self._set_unpreparable(sql)
+            return None
+
+        name = next(self._names)
+        # A failed PREPARE aborts the current transaction, it's done in a savepoint.
+        # The prepared statements are not transactional, rolling back doesn't
+        # deallocate them.
+        in_transaction = self._in_transaction(cursor)
+        try:
+            if in_transaction:
+                cursor.execute("SAVEPOINT django_multitenant_prepare")
+            cursor.execute(f"PREPARE {name} AS {prepare_sql}")
+        except psycopg2.Error as error:
+            logger.debug("Could not prepare %s: %s", sql, error)
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT django_multitenant_prepare")
+                cursor.execute("RELEASE SAVEPOINT django_multitenant_prepare")
+            self._set_unpreparable(sql)
+            return None
+        if in_transaction:
+            cursor.execute("RELEASE SAVEPOINT django_multitenant_prepare")
+
+        self.misses += 1
+        self.statements[sql] = name
+        if len(self.statements) > self.size:
+            _, evicted_name = self.statements.popitem(last=False)
+            cursor.execute(f"DEALLOCATE {evicted_name}")
+        return name
+
+    def _set_unpreparable(self, sql):
+        self.unpreparable[sql] = True
+        if len(self.unpreparable) > self.size:
+            self.unpreparable.popitem(last=False)
+
+
+class PreparedStatementCursor:
+    """
+    Wraps a psycopg2 cursor to run the statements executed through it as prepared
+    statements.
+    """
+
+    def __init__(self, cursor, cache):
+        self.cursor = cursor
+        self.cache = cache
+        self._last_statement = None
+
+    @property
+    def query(self):
+        # The statement as it would have been sent without the prepared statements,
+        # rather than EXECUTE, for connection.queries and the logs.
+        if self._last_statement is None:
+            return self.cursor.query
+        sql, params = self._last_statement
+        return self.cursor.mogrify(sql, params)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cursor.close()
+
+    def execute(self, sql, params=None):
+        self._last_statement = (sql, params)
+        return self.cache.execute(self.cursor, sql, params)
@@ -1,16 +1,23 @@
 import operator
+from collections import Counter
+from contextlib import nullcontext
 from functools import reduce
 
 import django
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import CASCADE, DO_NOTHING, SET_NULL, Q, QuerySet, signals
+from django.db.models.deletion import get_candidate_relations_to_delete
 
-from .utils import get_current_tenant, get_tenant_filters
+from .fields import TenantForeignKey
+from .query import citus_modify_mode, scope_query
+from .registry import get_tenant_model_info
+from .utils import TenantRef, get_current_tenant_snapshot, tenant_context
 
 
 def related_objects(obj, *args):
     """
     Override of Collector.related_objects. Returns the filter for the related objects
-    Different from the original method, this method adds the tenant filters to the query.
+    Different from the original method, the query is scoped to the current tenant.
     CAUTION: When Collector.related_objects is changed, this method should be updated accordingly.
     """
     if django.VERSION < (3, 0) or len(args) == 2:
@@ -25,16 +32,198 @@ def related_objects(obj, *args):
         related_fields = args[1]
         objs = args[2]
 
-    filters = {}
     predicate = reduce(
         operator.or_,
         (Q(**{f"{related_field.name}__in": objs}) for related_field in related_fields),
     )
 
-    if get_current_tenant():
-        try:
-            filters = get_tenant_filters(related_model)
-        except ValueError:
-            pass
     # pylint: disable=protected-access
-    return related_model._base_manager.using(obj.using).filter(predicate, **filters)
+    queryset = related_model._base_manager.using(obj.using).filter(
+        predicate, **get_related_tenant_filters(related_model, related_fields, objs)
+    )
+    # The tenant filters are added when the query is compiled
+    scope_query(queryset.query)
+    return queryset
+
+
+def get_related_tenant_filters(related_model, related_fields, objs):
+    """
+    Returns the filters restricting the related objects to the tenants of objs when no
+    tenant is set and the related fields are TenantForeignKeys, i.e. the related objects
+    are in the tenants of objs. This keeps a tenant predicate in the SELECT, and in the
+    DELETE of the related objects that Django deletes without fetching them.
+    """
+    snapshot = get_current_tenant_snapshot()
+    if (
+        (snapshot is not None and snapshot.filter_value is not None)
+        or isinstance(objs, QuerySet)
+        or not all(isinstance(field, TenantForeignKey) for field in related_fields)
+    ):
+        return {}
+    info = get_tenant_model_info(related_model)
+    objs_info = get_tenant_model_info(objs[0])
+    if info is None or objs_info is None:
+        return {}
+
+    # The tenant column of objs is deferred when they were fetched by the collector
+    # with only(), it's not read then since it would be fetched for every object.
+    tenant_values = {obj.__dict__.get(objs_info.tenant_attname) for obj in objs}
+    if not tenant_values or None in tenant_values:
+        return {}
+    if len(tenant_values) == 1:
+        return {info.tenant_attname: tenant_values.pop()}
+    return {f"{info.tenant_attname}__in": list(tenant_values)}
+
+
+def get_cascade_models(model, path=()):
+    """
+    Returns the models whose rows are deleted or updated when rows of model are deleted,
+    if this can be done with DELETE and UPDATE statements only. Returns None if the
+    instances must be fetched: delete signals are received, a model inherits from
+    another one or has generic relations, an on_delete is not CASCADE, SET_NULL or
+    DO_NOTHING, or the cascades loop through several models.
+    """
+    opts = model._meta
+    if (
+        signals.pre_delete.has_listeners(model)
+        or signals.post_delete.has_listeners(model)
+        or opts.parents
+        or any(hasattr(field, "bulk_related_objects") for field in opts.private_fields)
+    ):
+        return None
+
+    path = path + (model,)
+    models = {model}
+    for related in get_candidate_relations_to_delete(opts):
+        on_delete = related.field.remote_field.on_delete
+        related_model = related.related_model
+        if on_delete is DO_NOTHING:
+            continue
+        if on_delete is SET_NULL:
+            models.add(related_model)
+        elif on_delete is not CASCADE or related_model in path[:-1]:
+            return None
+        elif related_model is not model:
+            related_models = get_cascade_models(related_model, path)
+            if related_models is None:
+                return None
+            models |= related_models
+    return models
+
+
+def delete_rows(queryset, using, deleted_counter, deleted_pks=None):
+    """
+    Deletes the rows of the queryset, without fetching them, after the rows they
+    cascade to, which are selected with "fk IN (subquery of the queryset)" filters.
+    deleted_pks is the set of the primary keys of the rows of the queryset and of the
+    rows of the same table being deleted with them, it is read when needed otherwise.
+    """
+    model = queryset.model
+    for related in get_candidate_relations_to_delete(model._meta):
+        field = related.field
+        on_delete = field.remote_field.on_delete
+        if on_delete is DO_NOTHING:
+            continue
+
+        # pylint: disable=protected-access
+        related_queryset = related.related_model._base_manager.using(using).filter(
+            **{f"{field.name}__in": queryset}
+        )
+        # The tenant filters are added when the query is compiled
+        scope_query(related_queryset.query)
+        if on_delete is SET_NULL:
+            related_queryset.update(**{field.name: None})
+        elif related.related_model is not model:
+            delete_rows(related_queryset, using, deleted_counter)
+        else:
+            # The rows referring to the deleted rows of the same table, and the rows
+            # referring to them, and so on, until there are none left. The rows already
+            # being deleted are skipped, so that the cyclic chains end.
+            if deleted_pks is None:
+                deleted_pks = set(queryset.values_list("pk", flat=True))
+            pks = set(related_queryset.values_list("pk", flat=True)) - deleted_pks
+            if pks:
+                deleted_pks = deleted_pks | pks
+                delete_rows(
+                    get_rows(model, using, pks), using, deleted_counter, deleted_pks
+                )
+
+    # pylint: disable=protected-access
+    count = queryset._raw_delete(using)
+    if count:
+        deleted_counter[model._meta.label] += count
+
+
+def get_rows(model, using, pks):
+    # pylint: disable=protected-access
+    queryset = model._base_manager.using(using).filter(pk__in=pks)
+    # The tenant filters are added when the query is compiled
+    scope_query(queryset.query)
+    return queryset
+
+
+def iter_pk_chunks(queryset, chunk_size):
+    """
+    Yields the lists of the primary keys of the rows of the queryset, chunk_size keys
+    each, in ascending order. Each chunk is read when the previous one has been
+    processed.
+    """
+    pks = queryset.order_by("pk").values_list("pk", flat=True)
+    lower = None
+    while True:
+        chunk = pks if lower is None else pks.filter(pk__gt=lower)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        lower = chunk[-1]
+
+
+def cascade_delete(queryset, chunk_size=1000):
+    """
+    Deletes the rows of the queryset and the rows they cascade to, like
+    queryset.delete(), without loading them in memory when no Python code has to run
+    on them (see get_cascade_models). Otherwise falls back to queryset.delete().
+
+    The rows are deleted by chunks of chunk_size primary keys, each one with a DELETE
+    statement per model of the cascade. When no tenant is set, the rows of the tenants
+    are deleted one tenant after the other, so that every statement is filtered on a
+    tenant and routed to a single shard by Citus.
+    Returns (number of rows deleted, {model label: number of rows deleted}).
+    """
+    model = queryset.model
+    models = get_cascade_models(model)
+    if models is None:
+        return queryset.delete()
+
+    queryset = queryset.order_by()
+    # As in QuerySet.delete(), the rows are selected from the database they're deleted from
+    # pylint: disable=protected-access
+    queryset._for_write = True
+    using = queryset.db
+    scope_query(queryset.query)
+    deleted_counter = Counter()
+
+    snapshot = get_current_tenant_snapshot()
+    info = get_tenant_model_info(model)
+    if info is not None and (snapshot is None or snapshot.filter_value is None):
+        tenant_field = info.tenant_field
+        tenant_model = tenant_field.related_model if tenant_field.is_relation else model
+        tenants = [
+            TenantRef(tenant_model, value)
+            for value in queryset.values_list(info.tenant_attname, flat=True).distinct()
+        ]
+    else:
+        tenants = [None]
+
+    with transaction.atomic(using=using), citus_modify_mode(using, models):
+        for tenant in tenants:
+            with tenant_context(tenant) if tenant is not None else nullcontext():
+                # The rows are deleted by their primary keys, read before the rows they
+                # cascade to are deleted, which the filters of the queryset may use.
+                for pks in iter_pk_chunks(queryset, chunk_size):
+                    delete_rows(
+                        get_rows(model, using, pks), using, deleted_counter, set(pks)
+                    )
+
+    return sum(deleted_counter.values()), dict(deleted_counter)
@@ -1,2 +1,16 @@
 class EmptyTenant(Exception):
     pass
+
+
+class MissingTenantPredicate(Exception):
+    """
+    Raised in strict mode by TenantPredicateChecker for the queries on tenant
+    tables without tenant predicate. record holds the details of the query.
+    """
+
+    def __init__(self, record):
+        super().__init__(
+            f"Query on {', '.join(record.tables)} without tenant predicate "
+            f"({record.fingerprint}) at {record.call_site}: {record.sql}"
+        )
+        self.record = record
@@ -5,7 +5,7 @@ from django.db.models.sql.where import WhereNode
 from django.conf import settings
 
 from .exceptions import EmptyTenant
-from .utils import get_current_tenant, get_tenant_column, get_tenant_filters
+from .utils import get_current_tenant_snapshot, get_tenant_field
 
 logger = logging.getLogger(__name__)
 
@@ -37,9 +37,9 @@ class TenantForeignKey(models.ForeignKey):
         JOIN and subquery conditions.
         """
 
-        current_tenant = get_current_tenant()
-        if current_tenant:
-            return get_tenant_filters(self.related_model)
+        snapshot = get_current_tenant_snapshot()
+        if snapshot is not None and snapshot.tenant:
+            return snapshot.get_filters(self.related_model)
 
         empty_tenant_message = (
             f"TenantForeignKey field {self.model.__name__}.{self.name} "
@@ -87,15 +87,9 @@ class TenantForeignKey(models.ForeignKey):
         if not (related_alias and alias):
             return None
 
-        # Fetch tenant column names for both sides of the relation
-        lhs_model = self.model
-        rhs_model = self.related_model
-        lhs_tenant_id = get_tenant_column(lhs_model)
-        rhs_tenant_id = get_tenant_column(rhs_model)
-
         # Fetch tenant fields for both sides of the relation
-        lhs_tenant_field = lhs_model._meta.get_field(lhs_tenant_id)
-        rhs_tenant_field = rhs_model._meta.get_field(rhs_tenant_id)
+        lhs_tenant_field = get_tenant_field(self.model)
+        rhs_tenant_field = get_tenant_field(self.related_model)
 
         # Get references to both tenant columns
         lookup_lhs = lhs_tenant_field.get_col(related_alias)
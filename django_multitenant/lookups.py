@@ -0,0 +1,48 @@
+from django.db.models import Field, ForeignObject, Lookup
+from django.db.models.fields.related_lookups import get_normalized_value
+
+
+@Field.register_lookup
+class Any(Lookup):
+    """
+    field__any=[...] lookup, compiled to "field = ANY(%s)" with the list bound as a single
+    array parameter. Unlike field__in, the SQL is the same whatever the length of the list.
+    Used for the tenant filters when TENANT_USE_ARRAY_PARAMETER is enabled.
+    """
+
+    lookup_name = "any"
+
+    def get_prep_lookup(self):
+        if hasattr(self.rhs, "resolve_expression"):
+            return self.rhs
+        output_field = self.lhs.output_field
+        return [output_field.get_prep_value(value) for value in self.rhs]
+
+    def get_db_prep_lookup(self, value, connection):
+        output_field = self.lhs.output_field
+        return (
+            "%s",
+            [
+                [
+                    output_field.get_db_prep_value(item, connection, prepared=True)
+                    for item in value
+                ]
+            ],
+        )
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs_sql} = ANY({rhs_sql})", [*lhs_params, *rhs_params]
+
+
+@ForeignObject.register_lookup
+class RelatedAny(Any):
+    """
+    any lookup of the foreign keys, which also accepts model instances.
+    """
+
+    def get_prep_lookup(self):
+        if not hasattr(self.rhs, "resolve_expression"):
+            self.rhs = [get_normalized_value(value, self.lhs)[0] for value in self.rhs]
+        return super().get_prep_lookup()
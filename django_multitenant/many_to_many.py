@@ -0,0 +1,249 @@
+"""
+Wrappers of the methods of the many to many managers, which set the tenant column of
+the rows of the through model and filter the queries on the tenant of the instance.
+They are installed by ``patches.install_patches()``.
+"""
+
+import functools
+
+from django.db import router, transaction
+from django.db.models import signals
+from django.db.models.utils import resolve_callables
+
+from .registry import get_tenant_model_info
+from .utils import (
+    get_current_tenant_snapshot,
+    get_current_tenant_value,
+    get_object_tenant,
+    get_tenant_column,
+    tenant_context,
+)
+
+
+# Methods of the many to many managers which run with the tenant of their instance as the
+# current tenant. add() is wrapped by wrap_many_related_manager_add() too.
+TENANT_SCOPED_MANY_RELATED_METHODS = (
+    "add",
+    "remove",
+    "clear",
+    "set",
+    "create",
+    "get_or_create",
+    "update_or_create",
+    "count",
+    "exists",
+)
+
+
+def get_many_related_tenant_value(manager, model):
+    """
+    Returns the tenant value of the instance of a many to many manager if the rows of model,
+    its through or target model, are in the tenant of the instance, or None.
+    """
+    instance_info = get_tenant_model_info(manager.instance)
+    if instance_info is None or not hasattr(model, "tenant_field"):
+        return None
+    info = get_tenant_model_info(model)
+    if info.tenant_model is not instance_info.tenant_model:
+        return None
+    return getattr(manager.instance, instance_info.tenant_attname)
+
+
+def get_through_defaults(manager, through_defaults):
+    """
+    Returns through_defaults with the tenant column of the through model set to the current
+    tenant.
+    """
+    snapshot = get_current_tenant_snapshot()
+    if (
+        hasattr(manager.through, "tenant_field")
+        and snapshot is not None
+        and snapshot.tenant
+    ):
+        through_defaults = through_defaults or {}
+        through_defaults[get_tenant_column(manager.through)] = (
+            get_current_tenant_value()
+        )
+    return through_defaults
+
+
+def wrap_many_related_manager_add(many_related_manager_add):
+    """
+    Wraps the add method of many to many field to set tenant_id in through_defaults
+    parameter of the add method.
+    """
+
+    @functools.wraps(many_related_manager_add)
+    def add(self, *objs, through_defaults=None):
+        return many_related_manager_add(
+            self, *objs, through_defaults=get_through_defaults(self, through_defaults)
+        )
+
+    return add
+
+
+def wrap_many_related_manager_method(many_related_manager_method):
+    """
+    Wraps a method of many to many field to run it with the tenant of the instance as the
+    current tenant, so that the queries on the through table are filtered on its tenant
+    column, e.g. the DELETE of remove() and clear(), when no tenant is set. The current
+    tenant, if any, is kept even if it's not the tenant of the instance.
+    """
+
+    @functools.wraps(many_related_manager_method)
+    def method(self, *args, **kwargs):
+        snapshot = get_current_tenant_snapshot()
+        if snapshot is not None and snapshot.filter_value is not None:
+            return many_related_manager_method(self, *args, **kwargs)
+        tenant_value = get_many_related_tenant_value(self, self.through)
+        if tenant_value is None:
+            return many_related_manager_method(self, *args, **kwargs)
+        with tenant_context(get_object_tenant(self.instance, fetch=False)):
+            return many_related_manager_method(self, *args, **kwargs)
+
+    return method
+
+
+def wrap_many_related_manager_apply_rel_filters(apply_rel_filters):
+    """
+    Wraps the _apply_rel_filters method of many to many field, which filters the querysets
+    of the related objects on the instance, to filter them on the tenant of the instance
+    too when no tenant is set. The tenant filters are added when the queries are compiled,
+    after the method returns.
+    """
+
+    @functools.wraps(apply_rel_filters)
+    def _apply_rel_filters(self, queryset):
+        queryset = apply_rel_filters(self, queryset)
+        snapshot = get_current_tenant_snapshot()
+        if snapshot is not None and snapshot.filter_value is not None:
+            return queryset
+        tenant_value = get_many_related_tenant_value(self, self.model)
+        if tenant_value is None:
+            return queryset
+        info = get_tenant_model_info(self.model)
+        return queryset.filter(**{info.tenant_attname: tenant_value})
+
+    return _apply_rel_filters
+
+
+def wrap_many_related_manager_set(many_related_manager_set, superclass):
+    """
+    Wraps the set method of many to many field to read the current related objects with a
+    single query on the through table, and to apply the difference with one DELETE and one
+    INSERT. Django's set() reads them with a join on the target table, and add() reads the
+    through table again to skip the objects already related.
+    The relations to self, and the relations whose target manager filters the objects, are
+    set by Django's set().
+    """
+
+    @functools.wraps(many_related_manager_set)
+    def set_related(self, objs, *, clear=False, through_defaults=None):
+        # pylint: disable=protected-access
+        if clear or self.symmetrical or superclass.get_queryset(self)._has_filters():
+            return many_related_manager_set(
+                self, objs, clear=clear, through_defaults=through_defaults
+            )
+
+        target_ids = self._get_target_ids(self.target_field_name, tuple(objs))
+        db = router.db_for_write(self.through, instance=self.instance)
+        with transaction.atomic(using=db, savepoint=False):
+            old_ids = set(
+                self.through._default_manager.using(db)
+                .filter(**{self.source_field_name: self.related_val[0]})
+                .values_list(self.target_field.attname, flat=True)
+            )
+            self._remove_prefetched_objects()
+            self._remove_items(
+                self.source_field_name, self.target_field_name, *(old_ids - target_ids)
+            )
+            add_missing_items(
+                self,
+                target_ids - old_ids,
+                db,
+                get_through_defaults(self, through_defaults),
+            )
+        return None
+
+    return set_related
+
+
+def add_missing_items(manager, target_ids, db, through_defaults):
+    """
+    Same as the _add_items method of many to many field, for target ids known not to be
+    related to the instance yet, which are not read from the through table again.
+    """
+    if not target_ids:
+        return
+    # pylint: disable=protected-access
+    can_ignore_conflicts, must_send_signals, _ = manager._get_add_plan(
+        db, manager.source_field_name
+    )
+    through_defaults = dict(resolve_callables(through_defaults or {}))
+
+    def send_signal(action):
+        signals.m2m_changed.send(
+            sender=manager.through,
+            action=action,
+            instance=manager.instance,
+            reverse=manager.reverse,
+            model=manager.model,
+            pk_set=target_ids,
+            using=db,
+        )
+
+    if must_send_signals:
+        send_signal("pre_add")
+    manager.through._default_manager.using(db).bulk_create(
+        [
+            manager.through(
+                **through_defaults,
+                **{
+                    f"{manager.source_field_name}_id": manager.related_val[0],
+                    f"{manager.target_field_name}_id": target_id,
+                },
+            )
+            for target_id in target_ids
+        ],
+        ignore_conflicts=can_ignore_conflicts,
+    )
+    if must_send_signals:
+        send_signal("post_add")
+
+
+def wrap_forward_many_to_many_manager(create_forward_many_to_many_manager_method):
+    """
+    Wraps the create_forward_many_to_many_manager method of the related_descriptors module
+    and changes the methods of the ManyRelatedManagerClass to set tenant_id in
+    through_defaults, and to filter the queries on the tenant of the instance.
+    """
+
+    def create_forward_many_to_many_manager_wrapper(superclass, rel, reverse):
+        ManyRelatedManagerClass = create_forward_many_to_many_manager_method(
+            superclass, rel, reverse
+        )
+        ManyRelatedManagerClass.add = wrap_many_related_manager_add(
+            ManyRelatedManagerClass.add
+        )
+        ManyRelatedManagerClass.set = wrap_many_related_manager_set(
+            ManyRelatedManagerClass.set, superclass
+        )
+        for name in TENANT_SCOPED_MANY_RELATED_METHODS:
+            setattr(
+                ManyRelatedManagerClass,
+                name,
+                wrap_many_related_manager_method(
+                    getattr(ManyRelatedManagerClass, name)
+                ),
+            )
+        # pylint: disable=protected-access
+        ManyRelatedManagerClass._apply_rel_filters = (
+            wrap_many_related_manager_apply_rel_filters(
+                ManyRelatedManagerClass._apply_rel_filters
+            )
+        )
+        return ManyRelatedManagerClass
+
+    # pylint: disable=protected-access
+    create_forward_many_to_many_manager_wrapper._sign = "add django-multitenant"
+    return create_forward_many_to_many_manager_wrapper
@@ -1,156 +1,269 @@
 import logging
 
-from django.db.models.sql import DeleteQuery, UpdateQuery
-from django.db.models.deletion import Collector
+import django
+from django.db import connections, models, transaction
 from django.db.utils import NotSupportedError
 from django.conf import settings
 
-import django
-from django.db.models.fields.related_descriptors import (
-    create_forward_many_to_many_manager,
-)
 
-
-from .deletion import related_objects
+from .backends.postgresql.copy import copy_rows
+from .deletion import cascade_delete
 from .exceptions import EmptyTenant
-from .query import wrap_get_compiler, wrap_update_batch, wrap_delete
+from .query import scope_query
+from .registry import get_tenant_model_info
 from .utils import (
-    set_current_tenant,
-    get_current_tenant,
+    get_current_tenant_snapshot,
     get_current_tenant_value,
-    get_tenant_field,
-    get_tenant_filters,
     get_object_tenant,
+    get_tenant_id,
     set_object_tenant,
-    get_tenant_column,
+    tenant_context,
 )
 
 
 logger = logging.getLogger(__name__)
 
 
-def wrap_many_related_manager_add(many_related_manager_add):
-    """
-    Wraps the add method of many to many field to set tenant_id in through_defaults
-    parameter of the add method.
-    """
-
-    def add(self, *objs, through_defaults=None):
-        if hasattr(self.through, "tenant_field") and get_current_tenant():
-            through_defaults = through_defaults or {}
-            through_defaults[get_tenant_column(self.through)] = (
-                get_current_tenant_value()
-            )
-        return many_related_manager_add(self, *objs, through_defaults=through_defaults)
-
-    return add
-
-
-def wrap_forward_many_to_many_manager(create_forward_many_to_many_manager_method):
-    """
-    Wraps the create_forward_many_to_many_manager method of the related_descriptors module
-    and changes the add method of the ManyRelatedManagerClass to set tenant_id in through_defaults
-    """
-
-    def create_forward_many_to_many_manager_wrapper(superclass, rel, reverse):
-        ManyRelatedManagerClass = create_forward_many_to_many_manager_method(
-            superclass, rel, reverse
-        )
-        ManyRelatedManagerClass.add = wrap_many_related_manager_add(
-            ManyRelatedManagerClass.add
-        )
-        return ManyRelatedManagerClass
-
-    # pylint: disable=protected-access
-    create_forward_many_to_many_manager_wrapper._sign = "add django-multitenant"
-    return create_forward_many_to_many_manager_wrapper
-
-
 class TenantManagerMixin:
     # Below is the manager related to the above class.
     # Overrides the get_queryset method of to inject tenant_id filters in the get_queryset.
     # With this method, models extended from TenantManagerMixin will have tenant_id filters by default
     # if the tenant_id is set in the current thread.
     def get_queryset(self):
-        # Injecting tenant_id filters in the get_queryset.
-        # Injects tenant_id filter on the current model for all the non-join/join queries.
+        # Marks the query to inject the tenant_id filters in it.
+        # The filter on the current model is added when the query is compiled, for all the
+        # non-join/join queries, so that getting the queryset doesn't clone it.
         queryset = self._queryset_class(self.model)
-        current_tenant = get_current_tenant()
-        if current_tenant:
-            kwargs = get_tenant_filters(self.model)
-            return queryset.filter(**kwargs)
+        scope_query(queryset.query)
         return queryset
 
     def bulk_create(self, objs, **kwargs):
         # Helper method to set tenant_id in the current thread for the results returned from query_set.
         # For example, if we have a query_set of all the users in the current tenant, we can set the tenant_id by calling
         # User.object.bulk_create(users)
-        if get_current_tenant():
+        snapshot = get_current_tenant_snapshot()
+        if snapshot is not None and snapshot.tenant:
             tenant_value = get_current_tenant_value()
             for obj in objs:
                 set_object_tenant(obj, tenant_value)
 
         return super().bulk_create(objs, **kwargs)
 
+    def bulk_update(self, objs, fields, batch_size=None):
+        # Partitions the objects by tenant, so that every UPDATE is filtered on the tenant
+        # column and routed to a single shard by Citus instead of all of them.
+        # batch_size applies to the objects of every tenant. Django 3.2 returns None
+        # instead of the number of rows updated.
+        info = get_tenant_model_info(self.model)
+        if any(field in info.tenant_attrs for field in fields):
+            raise NotSupportedError("Tenant column of a row cannot be updated.")
 
-class TenantModelMixin:
-    # Abstract model which all the models related to tenant inherit.
+        partitions = {}
+        for obj in objs:
+            partitions.setdefault(getattr(obj, info.tenant_attname), []).append(obj)
+
+        # The rows of the other tenants than the current ones would not be updated
+        snapshot = get_current_tenant_snapshot()
+        if snapshot is not None and snapshot.filter_value is not None:
+            tenant_values = snapshot.value if snapshot.is_multi else (snapshot.value,)
+            partitions = {
+                tenant_value: partition
+                for tenant_value, partition in partitions.items()
+                if tenant_value in tenant_values
+            }
+
+        # The tenant column of the tenants is their primary key, every row would be
+        # a partition of its own. Their UPDATEs are filtered on it already.
+        if info.is_tenant_model and partitions:
+            partitions = {
+                None: [obj for partition in partitions.values() for obj in partition]
+            }
+
+        rows_updated = 0
+        with transaction.atomic(using=self.db, savepoint=False):
+            for tenant_value, partition in partitions.items():
+                queryset = self.get_queryset()
+                if tenant_value is not None:
+                    queryset = queryset.filter(**{info.tenant_attname: tenant_value})
+                rows_updated += (
+                    queryset.bulk_update(partition, fields, batch_size=batch_size) or 0
+                )
+        if django.VERSION < (4, 0):
+            return None
+        return rows_updated
+
+    def bulk_upsert(self, objs, unique_fields, update_fields=None, batch_size=None):
+        # Inserts the objects, or updates the update_fields of the rows conflicting with
+        # them, with INSERT ... ON CONFLICT DO UPDATE ... RETURNING. The tenant column
+        # is always part of the conflict target, which has to be a unique constraint,
+        # and the objects are inserted by tenant, so that every statement is routed to
+        # a single shard by Citus. The primary keys are set from the rows returned.
+        # Requires Django 5.0 or later: bulk_create supports update_conflicts from 4.1,
+        # but only returns the primary keys of the rows from 5.0.
+        if django.VERSION < (5, 0):
+            raise NotSupportedError(
+                "bulk_upsert() and upsert() require Django 5.0 or later."
+            )
+        info = get_tenant_model_info(self.model)
+        unique_fields = list(unique_fields)
+        update_fields = list(update_fields or ())
+        if any(field in info.tenant_attrs for field in update_fields):
+            raise NotSupportedError("Tenant column of a row cannot be updated.")
+        if not any(field in info.tenant_attrs for field in unique_fields):
+            unique_fields.insert(0, info.tenant_field.name)
+        if not update_fields:
+            # ON CONFLICT DO UPDATE needs a column to set, a key column is set to its
+            # own value so that the conflicting rows are returned too. Django doesn't
+            # allow setting the primary key, the conflicts are then ignored, and the
+            # conflicting rows are not returned.
+            update_fields = [
+                field
+                for field in unique_fields
+                if field not in info.tenant_attrs
+                and not self.model._meta.get_field(field).primary_key
+            ][:1]
+        conflict_options = (
+            {
+                "update_conflicts": True,
+                "unique_fields": unique_fields,
+                "update_fields": update_fields,
+            }
+            if update_fields
+            else {"ignore_conflicts": True}
+        )
 
-    def __init__(self, *args, **kwargs):
-        # Adds tenant_id filters in the delete and update queries.
+        objs = list(objs)
+        tenant_value = get_current_tenant_value()
+        partitions = {}
+        for obj in objs:
+            set_object_tenant(obj, tenant_value)
+            partitions.setdefault(getattr(obj, info.tenant_attname), []).append(obj)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            for partition in partitions.values():
+                super().bulk_create(
+                    partition, batch_size=batch_size, **conflict_options
+                )
+        return objs
+
+    def bulk_delete(self, *args, chunk_size=1000, **kwargs):
+        # Deletes the rows matching the filters and the rows they cascade to, like
+        # filter().delete(), with DELETE ... WHERE fk IN (SELECT ...) statements which
+        # don't load the rows in memory, in chunks of chunk_size primary keys.
+        # Falls back to delete() when signals or on_delete handlers need the instances.
+        return cascade_delete(self.filter(*args, **kwargs), chunk_size=chunk_size)
+
+    def upsert(self, defaults=None, **kwargs):
+        # Single statement, race free, counterpart of update_or_create: inserts an object
+        # with the kwargs and defaults values, or updates the defaults values of the row
+        # of the current tenant matching kwargs, which must be a unique constraint along
+        # with the tenant column. Requires Django 5.0 or later, as bulk_upsert.
+        defaults = defaults or {}
+        obj = self.model(**kwargs, **defaults)
+        self.bulk_upsert([obj], unique_fields=kwargs, update_fields=defaults)
+        return obj
+
+    # pylint: disable=redefined-builtin
+    def copy_from(self, rows, fields=None, format="csv", chunk_size=10000):
+        # Inserts the rows with COPY ... FROM STDIN, which is much faster than the INSERT
+        # statements of bulk_create. rows are model instances, or tuples of the values of
+        # fields, which defaults to the concrete fields except the auto-incremented primary
+        # key. The rows are read and sent in chunks of chunk_size rows.
+        # As in bulk_create, the rows without tenant get the current tenant. The tenant
+        # column is appended to fields if it's not in it, the tuples then don't hold it.
+        # The primary keys of the instances are not set. Returns the number of rows.
+        opts = self.model._meta
+        if fields is None:
+            fields = [
+                field
+                for field in opts.concrete_fields
+                if field is not opts.auto_field
+                and not getattr(field, "generated", False)
+            ]
+        else:
+            fields = [opts.get_field(name) for name in fields]
 
-        # Below block decorates Delete operations related activities and adds tenant_id filters.
+        info = get_tenant_model_info(self.model)
+        tenant_value = get_current_tenant_value()
+        if isinstance(tenant_value, list):
+            # The tenant of the rows cannot be chosen among a list of tenants
+            tenant_value = None
+
+        tenant_index = None
+        if not info.is_tenant_model:
+            if info.tenant_field not in fields:
+                fields.append(info.tenant_field)
+            tenant_index = fields.index(info.tenant_field)
+
+        def get_values(row):
+            if isinstance(row, models.Model):
+                set_object_tenant(row, tenant_value)
+                values = [field.pre_save(row, True) for field in fields]
+            else:
+                values = list(row)
+                if len(values) == tenant_index:
+                    values.append(None)
+            if tenant_index is not None and values[tenant_index] is None:
+                if tenant_value is None:
+                    raise EmptyTenant(
+                        f"Attempting to copy a {opts.model_name} row without tenant "
+                        "and without a current tenant set."
+                    )
+                values[tenant_index] = tenant_value
+            return values
+
+        return copy_rows(
+            connections[self.db],
+            self.model,
+            fields,
+            map(get_values, rows),
+            copy_format=format,
+            chunk_size=chunk_size,
+        )
 
-        if not hasattr(DeleteQuery.get_compiler, "_sign"):
-            # Decorates the the compiler of DeleteQuery to add tenant_id filters.
-            DeleteQuery.get_compiler = wrap_get_compiler(DeleteQuery.get_compiler)
-            # Decorates related_objects to add tenant_id filters to add tenant_id filters.
-            # related_objects is being used to define additional records for deletion defined with relations
-            Collector.related_objects = related_objects
-            # Decorates the delete method of Collector to execute citus shard_modify_mode commands
-            # if distributed tables are being related to the model.
-            Collector.delete = wrap_delete(Collector.delete)
 
-        if not hasattr(create_forward_many_to_many_manager, "_sign"):
-            django.db.models.fields.related_descriptors.create_forward_many_to_many_manager = wrap_forward_many_to_many_manager(
-                create_forward_many_to_many_manager
-            )
+class TenantModelMixin:
+    # Abstract model which all the models related to tenant inherit.
 
-        # Decorates the update_batch method of UpdateQuery to add tenant_id filters.
-        if not hasattr(UpdateQuery.get_compiler, "_sign"):
-            UpdateQuery.update_batch = wrap_update_batch(UpdateQuery.update_batch)
+    def __init_subclass__(cls, **kwargs):
+        # The patches are installed by MultitenantConfig.ready(). This covers the projects
+        # which don't list django_multitenant in INSTALLED_APPS.
+        # pylint: disable=import-outside-toplevel
+        from .patches import install_patches
 
-        super().__init__(*args, **kwargs)
+        install_patches()
+        super().__init_subclass__(**kwargs)
 
     def __setattr__(self, attrname, val):
         # Provides failing of the save operation if the tenant_id is changed.
         # try_update_tenant is being checked inside save method and if it is true, it will raise an exception.
-        def is_val_equal_to_tenant(val):
-            return (
-                val
-                and self.tenant_value
-                and val != self.tenant_value
-                and val != self.tenant_object
-            )
-
+        # Django sets every column through this method while building instances from query rows,
+        # so the cheapest check, whether attrname is a tenant attribute, is done first.
         if (
-            attrname in (self.tenant_field, get_tenant_field(self).name)
+            attrname in get_tenant_model_info(self).tenant_attrs
             and not self._state.adding
-            and is_val_equal_to_tenant(val)
+            and self._is_tenant_change(val)
         ):
             self._try_update_tenant = True
 
         return super().__setattr__(attrname, val)
 
+    def _is_tenant_change(self, val):
+        # Compares ids only, so that neither the current nor the new tenant is loaded.
+        # A deferred tenant is not compared, reading it would load it, which sets it
+        # through __setattr__ again.
+        tenant_value = self.__dict__.get(get_tenant_model_info(self).tenant_attname)
+        return val and tenant_value and get_tenant_id(val) != tenant_value
+
     # pylint: disable=too-many-arguments
     def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
         # adding tenant filters for save
         # Citus requires tenant_id filters for update, hence doing this below change.
 
-        current_tenant = get_current_tenant()
+        snapshot = get_current_tenant_snapshot()
 
-        if current_tenant:
-            kwargs = get_tenant_filters(self.__class__)
+        if snapshot is not None and snapshot.tenant:
+            kwargs = snapshot.get_filters(self.__class__)
             base_qs = base_qs.filter(**kwargs)
         else:
             empty_tenant_message = (
@@ -176,43 +289,22 @@ class TenantModelMixin:
         if hasattr(self, "_try_update_tenant"):
             raise NotSupportedError("Tenant column of a row cannot be updated.")
 
-        current_tenant = get_current_tenant()
         tenant_value = get_current_tenant_value()
-
         set_object_tenant(self, tenant_value)
 
-        if self.tenant_value and tenant_value != self.tenant_value:
-            self_tenant = get_object_tenant(self)
-            set_current_tenant(self_tenant)
-
-        try:
-            obj = super().save(*args, **kwargs)
-        finally:
-            set_current_tenant(current_tenant)
+        # The object is saved in the current tenant as is when it is in it, which is the
+        # case of every object of a loop importing the rows of a tenant. Otherwise, its
+        # tenant is the current tenant for the duration of the save only.
+        self_tenant_value = self.tenant_value
+        if not self_tenant_value or self_tenant_value == tenant_value:
+            return super().save(*args, **kwargs)
 
-        return obj
+        with tenant_context(get_object_tenant(self, fetch=False)):
+            return super().save(*args, **kwargs)
 
     @property
     def tenant_field(self):
-        if hasattr(self, "TenantMeta") and "tenant_field_name" in dir(self.TenantMeta):
-            return self.TenantMeta.tenant_field_name
-        if hasattr(self, "TenantMeta") and "tenant_id" in dir(self.TenantMeta):
-            return self.TenantMeta.tenant_id
-        if hasattr(self, "tenant"):
-            raise AttributeError(
-                f"Tenant field exists which may cause collision with tenant_id field. Please rename the tenant field in {self.__class__.__name__} "
-            )
-        if hasattr(self, "tenant_id"):
-            return self.tenant_id
-        if self.__module__ == "__fake__":
-            raise AttributeError(
-                f"apps.get_model method should not be used to get the model {self.__class__.__name__}."
-                "Either import the model directly or use the module apps under the module django.apps."
-            )
-
-        raise AttributeError(
-            f"tenant_id field not found. Please add tenant_id field to the model {self.__class__.__name__}"
-        )
+        return get_tenant_model_info(self).tenant_column
 
     @property
     def tenant_value(self):
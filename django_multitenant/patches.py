@@ -0,0 +1,86 @@
+"""
+Patches of the Django internals which add the tenant filters to the queries
+when they are compiled, scope the deletion of the related objects, update the
+objects of a deletion by tenant, group the TenantPrefetch queries by tenant and
+scope the many to many managers to the tenant of their instance.
+
+The patches are installed once, from ``MultitenantConfig.ready()``, or when
+the first tenant model class is created if django_multitenant is not listed in
+INSTALLED_APPS. ``uninstall_patches()`` restores the original methods, which
+lets tests and benchmarks compare the patched and unpatched behaviors.
+"""
+
+from django.db.models import query as query_module
+from django.db.models.deletion import Collector
+from django.db.models.fields import related_descriptors
+from django.db.models.sql import Query, UpdateQuery
+
+from .deletion import related_objects
+from .many_to_many import wrap_forward_many_to_many_manager
+from .prefetch import wrap_prefetch_one_level
+from .query import wrap_get_compiler, wrap_delete, wrap_update_batch
+
+
+_MISSING = object()
+
+# (owner, name, original value) of every attribute replaced by install_patches.
+# The original value is _MISSING when the attribute was inherited.
+_originals = []
+
+
+def _patch(owner, name, value):
+    _originals.append((owner, name, vars(owner).get(name, _MISSING)))
+    setattr(owner, name, value)
+
+
+def patches_installed():
+    return bool(_originals)
+
+
+def install_patches():
+    """
+    Installs the patches. Does nothing if they are already installed.
+    """
+    if patches_installed():
+        return
+
+    # Decorates the compiler of all the queries to add tenant_id filters to the scoped ones.
+    _patch(Query, "get_compiler", wrap_get_compiler(Query.get_compiler))
+    # Decorates related_objects to scope the query of the related objects.
+    # related_objects is being used to define additional records for deletion defined with relations
+    _patch(Collector, "related_objects", related_objects)
+    # Decorates the delete method of Collector to execute citus shard_modify_mode commands
+    # if distributed tables are being related to the model.
+    _patch(Collector, "delete", wrap_delete(Collector.delete))
+    # Decorates update_batch to update the objects of a deletion, e.g. SET_NULL, by tenant
+    # with one statement per chunk of TENANT_UPDATE_BATCH_SIZE primary keys.
+    _patch(UpdateQuery, "update_batch", wrap_update_batch(UpdateQuery.update_batch))
+    # Decorates prefetch_one_level to group the queries of the TenantPrefetch lookups by tenant.
+    _patch(
+        query_module,
+        "prefetch_one_level",
+        wrap_prefetch_one_level(query_module.prefetch_one_level),
+    )
+    # Decorates the methods of the many to many managers to set tenant_id in through_defaults
+    # and to filter their queries on the tenant of their instance.
+    _patch(
+        related_descriptors,
+        "create_forward_many_to_many_manager",
+        wrap_forward_many_to_many_manager(
+            related_descriptors.create_forward_many_to_many_manager
+        ),
+    )
+
+
+def uninstall_patches():
+    """
+    Restores the original Django methods.
+    Many to many managers are created once per relation and cached, the ones
+    created while the patches were installed keep the tenant aware methods.
+    """
+    while _originals:
+        owner, name, original = _originals.pop()
+        if original is _MISSING:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, original)
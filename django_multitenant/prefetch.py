@@ -0,0 +1,123 @@
+"""
+Tenant aware prefetching.
+
+prefetch_related fetches the related objects of all the instances with a single
+fk__in=[...] query, which has no tenant filter unless a tenant is set. With
+TenantPrefetch, the instances are grouped by tenant and the related objects of
+every group are fetched by a query restricted to its tenant, so that each query
+is routed to a single shard, whether a tenant is set or not:
+
+    Account.objects.prefetch_related(TenantPrefetch("projects__tasks"))
+"""
+
+from django.db.models import Prefetch
+from django.db.models.manager import BaseManager
+
+from .registry import get_tenant_model_info
+
+
+class TenantPrefetch(Prefetch):
+    """
+    Prefetch whose queries, at every level of the lookup, are grouped by the
+    tenant of the instances and filtered on it.
+    """
+
+
+class TenantPrefetcher:
+    """
+    Wraps the prefetcher of a relation to restrict the queryset of the related
+    objects to a tenant. The queryset is filtered before it's passed to the
+    prefetcher, since some prefetchers evaluate it. Related objects whose tenants
+    are of another model than tenant_model are not filtered.
+    """
+
+    def __init__(self, prefetcher, tenant_value, tenant_model):
+        self.prefetcher = prefetcher
+        self.tenant_value = tenant_value
+        self.tenant_model = tenant_model
+
+    def __getattr__(self, name):
+        return getattr(self.prefetcher, name)
+
+    def get_default_queryset(self):
+        # The queryset the prefetcher uses when the lookup has none
+        if isinstance(self.prefetcher, BaseManager):
+            # The related managers use the queryset of the manager they extend, the
+            # first base of their class, which Django creates for every relation
+            manager_class = type(self.prefetcher).__bases__[0]
+            return manager_class.get_queryset(self.prefetcher)
+        return self.prefetcher.get_queryset()
+
+    def filter_queryset(self, queryset):
+        info = get_tenant_model_info(queryset.model)
+        if info is None or info.tenant_model is not self.tenant_model:
+            return queryset
+        return queryset.filter(**{info.tenant_attname: self.tenant_value})
+
+    def get_prefetch_querysets(self, instances, querysets=None):
+        if querysets is None:
+            querysets = [self.get_default_queryset()]
+        if not hasattr(self.prefetcher, "get_prefetch_querysets"):
+            return self.get_prefetch_queryset(instances, querysets[0])
+        return self.prefetcher.get_prefetch_querysets(
+            instances, [self.filter_queryset(queryset) for queryset in querysets]
+        )
+
+    def get_prefetch_queryset(self, instances, queryset=None):
+        # Django < 5.0
+        if queryset is None:
+            queryset = self.get_default_queryset()
+        return self.prefetcher.get_prefetch_queryset(
+            instances, self.filter_queryset(queryset)
+        )
+
+
+def group_by_tenant(instances):
+    """
+    Returns the {tenant value: instances} groups of a list of instances, or None
+    if they're not tenant model instances.
+    """
+    info = get_tenant_model_info(instances[0])
+    if info is None:
+        return None
+
+    groups = {}
+    for instance in instances:
+        groups.setdefault(getattr(instance, info.tenant_attname), []).append(instance)
+    return groups
+
+
+def wrap_prefetch_one_level(base_prefetch_one_level):
+    def prefetch_one_level(instances, prefetcher, lookup, level):
+        if not isinstance(lookup, TenantPrefetch) or not instances:
+            return base_prefetch_one_level(instances, prefetcher, lookup, level)
+
+        groups = group_by_tenant(instances)
+        if groups is None:
+            return base_prefetch_one_level(instances, prefetcher, lookup, level)
+        tenant_model = get_tenant_model_info(instances[0]).tenant_model
+
+        all_related_objects = []
+        additional_lookups = None
+        for tenant_value, group in groups.items():
+            # The generic foreign keys have no default queryset, their prefetcher
+            # fetches the related objects of every content type.
+            if tenant_value is not None and hasattr(prefetcher, "get_queryset"):
+                group_prefetcher = TenantPrefetcher(
+                    prefetcher, tenant_value, tenant_model
+                )
+            else:
+                group_prefetcher = prefetcher
+            related_objects, lookups = base_prefetch_one_level(
+                group, group_prefetcher, lookup, level
+            )
+            all_related_objects.extend(related_objects)
+            # The lookups found in the queryset of the related objects are the same
+            # for all the groups
+            if additional_lookups is None:
+                additional_lookups = lookups
+        return all_related_objects, additional_lookups
+
+    # pylint: disable=protected-access
+    prefetch_one_level._sign = "prefetch_one_level django-multitenant"
+    return prefetch_one_level
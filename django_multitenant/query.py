@@ -1,88 +1,441 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import django
 from django.db import connections, transaction
-from django.db.models import Q
-from django.db.models.sql.constants import (
-    GET_ITERATOR_CHUNK_SIZE,
-    NO_RESULTS,
-)
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact, In
+from django.db.models.sql import DeleteQuery, UpdateQuery
+from django.db.models.sql.constants import NO_RESULTS
+from django.db.models.sql.where import AND, WhereNode
 from django.conf import settings
-from django.db.models.sql.where import WhereNode
+from django.utils.module_loading import import_string
 
 
+from .lookups import Any
+from .registry import get_tenant_model_info
 from .utils import (
-    get_current_tenant,
-    get_tenant_filters,
+    get_current_tenant_snapshot,
+    set_current_tenant,
     is_distributed_model,
 )
 
 
+# Maps the models of the objects updated by the running deletion, e.g. by SET_NULL,
+# to {pk: tenant value} of these objects. Read by update_batch to update them by tenant.
+_field_update_tenants = ContextVar("field_update_tenants", default=None)
+
+
+def scope_query(query):
+    """
+    Marks the query to be scoped to the current tenant. The tenant predicate is added when
+    the query is compiled, using the tenant set at that time.
+    The mark is kept when the query is cloned, i.e. by the querysets chained from it.
+    """
+    query.tenant_scoped = True
+    return query
+
+
+def is_scoped_query(query):
+    # Update and delete queries are always scoped. Besides the querysets of the tenant
+    # managers, they're created by Model.save(), the deletion collector and batch updates.
+    return getattr(query, "tenant_scoped", False) or isinstance(
+        query, (DeleteQuery, UpdateQuery)
+    )
+
+
+def get_tenant_lookup_values(lookup):
+    """
+    Returns (alias, values) if the lookup restricts the tenant column of the table
+    aliased as alias to the set of values, i.e. is an exact, in or any lookup on the tenant
+    column with literal values. Returns None for any other condition.
+    """
+    if not (
+        isinstance(lookup, (Exact, In, Any))
+        and isinstance(lookup.lhs, Col)
+        and not hasattr(lookup.rhs, "resolve_expression")
+    ):
+        return None
+
+    target = lookup.lhs.target
+    try:
+        info = get_tenant_model_info(target.model)
+    except (AttributeError, ValueError):
+        return None
+    if info is None or target.column != info.tenant_column:
+        return None
+
+    try:
+        if isinstance(lookup, (In, Any)):
+            return lookup.lhs.alias, frozenset(lookup.rhs)
+        return lookup.lhs.alias, frozenset((lookup.rhs,))
+    except TypeError:
+        return None
+
+
+def normalize_tenant_predicates(where):
+    """
+    Finds the tenant conditions of the top level where clause.
+    Returns the tenant values every alias is restricted to, and the indexes of the
+    children which repeat a condition already found on the same alias.
+    """
+    restrictions = {}
+    duplicates = []
+    if where.connector != AND or where.negated:
+        return restrictions, duplicates
+
+    seen = set()
+    for index, child in enumerate(where.children):
+        alias_values = get_tenant_lookup_values(child)
+        if alias_values is None:
+            continue
+        if alias_values in seen:
+            duplicates.append(index)
+            continue
+        seen.add(alias_values)
+        alias, values = alias_values
+        restrictions[alias] = restrictions.get(alias, values) & values
+    return restrictions, duplicates
+
+
+def get_tenant_correlation(obj, info):
+    """
+    Returns the "inner.tenant_id = outer.tenant_id" condition correlating the tenant of
+    a subquery with the tenant of the outer query, or None if it's not needed.
+    The outer table is the first table of a model of the same tenants the top level where
+    clause of the subquery refers to, e.g. through OuterRef, unless the tenant columns are
+    already compared. The tables of the models of other tenants are not correlated.
+    """
+    if (
+        not obj.external_aliases
+        or obj.where.connector != AND
+        or obj.where.negated
+        or info.tenant_field.model._meta.db_table != obj.get_meta().db_table
+    ):
+        return None
+
+    outer_col = None
+    for child in obj.where.children:
+        for expression in (getattr(child, "lhs", None), getattr(child, "rhs", None)):
+            if not isinstance(expression, Col) or expression.alias in obj.alias_map:
+                continue
+            try:
+                outer_info = get_tenant_model_info(expression.target.model)
+            except (AttributeError, ValueError):
+                continue
+            if outer_info is None or outer_info.tenant_model is not info.tenant_model:
+                continue
+            col = outer_info.tenant_field.get_col(expression.alias)
+            if is_tenant_correlation(child, obj.base_table, info, col):
+                return None
+            if outer_col is None and (
+                outer_info.tenant_field.model._meta.db_table
+                == expression.target.model._meta.db_table
+            ):
+                outer_col = col
+
+    if outer_col is None:
+        return None
+    return Exact(info.tenant_field.get_col(obj.base_table), outer_col)
+
+
+def is_tenant_correlation(lookup, alias, info, outer_col):
+    # True if the lookup compares the tenant column of the table aliased as alias with
+    # the outer tenant column. The columns are compared by alias and name, the output
+    # fields of the columns of the foreign keys depend on how they're referred to.
+    if not (
+        isinstance(lookup, Exact)
+        and isinstance(lookup.lhs, Col)
+        and isinstance(lookup.rhs, Col)
+    ):
+        return False
+    columns = {
+        (lookup.lhs.alias, lookup.lhs.target.column),
+        (lookup.rhs.alias, lookup.rhs.target.column),
+    }
+    return columns == {
+        (alias, info.tenant_field.column),
+        (outer_col.alias, outer_col.target.column),
+    }
+
+
 def add_tenant_filters_on_query(obj):
-    current_tenant = get_current_tenant()
+    """
+    Returns a clone of the query with the current tenant predicate added to its where
+    clause and the repeated tenant conditions removed. The subqueries which refer to a
+    tenant model of the outer query are correlated with its tenant. Returns the query
+    itself if there is nothing to change: it's not scoped or no tenant is set, it's not
+    a correlated subquery, and the tenant conditions it holds are not repeated.
+    """
+    if obj.model is None or obj.combinator:
+        return obj
 
-    if current_tenant:
-        try:
-            filters = get_tenant_filters(obj.model)
-            obj.add_q(Q(**filters))
-        except ValueError:
-            pass
+    try:
+        info = get_tenant_model_info(obj.model)
+    except (AttributeError, ValueError):
+        return obj
+    if info is None:
+        return obj
+
+    restrictions, duplicates = normalize_tenant_predicates(obj.where)
+
+    snapshot = get_current_tenant_snapshot()
+    add_predicate = (
+        snapshot is not None
+        and snapshot.filter_value is not None
+        and is_scoped_query(obj)
+    )
+    if add_predicate and obj.alias_map:
+        # The predicate is redundant if the base table is already restricted to
+        # some of the current tenant values.
+        tenant_values = frozenset(
+            snapshot.filter_value if snapshot.is_multi else (snapshot.filter_value,)
+        )
+        restriction = restrictions.get(obj.base_table)
+        add_predicate = restriction is None or not restriction <= tenant_values
+
+    correlation = get_tenant_correlation(obj, info) if obj.alias_map else None
+
+    if not (add_predicate or duplicates or correlation):
+        return obj
+
+    query = obj.clone()
+    if duplicates:
+        query.where.children = [
+            child
+            for index, child in enumerate(query.where.children)
+            if index not in duplicates
+        ]
+    if correlation is not None:
+        query.where.children.append(correlation)
+    if not add_predicate:
+        return query
+
+    # The tenant column of a model inheriting it from a parent model is in the table of
+    # the parent, which is joined if it isn't yet.
+    alias = query.join_parent_model(
+        query.get_meta(), info.tenant_field.model, query.get_initial_alias(), {}
+    )
+    col = info.tenant_field.get_col(alias)
+    if snapshot.is_multi:
+        lookup_class = Any if snapshot.filter_suffix == "__any" else In
+        lookup = lookup_class(col, list(snapshot.filter_value))
+    else:
+        lookup = Exact(col, snapshot.filter_value)
+
+    # The tenant predicate comes first, as it did when it was added by the managers
+    if query.where.connector == AND and not query.where.negated:
+        query.where.children.insert(0, lookup)
+    else:
+        query.where = WhereNode([lookup, query.where], AND)
+    return query
 
 
 def wrap_get_compiler(base_get_compiler):
-    # Adds tenant filters to the query object
+    # Adds the tenant filters to the query when it is compiled. This is the single place
+    # where the predicate is added to select, update, delete and aggregate queries.
     def get_compiler(obj, *args, **kwargs):
-        add_tenant_filters_on_query(obj)
-        return base_get_compiler(obj, *args, **kwargs)
+        return base_get_compiler(add_tenant_filters_on_query(obj), *args, **kwargs)
 
     # pylint: disable=protected-access
     get_compiler._sign = "get_compiler django-multitenant"
     return get_compiler
 
 
-# pylint: disable=unused-argument
+def is_updated_by_tenant(using):
+    # update_batch updates the objects by tenant on PostgreSQL, unless a single tenant is
+    # set, in which case the tenant predicate is added to the UPDATE when it's compiled.
+    snapshot = get_current_tenant_snapshot()
+    return (
+        (3, 2) <= django.VERSION < (6, 0)
+        and connections[using].vendor == "postgresql"
+        and (snapshot is None or snapshot.filter_value is None or snapshot.is_multi)
+    )
+
+
+def get_field_update_tenants(collector):
+    """
+    Returns {model: {pk: tenant value}} of the instances of tenant models whose fields
+    are updated by the collector, when they're updated by tenant.
+    The instances fetched by the collector have their tenant column deferred, reading it
+    would fetch it for every instance, the missing values are fetched by one query per
+    model instead. Starting Django 4.2, the related objects are not fetched but updated
+    by a single queryset UPDATE, which has the tenant filters added by related_objects.
+    """
+    if not is_updated_by_tenant(collector.using):
+        return {}
+
+    if django.VERSION >= (4, 2):
+        # field_updates maps (field, value) to lists of instances or querysets
+        instance_lists = [
+            instances
+            for instances_list in collector.field_updates.values()
+            for instances in instances_list
+            # pylint: disable=protected-access
+            if not isinstance(instances, QuerySet)
+            or instances._result_cache is not None
+        ]
+    else:
+        # field_updates maps the models to {(field, value): instances}
+        instance_lists = [
+            instances
+            for updates in collector.field_updates.values()
+            for instances in updates.values()
+        ]
+
+    tenants = {}
+    deferred_pks = {}
+    for instances in instance_lists:
+        for instance in instances:
+            info = get_tenant_model_info(instance)
+            if info is None:
+                continue
+            model = type(instance)
+            if info.tenant_attname in instance.__dict__:
+                model_tenants = tenants.setdefault(model, {})
+                model_tenants[instance.pk] = instance.__dict__[info.tenant_attname]
+            else:
+                deferred_pks.setdefault(model, []).append(instance.pk)
+
+    for model, pks in deferred_pks.items():
+        # pylint: disable=protected-access
+        tenants.setdefault(model, {}).update(
+            model._base_manager.using(collector.using)
+            .filter(pk__any=pks)
+            .values_list("pk", get_tenant_model_info(model).tenant_attname)
+        )
+    return tenants
+
+
 def wrap_update_batch(base_update_batch):
-    # Written to decorate the update_batch method of the UpdateQuery class to add tenant_id filters.
-    # Since add tenant_filters method must be executed before the execute_sql method, we have to
-    # copy and rewrite the update_batch method.
-    # CAUTION: Since source is copied, UpdateQuery.update_batch method should be tracked
+    # Django's update_batch runs one UPDATE per chunk of 100 primary keys. On PostgreSQL,
+    # the primary keys are bound as a single array, "pk = ANY(%s)", in chunks of
+    # TENANT_UPDATE_BATCH_SIZE, and the objects updated by a deletion are updated by
+    # tenant, so that every UPDATE is routed to a single shard by Citus.
+    # The replacement is limited to the versions of Django whose update_batch it was
+    # checked against, the others run their own.
     def update_batch(obj, pk_list, values, using):
+        if (
+            not (3, 2) <= django.VERSION < (6, 0)
+            or connections[using].vendor != "postgresql"
+        ):
+            return base_update_batch(obj, pk_list, values, using)
+
+        info = get_tenant_model_info(obj.model)
+        tenants = (_field_update_tenants.get() or {}).get(obj.model)
+        partitions = {}
+        if info is not None and tenants and is_updated_by_tenant(using):
+            for pk in pk_list:
+                partitions.setdefault(tenants.get(pk), []).append(pk)
+        else:
+            partitions[None] = pk_list
+
+        batch_size = getattr(settings, "TENANT_UPDATE_BATCH_SIZE", 10000)
         obj.add_update_values(values)
-        for offset in range(0, len(pk_list), GET_ITERATOR_CHUNK_SIZE):
-            obj.where = WhereNode()
-            obj.add_q(Q(pk__in=pk_list[offset : offset + GET_ITERATOR_CHUNK_SIZE]))
-            add_tenant_filters_on_query(obj)
-            obj.get_compiler(using).execute_sql(NO_RESULTS)
+        for tenant_value, pks in partitions.items():
+            for offset in range(0, len(pks), batch_size):
+                filters = {"pk__any": pks[offset : offset + batch_size]}
+                if tenant_value is not None:
+                    filters[info.tenant_attname] = tenant_value
+                obj.where = WhereNode()
+                obj.add_q(Q(**filters))
+                obj.get_compiler(using).execute_sql(NO_RESULTS)
+        return None
 
     # pylint: disable=protected-access
     update_batch._sign = "update_batch django-multitenant"
     return update_batch
 
 
-def wrap_delete(base_delete):
-    def delete(obj):
-        obj_are_distributed = [
-            is_distributed_model(instance) for instance in obj.data.keys()
-        ]
+# Maps the sets of models deleted together to whether they mix distributed and
+# reference tables. The models of a deletion are the same from one call to another.
+_mixed_model_sets = {}
 
-        # If all elements are from distributed tables, then we can do a simple atomic transaction.
-        # If there are mixes of distributed and reference tables, it would raise the following error :
 
-        # django.db.utils.InternalError: cannot execute DML on reference relation
-        # "table" because there was a parallel DML access to distributed relation
-        # "table2" in the same transaction
+def is_mixed_model_set(models):
+    models = frozenset(models)
+    try:
+        return _mixed_model_sets[models]
+    except KeyError:
+        mixed = len({is_distributed_model(model) for model in models}) > 1
+        _mixed_model_sets[models] = mixed
+        return mixed
 
-        if len(set(obj_are_distributed)) > 1 and getattr(
-            settings, "CITUS_EXTENSION_INSTALLED", False
-        ):
-            # all elements are not the same, some False, some True
-            with transaction.atomic(using=obj.using, savepoint=False):
-                connections[obj.using].cursor().execute(
-                    "SET LOCAL citus.multi_shard_modify_mode TO 'sequential';"
-                )
+
+def get_sequential_mode_callback():
+    callback = getattr(settings, "TENANT_SEQUENTIAL_MODE_CALLBACK", None)
+    if isinstance(callback, str):
+        callback = import_string(callback)
+    return callback
+
+
+@contextmanager
+def citus_modify_mode(using, models):
+    """
+    Runs the block in a transaction in the sequential multi-shard modify mode of Citus
+    if the models mix distributed and reference tables.
+    TENANT_SEQUENTIAL_MODE_CALLBACK, a callable or its import path, is called with using
+    and models every time the sequential mode is used.
+    """
+    # If all elements are from distributed tables, then we can do a simple atomic transaction.
+    # If there are mixes of distributed and reference tables, it would raise the following error :
+
+    # django.db.utils.InternalError: cannot execute DML on reference relation
+    # "table" because there was a parallel DML access to distributed relation
+    # "table2" in the same transaction
+
+    # The databases of the other aliases may be plain databases, e.g. when the
+    # tenants are spread over several databases by TenantDatabaseRouter.
+    connection = connections[using]
+    if not (
+        getattr(settings, "CITUS_EXTENSION_INSTALLED", False)
+        and connection.vendor == "postgresql"
+        and is_mixed_model_set(models)
+    ):
+        yield
+        return
+
+    callback = get_sequential_mode_callback()
+    if callback is not None:
+        callback(using, models)
+
+    # SET LOCAL lasts until the end of the transaction. The mode of a transaction
+    # started here doesn't need to be set back, the one of an outer transaction is.
+    outer_transaction = connection.in_atomic_block
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL citus.multi_shard_modify_mode TO 'sequential';")
+            yield
+            if outer_transaction:
+                cursor.execute("SET LOCAL citus.multi_shard_modify_mode TO 'parallel';")
+
+
+def wrap_delete(base_delete):
+    def delete(obj):
+        # The values of the current tenant are read once when it is set. If the
+        # tenant itself is deleted, they are read again after the deletion.
+        snapshot = get_current_tenant_snapshot()
+        deletes_current_tenant = (
+            snapshot is not None
+            and not snapshot.is_multi
+            and any(
+                instance is snapshot.tenant
+                for instance in obj.data.get(snapshot.tenant.__class__, ())
+            )
+        )
+
+        token = _field_update_tenants.set(get_field_update_tenants(obj))
+        try:
+            with citus_modify_mode(obj.using, obj.data.keys()):
                 result = base_delete(obj)
-                connections[obj.using].cursor().execute(
-                    "SET LOCAL citus.multi_shard_modify_mode TO 'parallel';"
-                )
-                return result
+        finally:
+            _field_update_tenants.reset(token)
 
-        return base_delete(obj)
+        if deletes_current_tenant:
+            set_current_tenant(snapshot.tenant)
+        return result
 
+    # pylint: disable=protected-access
+    delete._sign = "delete django-multitenant"
     return delete
@@ -0,0 +1,188 @@
+"""
+Registry of the tenant metadata of every model.
+
+Resolving the tenant column of a model requires inspecting its TenantMeta
+class, its class attributes and its fields. Since these never change once the
+model class is created, the result is computed once per model and cached here,
+so that the query-time code paths only perform a dictionary lookup.
+
+The registry is populated for all installed models in
+``MultitenantConfig.ready()``. Models that are not known at that time (models
+created dynamically, or projects that don't list django_multitenant in
+INSTALLED_APPS) are resolved lazily on first access.
+"""
+
+import weakref
+
+from django.apps import apps
+
+
+class TenantModelInfo:
+    """
+    Tenant metadata of a model.
+
+    - model: the model class
+    - tenant_column: name of the tenant attribute, as set in TenantMeta or tenant_id
+    - tenant_field: the field object whose column is the tenant column
+    - tenant_attname: attname of the tenant field
+    - is_tenant_model: True if the model is the tenant itself, i.e. the tenant
+      column is its primary key
+    - tenant_attrs: attribute names that hold the tenant of an instance
+    """
+
+    __slots__ = (
+        "model",
+        "tenant_column",
+        "tenant_field",
+        "tenant_attname",
+        "is_tenant_model",
+        "tenant_attrs",
+    )
+
+    def __init__(self, model, tenant_column, tenant_field):
+        self.model = model
+        self.tenant_column = tenant_column
+        self.tenant_field = tenant_field
+        self.tenant_attname = tenant_field.attname
+        self.is_tenant_model = tenant_field.primary_key
+        self.tenant_attrs = frozenset((tenant_column, tenant_field.name))
+
+    @property
+    def tenant_model(self):
+        """
+        The model of the tenants: the model the tenant field refers to, or the model
+        itself if it is the tenant.
+        """
+        if self.tenant_field.is_relation:
+            return self.tenant_field.related_model
+        return self.model
+
+    def __repr__(self):
+        return f"<TenantModelInfo: {self.model.__name__}.{self.tenant_column}>"
+
+
+# Maps model classes to their TenantModelInfo, or to None for models that are
+# not tenant models.
+_registry = {}
+
+# Maps app registries (the global one, or the historical ones used by the
+# migrations) to a (models, {db_table: model}) pair. models is the list returned
+# by the app registry when the index was built, it is used to detect changes.
+_db_table_indexes = weakref.WeakKeyDictionary()
+
+
+def resolve_tenant_column(model):
+    """
+    Computes the tenant column of a model class from its TenantMeta or
+    tenant_id attributes. Raises AttributeError if it cannot be found.
+    """
+    tenant_meta = getattr(model, "TenantMeta", None)
+    if tenant_meta is not None and hasattr(tenant_meta, "tenant_field_name"):
+        return tenant_meta.tenant_field_name
+    if tenant_meta is not None and hasattr(tenant_meta, "tenant_id"):
+        return tenant_meta.tenant_id
+    if hasattr(model, "tenant"):
+        raise AttributeError(
+            f"Tenant field exists which may cause collision with tenant_id field. Please rename the tenant field in {model.__name__} "
+        )
+    tenant_id = getattr(model, "tenant_id", None)
+    if isinstance(tenant_id, str):
+        return tenant_id
+    if model.__module__ == "__fake__":
+        raise AttributeError(
+            f"apps.get_model method should not be used to get the model {model.__name__}."
+            "Either import the model directly or use the module apps under the module django.apps."
+        )
+
+    raise AttributeError(
+        f"tenant_id field not found. Please add tenant_id field to the model {model.__name__}"
+    )
+
+
+def _build_info(model):
+    if not hasattr(model, "tenant_field"):
+        return None
+
+    tenant_column = resolve_tenant_column(model)
+    try:
+        tenant_field = next(
+            field for field in model._meta.fields if field.column == tenant_column
+        )
+    except StopIteration as no_field_found:
+        raise ValueError(
+            f'No field found in {model.__name__} with column name "{tenant_column}"'
+        ) from no_field_found
+
+    return TenantModelInfo(model, tenant_column, tenant_field)
+
+
+def get_tenant_model_info(model_class_or_instance):
+    """
+    Returns the TenantModelInfo of a model class or instance, or None if the
+    model is not a tenant model.
+    Raises AttributeError or ValueError if the model is a tenant model whose
+    tenant column cannot be resolved.
+    """
+    model = (
+        model_class_or_instance
+        if isinstance(model_class_or_instance, type)
+        else type(model_class_or_instance)
+    )
+    try:
+        return _registry[model]
+    except KeyError:
+        pass
+
+    info = _build_info(model)
+    _registry[model] = info
+    return info
+
+
+def register_model(model):
+    """
+    Computes and stores the tenant metadata of the model.
+    Models whose tenant column cannot be resolved are skipped, the error will
+    be raised when they are used.
+    """
+    try:
+        return get_tenant_model_info(model)
+    except (AttributeError, ValueError):
+        return None
+
+
+def populate(app_registry=None):
+    """
+    Registers all the models of the app registry. Called once at startup from
+    MultitenantConfig.ready().
+    """
+    app_registry = app_registry or apps
+    for model in app_registry.get_models(include_auto_created=True):
+        register_model(model)
+
+
+def get_model_by_db_table(db_table, app_registry=None):
+    """
+    Returns the model of the app registry using the given db_table, or None.
+
+    The index is rebuilt whenever the app registry changes. App registries
+    cache the result of get_models() until a model is registered or
+    unregistered, so comparing that result with the one the index was built
+    from is enough to detect changes.
+    """
+    app_registry = app_registry or apps
+    models = app_registry.get_models()
+
+    index_entry = _db_table_indexes.get(app_registry)
+    if index_entry is None or index_entry[0] is not models:
+        index = {}
+        for model in models:
+            index.setdefault(model._meta.db_table, model)
+        index_entry = (models, index)
+        _db_table_indexes[app_registry] = index_entry
+
+    return index_entry[1].get(db_table)
+
+
+def clear():
+    _registry.clear()
+    _db_table_indexes.clear()
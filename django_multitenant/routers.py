@@ -0,0 +1,144 @@
+"""
+Database router spreading the tenants over several databases.
+
+Every tenant is placed in one of the DATABASES aliases by a placement, which
+maps tenant values to aliases. The reads and writes of the tenant models are
+routed to the database of the current tenant, or of the instance they're done
+on. Projects subclass TenantDatabaseRouter to set its placement:
+
+    class ShardRouter(TenantDatabaseRouter):
+        placement = HashRingPlacement(["shard1", "shard2", "shard3"])
+
+and add it to DATABASE_ROUTERS:
+
+    DATABASE_ROUTERS = ["appname.routers.ShardRouter"]
+"""
+
+import bisect
+import hashlib
+
+from .registry import get_tenant_model_info
+from .utils import get_current_tenant_snapshot
+
+
+class HashRingPlacement:
+    """
+    Places the tenants on a consistent hash ring of the aliases. Adding an alias
+    only moves the tenants placed on the part of the ring it takes over.
+    """
+
+    def __init__(self, aliases, replicas=100):
+        ring = sorted(
+            (self._hash(f"{alias}-{replica}"), alias)
+            for alias in aliases
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in ring]
+        self._aliases = [alias for _, alias in ring]
+
+    @staticmethod
+    def _hash(key):
+        # hash() is randomized per process, the placement must be the same in all of them
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def get_alias(self, tenant_value):
+        index = bisect.bisect(self._hashes, self._hash(str(tenant_value)))
+        return self._aliases[index % len(self._aliases)]
+
+
+class ExplicitPlacement:
+    """
+    Places the tenants as listed in a {tenant value: alias} mapping. The tenants
+    which are not listed are placed in default, None lets Django pick the database.
+    """
+
+    def __init__(self, placements, default=None):
+        self.placements = placements
+        self.default = default
+
+    def get_alias(self, tenant_value):
+        return self.placements.get(tenant_value, self.default)
+
+
+class TenantDatabaseRouter:
+    """
+    Routes the queries of the tenant models to the database of their tenant.
+
+    - placement: maps tenant values to database aliases
+    - route_reference_models: if True, the models which are not tenant models
+      are routed to the database of the current tenant too, when they are
+      replicated in all the databases.
+    """
+
+    placement = None
+    route_reference_models = False
+
+    def get_placement(self):
+        if self.placement is None:
+            raise ValueError(
+                f"{self.__class__.__name__}.placement must be set to place the tenants "
+                "in the databases."
+            )
+        return self.placement
+
+    def get_instance_alias(self, instance):
+        """
+        Returns the alias of the tenant of a model instance, or None if it has none.
+        """
+        info = get_tenant_model_info(instance)
+        if info is None:
+            return None
+        tenant_value = getattr(instance, info.tenant_attname)
+        if tenant_value is None:
+            return None
+        return self.get_placement().get_alias(tenant_value)
+
+    def get_current_alias(self):
+        """
+        Returns the alias of the current tenant, or None if no tenant is set.
+        A list of tenants must be placed in a single database.
+        """
+        snapshot = get_current_tenant_snapshot()
+        if snapshot is None or snapshot.filter_value is None:
+            return None
+
+        placement = self.get_placement()
+        if not snapshot.is_multi:
+            return placement.get_alias(snapshot.value)
+
+        aliases = {placement.get_alias(value) for value in snapshot.value}
+        if len(aliases) > 1:
+            raise ValueError(
+                f"The current tenants are placed in several databases: {sorted(aliases)}"
+            )
+        return aliases.pop()
+
+    def _get_alias(self, model, hints):
+        if get_tenant_model_info(model) is None and not self.route_reference_models:
+            return None
+
+        instance = hints.get("instance")
+        if instance is not None:
+            alias = self.get_instance_alias(instance)
+            if alias is not None:
+                return alias
+        return self.get_current_alias()
+
+    def db_for_read(self, model, **hints):
+        return self._get_alias(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._get_alias(model, hints)
+
+    def allow_relation(self, obj1, obj2, **_hints):
+        # Rejects the relations which would have to join tables of two databases.
+        # _state.db, the database an instance was read from or saved to, is how Django
+        # itself tells the database of an instance, there is no public accessor.
+        # pylint: disable=protected-access
+        aliases = {
+            obj._state.db or self.get_instance_alias(obj) for obj in (obj1, obj2)
+        }
+        aliases.discard(None)
+        if len(aliases) > 1:
+            return False
+        return None
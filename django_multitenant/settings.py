@@ -7,3 +7,4 @@ TENANT_MODEL_NAME = getattr(settings, "TENANT_MODEL_NAME", None)
 CITUS_EXTENSION_INSTALLED = getattr(settings, "CITUS_EXTENSION_INSTALLED", False)
 TENANT_STRICT_MODE = getattr(settings, "TENANT_STRICT_MODE", False)
 TENANT_USE_ASGIREF = getattr(settings, "TENANT_USE_ASGIREF", False)
+TENANT_CONTEXT_BACKEND = getattr(settings, "TENANT_CONTEXT_BACKEND", "contextvars")
@@ -21,9 +21,18 @@ DATABASES = {
         "HOST": os.environ.get("DATABASE_HOST", "localhost"),
         "PORT": int(os.environ.get("DATABASE_PORT", "5600")),
         "TEST": test_db,
-    }
+    },
 }
 
+# Plain databases used by the tests of TenantDatabaseRouter. Their tables are
+# created from the models since the migrations of the tests app require citus.
+for shard in ("shard1", "shard2"):
+    DATABASES[shard] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(BASE_PATH, f"{shard}.sqlite3"),
+        "TEST": {"MIGRATE": False},
+    }
+
 SITE_ID = 1
 DEBUG = True
 
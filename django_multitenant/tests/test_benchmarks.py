@@ -0,0 +1,428 @@
+"""
+Micro benchmarks of the hot code paths of django-multitenant.
+
+These are not run with the test suite, run them with `make benchmark`.
+Each benchmark prints the throughput of the compared code paths.
+"""
+
+import asyncio
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import models
+from django.test.utils import isolate_apps, override_settings
+
+from django_multitenant import registry
+from django_multitenant.fields import TenantForeignKey
+from django_multitenant.models import TenantModel
+from django_multitenant.patches import install_patches, uninstall_patches
+from django_multitenant.utils import (
+    create_tenant_storage,
+    get_model_by_db_table,
+    set_current_tenant,
+    set_current_tenant_id,
+    unset_current_tenant,
+)
+
+from .base import BaseTestCase
+from .test_prepared_statements import prepared_statements
+
+
+def run_benchmark(name, func, number=10000):
+    """
+    Runs func number times and prints the number of operations per second.
+    """
+    func()
+
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    elapsed = time.perf_counter() - start
+
+    print(f"{name}: {number / elapsed:,.0f} ops/s ({elapsed / number * 1e6:.2f} us/op)")
+    return elapsed
+
+
+class BenchmarkTest(BaseTestCase):
+    def test_benchmark_queryset_construction(self):
+        from .models import Project
+
+        set_current_tenant(self.account_fr)
+
+        def build_queryset():
+            return Project.objects.filter(name="project").exclude(employee=None)
+
+        def build_queryset_without_registry():
+            # Resolves the tenant metadata again, as every call did before
+            # the registry existed.
+            registry.clear()
+            return build_queryset()
+
+        run_benchmark(
+            "queryset construction (registry cleared)",
+            build_queryset_without_registry,
+        )
+        registry.populate()
+        run_benchmark("queryset construction (registry)", build_queryset)
+
+        unset_current_tenant()
+
+    def test_benchmark_model_by_db_table(self):
+        # The schema editor looks up both sides of every TenantForeignKey
+        # constraint while migrating. Simulates a migration from zero of a
+        # project with 600 tenant models.
+        model_count = 600
+
+        with isolate_apps("django_multitenant.tests") as test_apps:
+            tenant_model = type(
+                "BenchmarkTenant",
+                (TenantModel,),
+                {
+                    "__module__": __name__,
+                    "tenant_id": "id",
+                    "Meta": type("Meta", (), {"app_label": "tests"}),
+                },
+            )
+            synthetic_models = [
+                type(
+                    f"BenchmarkModel{i}",
+                    (TenantModel,),
+                    {
+                        "__module__": __name__,
+                        "tenant_id": "owner_id",
+                        "owner": TenantForeignKey(
+                            tenant_model, on_delete=models.CASCADE
+                        ),
+                        "Meta": type("Meta", (), {"app_label": "tests"}),
+                    },
+                )
+                for i in range(model_count)
+            ]
+            db_tables = [model._meta.db_table for model in synthetic_models]
+
+            def linear_scan(db_table):
+                for model in test_apps.get_models():
+                    if model._meta.db_table == db_table:
+                        return model
+                raise ValueError(db_table)
+
+            def migrate_with_linear_scan():
+                for db_table in db_tables:
+                    linear_scan(db_table)
+                    linear_scan(tenant_model._meta.db_table)
+
+            def migrate_with_index():
+                for db_table in db_tables:
+                    get_model_by_db_table(db_table, test_apps)
+                    get_model_by_db_table(tenant_model._meta.db_table, test_apps)
+
+            run_benchmark(
+                f"fk constraint lookups, {model_count} models (linear scan)",
+                migrate_with_linear_scan,
+                number=10,
+            )
+            run_benchmark(
+                f"fk constraint lookups, {model_count} models (index)",
+                migrate_with_index,
+                number=10,
+            )
+
+    def test_benchmark_context_backends(self):
+        account = self.account_fr
+        operations = 100000
+        workers = 8
+
+        for backend in ["contextvars", "threading", "asgiref"]:
+            storage = create_tenant_storage(backend)
+
+            def get_set(count, storage=storage):
+                for _ in range(count):
+                    token = storage.set(account)
+                    storage.get()
+                    storage.reset(token)
+
+            def run_threads(get_set=get_set):
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for future in [
+                        executor.submit(get_set, operations // workers)
+                        for _ in range(workers)
+                    ]:
+                        future.result()
+
+            async def run_tasks(get_set=get_set):
+                async def task():
+                    get_set(operations // workers)
+
+                await asyncio.gather(*[task() for _ in range(workers)])
+
+            elapsed = run_benchmark(
+                f"{backend} set/get/reset, {workers} threads", run_threads, number=5
+            )
+            print(f"  {operations * 5 / elapsed:,.0f} set/get/reset per second")
+            elapsed = run_benchmark(
+                f"{backend} set/get/reset, {workers} asyncio tasks",
+                lambda run_tasks=run_tasks: asyncio.run(run_tasks()),
+                number=5,
+            )
+            print(f"  {operations * 5 / elapsed:,.0f} set/get/reset per second")
+
+    def test_benchmark_model_hydration(self):
+        from .models import Country, Project
+
+        row_count = 20000
+        Project.objects.bulk_create(
+            [
+                Project(name=f"project {i}", account=self.account_fr)
+                for i in range(row_count)
+            ]
+        )
+        Country.objects.bulk_create(
+            [Country(name=f"country {i}") for i in range(row_count)]
+        )
+        project_count = Project.objects.count()
+        country_count = Country.objects.count()
+
+        elapsed = run_benchmark(
+            f"list({project_count} tenant model rows)",
+            lambda: list(Project.objects.all()),
+            number=5,
+        )
+        print(f"  {project_count * 5 / elapsed:,.0f} rows/s")
+        elapsed = run_benchmark(
+            f"list({country_count} plain model rows)",
+            lambda: list(Country.objects.all()),
+            number=5,
+        )
+        print(f"  {country_count * 5 / elapsed:,.0f} rows/s")
+
+    def test_benchmark_model_instantiation(self):
+        from .models import Country, Project
+
+        account = self.account_fr
+
+        run_benchmark(
+            "tenant model instantiation",
+            lambda: Project(name="project", account=account),
+            number=100000,
+        )
+        run_benchmark(
+            "plain model instantiation",
+            lambda: Country(name="country"),
+            number=100000,
+        )
+
+    def test_benchmark_filter_first(self):
+        # The base manager, which isn't scoped, runs the queries of unpatched Django
+        # pylint: disable=protected-access
+        from .models import Project
+
+        projects = self.projects
+        account = self.account_fr
+        set_current_tenant(account)
+
+        run_benchmark(
+            "objects.filter().first() (tenant predicate added when compiled)",
+            lambda: Project.objects.filter(name="project 1").first(),
+            number=2000,
+        )
+        # Same query on unpatched Django, with the tenant filter added to the
+        # queryset as the managers did before.
+        uninstall_patches()
+        try:
+            run_benchmark(
+                "_base_manager.filter(tenant).filter().first() (unpatched Django)",
+                lambda: Project._base_manager.filter(account_id=account.id)
+                .filter(name="project 1")
+                .first(),
+                number=2000,
+            )
+        finally:
+            install_patches()
+        run_benchmark(
+            "objects.filter() construction only",
+            lambda: Project.objects.filter(name="project 1"),
+        )
+        run_benchmark(
+            "_base_manager.filter(tenant).filter() construction only",
+            lambda: Project._base_manager.filter(account_id=account.id).filter(
+                name="project 1"
+            ),
+        )
+
+        unset_current_tenant()
+
+    def test_benchmark_array_parameter(self):
+        from .models import Account, Project
+
+        for tenant_count in [1, 10, 100, 1000]:
+            tenant_ids = list(range(1, tenant_count + 1))
+            for use_array_parameter in [False, True]:
+                with override_settings(TENANT_USE_ARRAY_PARAMETER=use_array_parameter):
+                    set_current_tenant_id(Account, tenant_ids)
+                    queryset = Project.objects.filter(name="project 1")
+                    sql, params = queryset.query.get_compiler("default").as_sql()
+                    run_benchmark(
+                        f"{tenant_count} tenants, "
+                        f"{'= ANY(%s)' if use_array_parameter else 'IN (%s, ...)'}: "
+                        f"{len(sql)} chars of SQL, {len(params)} parameters",
+                        lambda: list(Project.objects.filter(name="project 1")),
+                        number=500,
+                    )
+
+        unset_current_tenant()
+
+    def test_benchmark_prepared_statements(self):
+        from .models import SubTask
+
+        subtasks = self.subtasks
+        account = self.account_fr
+        set_current_tenant(account)
+
+        def run_query():
+            return list(
+                SubTask.objects.filter(
+                    task__opened=True, project__name="project 1"
+                ).select_related("task", "project")[:10]
+            )
+
+        for cache_size in [0, 100]:
+            with prepared_statements(cache_size) as cache:
+                run_benchmark(
+                    f"filter().select_related() with prepared statements "
+                    f"{'on' if cache_size else 'off'}",
+                    run_query,
+                    number=2000,
+                )
+                if cache is not None:
+                    print(f"  {cache.hits} hits, {cache.misses} misses")
+
+        unset_current_tenant()
+
+    def test_benchmark_bulk_update(self):
+        from .models import Project
+
+        projects = self.projects
+        number = 100
+
+        def bulk_update_by_tenant():
+            Project.objects.bulk_update(projects, ["name"], batch_size=100)
+
+        def bulk_update_pk_in():
+            # Django's bulk_update, as the managers did before: pk__in batches
+            # without tenant predicate.
+            # pylint: disable=protected-access
+            Project._base_manager.bulk_update(projects, ["name"], batch_size=100)
+
+        for name, func in [
+            ("bulk_update (pk__in batches)", bulk_update_pk_in),
+            ("bulk_update (partitioned by tenant)", bulk_update_by_tenant),
+        ]:
+            elapsed = run_benchmark(name, func, number=number)
+            print(f"  {len(projects) * number / elapsed:,.0f} rows/s")
+
+    def test_benchmark_copy_from(self):
+        from .models import Project
+
+        account = self.account_fr
+        row_count = 10000
+        number = 5
+        set_current_tenant(account)
+
+        def bulk_create():
+            Project.objects.bulk_create(
+                [Project(name=f"project {i}") for i in range(row_count)]
+            )
+
+        def copy_from(copy_format):
+            Project.objects.copy_from(
+                ((f"project {i}",) for i in range(row_count)),
+                fields=["name"],
+                format=copy_format,
+            )
+
+        for name, func in [
+            ("bulk_create", bulk_create),
+            ("copy_from (csv)", lambda: copy_from("csv")),
+            ("copy_from (binary)", lambda: copy_from("binary")),
+        ]:
+            elapsed = run_benchmark(f"{name}, {row_count} rows", func, number=number)
+            print(f"  {row_count * number / elapsed:,.0f} rows/s")
+
+        unset_current_tenant()
+
+    def test_benchmark_bulk_delete(self):
+        from .models import Project, SubTask, Task
+
+        account = self.account_fr
+        project_count = 20
+        task_count = 250
+
+        def create_projects():
+            projects = Project.objects.bulk_create(
+                [
+                    Project(name=f"project {i}", account=account)
+                    for i in range(project_count)
+                ]
+            )
+            tasks = Task.objects.bulk_create(
+                [
+                    Task(name=f"task {i}", project=project, account=account)
+                    for project in projects
+                    for i in range(task_count)
+                ]
+            )
+            SubTask.objects.bulk_create(
+                [
+                    SubTask(
+                        name=f"subtask {i}",
+                        type="test",
+                        task=task,
+                        project_id=task.project_id,
+                        account=account,
+                    )
+                    for task in tasks
+                    for i in range(2)
+                ]
+            )
+
+        for name, delete in [
+            (
+                "filter().delete()",
+                lambda: Project.objects.filter(account=account).delete(),
+            ),
+            ("bulk_delete()", lambda: Project.objects.bulk_delete(account=account)),
+        ]:
+            create_projects()
+            tracemalloc.start()
+            start = time.perf_counter()
+            deleted, _ = delete()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{name}: {deleted} rows in {elapsed:.2f} s, "
+                f"{deleted / elapsed:,.0f} rows/s, peak memory {peak / 2**20:.1f} MiB"
+            )
+
+    def test_benchmark_save(self):
+        from .models import Project
+
+        project = Project.objects.create(name="project", account=self.account_fr)
+        number = 2000
+        set_current_tenant(self.account_fr)
+
+        # models.Model.save() skips the tenant handling of TenantModelMixin.save(), the
+        # UPDATE statement is the same.
+        plain_elapsed = run_benchmark(
+            "Model.save()", lambda: models.Model.save(project), number=number
+        )
+        for name, tenant in [
+            ("object in the current tenant", self.account_fr),
+            ("object in another tenant", self.account_us),
+        ]:
+            set_current_tenant(tenant)
+            elapsed = run_benchmark(f"save(), {name}", project.save, number=number)
+            print(f"  overhead {(elapsed - plain_elapsed) / number * 1e6:.2f} us/save")
+
+        unset_current_tenant()
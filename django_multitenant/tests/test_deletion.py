@@ -0,0 +1,136 @@
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from django_multitenant.utils import set_current_tenant, unset_current_tenant
+
+from .base import BaseTestCase
+
+
+def get_statements(queries):
+    return [
+        query["sql"]
+        for query in queries
+        if not query["sql"].startswith(("BEGIN", "COMMIT", "SAVEPOINT", "RELEASE"))
+    ]
+
+
+class DeletionQueryCountTest(BaseTestCase):
+    """
+    The number of statements of a deletion depends on the shape of the cascade, not on
+    the number of rows deleted, and the rows which are not cascaded to are deleted
+    without being fetched.
+    """
+
+    def setUp(self):
+        unset_current_tenant()
+
+    def tearDown(self):
+        unset_current_tenant()
+
+    def capture_delete(self, queryset):
+        with CaptureQueriesContext(connection) as captured:
+            queryset.delete()
+        return get_statements(captured.captured_queries)
+
+    def test_cascade_chain(self):
+        from .models import AliasedTask, Project, Revenue, SubTask, Task
+
+        account = self.account_fr
+        # pylint: disable=pointless-statement
+        self.subtasks
+        self.revenues
+        self.project_managers
+        set_current_tenant(account)
+
+        one = self.capture_delete(Project.objects.filter(name="project 0"))
+        many = self.capture_delete(
+            Project.objects.filter(name__in=[f"project {i}" for i in range(1, 6)])
+        )
+
+        self.assertEqual(len(one), len(many))
+        for statement in one + many:
+            self.assertRegex(statement, r'"(account|acc)_id" = 1')
+        # The subtasks, revenues and project managers are not fetched
+        for table in ("tests_subtask", "tests_revenue", "tests_projectmanager"):
+            self.assertFalse(
+                [s for s in many if s.startswith("SELECT") and f'FROM "{table}"' in s]
+            )
+
+        self.assertEqual(Project.objects.count(), 4)
+        self.assertEqual(Task.objects.count(), 4 * 5)
+        self.assertEqual(SubTask.objects.count(), 4 * 5 * 5)
+        self.assertEqual(Revenue.objects.count(), 4 * 5)
+        self.assertEqual(AliasedTask.objects.count(), 0)
+
+    def test_cascade_chain_without_tenant(self):
+        from .models import Project, SubTask, Task
+
+        account = self.account_fr
+        subtasks = self.subtasks
+
+        # The instances of the cascade are fetched without their deferred tenant column
+        Project.objects.filter(account=account).delete()
+
+        self.assertFalse(Project.objects.filter(account=account).exists())
+        self.assertFalse(Task.objects.filter(account=account).exists())
+        self.assertFalse(SubTask.objects.filter(account=account).exists())
+        self.assertEqual(SubTask.objects.count(), 2 * 10 * 5 * 5)
+
+    def test_many_to_many_through(self):
+        from .models import Manager, ProjectManager
+
+        account = self.account_fr
+        project_managers = self.project_managers
+
+        # Without a tenant, the rows of the through table are deleted with the tenant
+        # predicate of the managers
+        one = self.capture_delete(Manager.objects.filter(name="manager 0"))
+        many = self.capture_delete(
+            Manager.objects.filter(name__in=["manager 1", "manager 2", "manager 3"])
+        )
+
+        self.assertEqual(len(one), len(many))
+        through_deletes = [
+            s for s in one + many if s.startswith('DELETE FROM "tests_projectmanager"')
+        ]
+        self.assertEqual(len(through_deletes), 2)
+        for statement in through_deletes:
+            self.assertIn('"tests_projectmanager"."account_id" IN', statement)
+        self.assertFalse(
+            [s for s in many if s.startswith("SELECT") and "tests_projectmanager" in s]
+        )
+
+        set_current_tenant(account)
+        self.assertEqual(Manager.objects.count(), 1)
+        self.assertEqual(ProjectManager.objects.count(), 10)
+
+    def test_set_null(self):
+        from .models import Employee, Project
+
+        account = self.account_fr
+        projects = self.projects
+        employees = [Employee.objects.create(name=f"employee {i}") for i in range(4)]
+        for i, project in enumerate(projects):
+            project.employee = employees[i % 4]
+            project.save()
+
+        one = self.capture_delete(Employee.objects.filter(name="employee 0"))
+        many = self.capture_delete(
+            Employee.objects.filter(name__in=["employee 1", "employee 2"])
+        )
+
+        self.assertEqual(len(one), len(many))
+        self.assertTrue([s for s in many if s.startswith('UPDATE "tests_project"')])
+        if django.VERSION >= (4, 2):
+            # The projects are updated with a queryset, without being fetched
+            self.assertFalse(
+                [
+                    s
+                    for s in many
+                    if s.startswith("SELECT") and 'FROM "tests_project"' in s
+                ]
+            )
+
+        set_current_tenant(account)
+        self.assertEqual(Project.objects.filter(employee__isnull=True).count(), 8)
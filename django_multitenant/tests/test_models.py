@@ -4,15 +4,23 @@ import pytest
 import django
 
 from django.conf import settings
-from django.db.models import Count
+from django.db import connection, transaction
+from django.db.models import Count, signals
+from django.db.models.deletion import Collector
+from django.db.models.sql import UpdateQuery
 from django.db.utils import NotSupportedError, DataError
+from django.test.utils import CaptureQueriesContext, override_settings
 from .models import Store, Product, Purchase, Staff, StoreStaff
 
 
+from django_multitenant.exceptions import EmptyTenant
+from django_multitenant.query import _mixed_model_sets, is_mixed_model_set
 from django_multitenant.utils import (
     set_current_tenant,
     unset_current_tenant,
     get_current_tenant,
+    get_current_tenant_snapshot,
+    get_current_tenant_value,
 )
 
 from .base import BaseTestCase
@@ -248,6 +256,228 @@ class TenantModelTest(BaseTestCase):
         with self.assertRaises(DataError):
             Project.objects.bulk_create(projects)
 
+    def test_bulk_update_tenant_not_set(self):
+        from .models import Project
+
+        projects = self.projects
+        for project in projects:
+            project.name = f"renamed {project.account_id}"
+
+        # One UPDATE per tenant and batch, filtered on the tenant
+        with CaptureQueriesContext(connection) as captured_queries:
+            self.assertEqual(
+                Project.objects.bulk_update(projects, ["name"], batch_size=5),
+                30 if django.VERSION >= (4, 0) else None,
+            )
+        updates = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith("UPDATE")
+        ]
+        self.assertEqual(len(updates), 6)
+        for sql, account in zip(updates[::2], self.accounts):
+            self.assertIn(f'"tests_project"."account_id" = {account.id}', sql)
+
+        for account in self.accounts:
+            self.assertEqual(
+                Project.objects.filter(
+                    account=account, name=f"renamed {account.id}"
+                ).count(),
+                10,
+            )
+
+    def test_bulk_update_tenant_set(self):
+        from .models import Project
+
+        projects = self.projects
+        account = self.account_fr
+        for project in projects:
+            project.name = "renamed"
+
+        # The projects of the other tenants are skipped
+        set_current_tenant(account)
+        with CaptureQueriesContext(connection) as captured_queries:
+            self.assertEqual(
+                Project.objects.bulk_update(projects, ["name"]),
+                10 if django.VERSION >= (4, 0) else None,
+            )
+        self.assertEqual(
+            [query["sql"][:6] for query in captured_queries].count("UPDATE"), 1
+        )
+        unset_current_tenant()
+        self.assertEqual(Project.objects.filter(name="renamed").count(), 10)
+
+        with self.assertRaises(NotSupportedError):
+            Project.objects.bulk_update(projects, ["account"])
+
+    def test_bulk_update_tenants(self):
+        from .models import Account
+
+        accounts = self.accounts
+        for account in accounts:
+            account.name = f"renamed {account.id}"
+
+        # The tenants are updated in batches, not one by one
+        with CaptureQueriesContext(connection) as captured_queries:
+            Account.objects.bulk_update(accounts, ["name"], batch_size=2)
+        self.assertEqual(
+            [query["sql"][:6] for query in captured_queries].count("UPDATE"), 2
+        )
+        for account in Account.objects.all():
+            self.assertEqual(account.name, f"renamed {account.id}")
+
+    @pytest.mark.skipif(
+        django.VERSION < (5, 0), reason="upserts require Django 5.0 or later"
+    )
+    def test_upsert(self):
+        store = Store.objects.create(name="store1")
+        set_current_tenant(store)
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            product = Product.objects.upsert(
+                id=1, defaults={"name": "product1", "description": "created"}
+            )
+        self.assertEqual(product.store_id, store.id)
+        self.assertEqual(product.pk, 1)
+        inserts = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith("INSERT")
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertIn('ON CONFLICT("store_id", "id") DO UPDATE', inserts[0])
+        self.assertIn("RETURNING", inserts[0])
+
+        product = Product.objects.upsert(
+            id=1, defaults={"name": "product2", "description": "updated"}
+        )
+        self.assertEqual(product.pk, 1)
+        self.assertEqual(
+            list(Product.objects.values_list("id", "name", "description")),
+            [(1, "product2", "updated")],
+        )
+
+        # The existing row is left untouched without defaults
+        Product.objects.upsert(id=1)
+        self.assertEqual(Product.objects.get().name, "product2")
+
+        with self.assertRaises(NotSupportedError):
+            Product.objects.upsert(id=1, defaults={"store": store})
+        unset_current_tenant()
+
+    @pytest.mark.skipif(
+        django.VERSION >= (5, 0), reason="upserts are supported from Django 5.0"
+    )
+    def test_upsert_not_supported(self):
+        store = Store.objects.create(name="store1")
+        set_current_tenant(store)
+        with self.assertRaises(NotSupportedError):
+            Product.objects.upsert(id=1, defaults={"name": "product1"})
+        unset_current_tenant()
+        self.assertFalse(Product.objects.exists())
+
+    @pytest.mark.skipif(
+        django.VERSION < (5, 0), reason="upserts require Django 5.0 or later"
+    )
+    def test_bulk_upsert(self):
+        stores = [Store.objects.create(name=f"store{i}") for i in range(2)]
+        Product.objects.create(id=1, name="product1", store=stores[0])
+
+        products = [
+            Product(id=1, name="renamed", description="", store=stores[0]),
+            Product(id=2, name="product2", description="", store=stores[1]),
+            Product(id=3, name="product3", description="", store=stores[0]),
+        ]
+        # One INSERT per tenant
+        with CaptureQueriesContext(connection) as captured_queries:
+            self.assertEqual(
+                Product.objects.bulk_upsert(products, ["id"], ["name"]), products
+            )
+        inserts = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith("INSERT")
+        ]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(
+            list(Product.objects.order_by("id").values_list("id", "name", "store")),
+            [
+                (1, "renamed", stores[0].id),
+                (2, "product2", stores[1].id),
+                (3, "product3", stores[0].id),
+            ],
+        )
+
+    def test_copy_from_instances(self):
+        from .models import Task
+
+        projects = self.projects
+        account = self.account_fr
+        project = projects[0]
+
+        for copy_format in ["csv", "binary"]:
+            set_current_tenant(account)
+            # Generator consumed in chunks of 3 rows
+            tasks = (
+                Task(
+                    name=f'{copy_format} "task", {i}',
+                    project=project,
+                    opened=i % 2 == 0,
+                )
+                for i in range(10)
+            )
+            self.assertEqual(
+                Task.objects.copy_from(tasks, format=copy_format, chunk_size=3), 10
+            )
+            unset_current_tenant()
+
+            copied_tasks = Task.objects.filter(name__startswith=copy_format).order_by(
+                "id"
+            )
+            self.assertEqual(
+                [(task.name, task.opened) for task in copied_tasks],
+                [(f'{copy_format} "task", {i}', i % 2 == 0) for i in range(10)],
+            )
+            for task in copied_tasks:
+                self.assertEqual(task.account_id, account.id)
+                self.assertIsNone(task.parent_id)
+
+    def test_copy_from_tuples(self):
+        from .models import Project
+
+        account = self.account_fr
+
+        # The tenant column is filled in from the current tenant
+        set_current_tenant(account)
+        self.assertEqual(
+            Project.objects.copy_from(
+                [("project 1",), ("",)], fields=["name"], format="binary"
+            ),
+            2,
+        )
+        unset_current_tenant()
+        self.assertEqual(
+            sorted(
+                Project.objects.filter(account=account).values_list("name", flat=True)
+            ),
+            ["", "project 1"],
+        )
+
+        # or from the rows
+        self.assertEqual(
+            Project.objects.copy_from(
+                [(account.id, "project 2"), (self.account_in.id, "project 3")],
+                fields=["account", "name"],
+            ),
+            2,
+        )
+        self.assertEqual(Project.objects.filter(account=account).count(), 3)
+        self.assertEqual(Project.objects.filter(account=self.account_in).count(), 1)
+
+        with self.assertRaises(EmptyTenant):
+            Project.objects.copy_from([("project 4",)], fields=["name"])
+        self.assertEqual(Project.objects.count(), 4)
+
     @pytest.mark.skipif(
         not settings.USE_CITUS,
         reason=(
@@ -331,6 +561,130 @@ class TenantModelTest(BaseTestCase):
         Project.objects.all().delete()
         self.assertEqual(Project.objects.count(), 0)
 
+    def test_bulk_delete(self):
+        from .models import Project, SubTask, Task
+
+        subtasks = self.subtasks
+        account = self.account_fr
+
+        # Without tenant, the rows are deleted one tenant after the other, by chunks of
+        # 4 projects, without being fetched
+        with CaptureQueriesContext(connection) as captured_queries:
+            deleted, deleted_per_model = Project.objects.bulk_delete(
+                name__in=[
+                    "project 1",
+                    "project 2",
+                    "project 3",
+                    "project 4",
+                    "project 5",
+                ],
+                chunk_size=4,
+            )
+        self.assertEqual(deleted, 15 + 75 + 375)
+        self.assertEqual(
+            deleted_per_model,
+            {"tests.Project": 15, "tests.Task": 75, "tests.SubTask": 375},
+        )
+        deletes = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith("DELETE")
+        ]
+        # 2 chunks per tenant, 7 tables, the self referencing tasks are deleted with
+        # the tasks of the projects
+        self.assertEqual(len(deletes), 3 * 2 * 7)
+        for sql in deletes[:14]:
+            self.assertRegex(sql, rf'"(account|acc)_id" = {account.id}\b')
+        # Only the tenants, the primary keys of the chunks and of the tasks referring
+        # to the deleted tasks are selected. The aliases of the columns depend on the
+        # Django version.
+        selected = {
+            re.sub(r' AS "\w+"', "", query["sql"].split(" FROM ")[0])
+            for query in captured_queries
+            if query["sql"].startswith("SELECT")
+        }
+        self.assertEqual(
+            selected,
+            {
+                'SELECT DISTINCT "tests_project"."account_id"',
+                'SELECT "tests_project"."id"',
+                'SELECT "tests_task"."id"',
+            },
+        )
+
+        self.assertEqual(Project.objects.count(), 15)
+        self.assertEqual(Task.objects.count(), 75)
+        self.assertEqual(SubTask.objects.count(), 375)
+
+        # With a tenant, only its rows are deleted
+        set_current_tenant(account)
+        self.assertEqual(Project.objects.bulk_delete()[1]["tests.Project"], 5)
+        unset_current_tenant()
+        self.assertEqual(Project.objects.count(), 10)
+        self.assertFalse(Task.objects.filter(account=account).exists())
+
+    def test_bulk_delete_related_filter(self):
+        from .models import Project, Task
+
+        account = self.account_fr
+        set_current_tenant(account)
+        projects = [
+            Project.objects.create(name=f"project {i}", account=account)
+            for i in range(3)
+        ]
+        for project in projects[:2]:
+            Task.objects.create(name="x", project=project, account=account)
+        Task.objects.create(name="y", project=projects[2], account=account)
+
+        # The projects are selected by the tasks which are deleted with them
+        deleted, deleted_per_model = Project.objects.bulk_delete(
+            tasks__name="x", chunk_size=1
+        )
+        self.assertEqual(deleted_per_model, {"tests.Project": 2, "tests.Task": 2})
+        self.assertEqual(list(Project.objects.all()), [projects[2]])
+        unset_current_tenant()
+
+    def test_bulk_delete_self_reference_cycle(self):
+        from .models import Project, Task
+
+        account = self.account_fr
+        set_current_tenant(account)
+        project = Project.objects.create(name="project", account=account)
+        other_project = Project.objects.create(name="other project", account=account)
+        first = Task.objects.create(name="first", project=project, account=account)
+        second = Task.objects.create(
+            name="second", project=other_project, account=account, parent=first
+        )
+        third = Task.objects.create(
+            name="third", project=other_project, account=account, parent=second
+        )
+        Task.objects.filter(pk=first.pk).update(parent=third)
+
+        # The tasks of the cycle are deleted once
+        deleted, deleted_per_model = Project.objects.bulk_delete(name="project")
+        self.assertEqual(deleted_per_model, {"tests.Project": 1, "tests.Task": 3})
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(list(Project.objects.all()), [other_project])
+        unset_current_tenant()
+
+    def test_bulk_delete_signals(self):
+        from .models import Project, Task
+
+        tasks = self.tasks
+        deleted_tasks = []
+
+        def receiver(instance, **kwargs):
+            deleted_tasks.append(instance)
+
+        # The instances are fetched when they are needed
+        signals.pre_delete.connect(receiver, sender=Task)
+        try:
+            Project.objects.bulk_delete(name="project 1")
+        finally:
+            signals.pre_delete.disconnect(receiver, sender=Task)
+        self.assertEqual(len(deleted_tasks), 15)
+        self.assertEqual(Project.objects.count(), 27)
+
     def test_subquery(self):
         # we want all the projects with the name of their first task
 
@@ -510,7 +864,7 @@ class TenantModelTest(BaseTestCase):
 
         self.assertEqual(Account.objects.count(), 2)
 
-        query_count = 18 if django.VERSION >= (4, 2) else 16
+        query_count = 17 if django.VERSION >= (4, 2) else 15
         with self.assertNumQueries(query_count) as captured_queries:
             country.delete()
 
@@ -520,7 +874,8 @@ class TenantModelTest(BaseTestCase):
                 "SET LOCAL citus.multi_shard_modify_mode TO 'sequential';"
                 in [query["sql"] for query in captured_queries.captured_queries]
             )
-            self.assertTrue(
+            # The mode lasts until the end of the transaction of the deletion
+            self.assertFalse(
                 "SET LOCAL citus.multi_shard_modify_mode TO 'parallel';"
                 in [query["sql"] for query in captured_queries.captured_queries]
             )
@@ -553,7 +908,7 @@ class TenantModelTest(BaseTestCase):
 
         set_current_tenant(account)
 
-        query_count = 29 if django.VERSION >= (4, 2) else 28
+        query_count = 28 if django.VERSION >= (4, 2) else 27
         with self.assertNumQueries(query_count) as captured_queries:
             account.delete()
 
@@ -566,13 +921,134 @@ class TenantModelTest(BaseTestCase):
                 "SET LOCAL citus.multi_shard_modify_mode TO 'sequential';"
                 in [query["sql"] for query in captured_queries.captured_queries]
             )
-            self.assertTrue(
+            # The mode lasts until the end of the transaction of the deletion
+            self.assertFalse(
                 "SET LOCAL citus.multi_shard_modify_mode TO 'parallel';"
                 in [query["sql"] for query in captured_queries.captured_queries]
             )
 
         unset_current_tenant()
 
+    def test_delete_cascade_sequential_mode(self):
+        from .models import Account, Country
+
+        unset_current_tenant()
+
+        country = self.france
+        account = self.account_fr
+        calls = []
+
+        with override_settings(
+            TENANT_SEQUENTIAL_MODE_CALLBACK=lambda using, models: calls.append(
+                (using, set(models))
+            )
+        ), CaptureQueriesContext(connection) as captured_queries:
+            # Within an outer transaction, the mode is set back after the deletion
+            with transaction.atomic():
+                country.delete()
+                self.assertFalse(Account.objects.exists())
+
+        statements = [query["sql"] for query in captured_queries.captured_queries]
+        self.assertEqual(
+            statements.count(
+                "SET LOCAL citus.multi_shard_modify_mode TO 'sequential';"
+            ),
+            1,
+        )
+        self.assertEqual(
+            statements.count("SET LOCAL citus.multi_shard_modify_mode TO 'parallel';"),
+            1,
+        )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][0], "default")
+        self.assertIn(Country, calls[0][1])
+        self.assertIn(Account, calls[0][1])
+
+    def test_mixed_model_set(self):
+        from .models import Account, Country, Project
+
+        self.assertFalse(is_mixed_model_set({Account, Project}))
+        self.assertTrue(is_mixed_model_set([Country, Account, Project]))
+        # The classification is cached per set of models
+        self.assertIn(frozenset({Country, Account, Project}), _mixed_model_sets)
+
+    def test_delete_field_updates_by_tenant(self):
+        from .models import Employee, Project
+
+        projects = self.projects
+        employee = Employee.objects.create(name="Louise")
+        Project.objects.update(employee=employee)
+        projects = list(Project.objects.all())
+
+        # The projects set by the collector are updated by tenant, whatever their number
+        collector = Collector(using="default")
+        collector.add_field_update(Project._meta.get_field("employee"), None, projects)
+        with CaptureQueriesContext(connection) as captured_queries:
+            collector.delete()
+        updates = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith("UPDATE")
+        ]
+        self.assertEqual(len(updates), 3)
+        for sql in updates:
+            self.assertIn('"tests_project"."id" = ANY(', sql)
+        for account in self.accounts:
+            self.assertEqual(
+                len([sql for sql in updates if f'"account_id" = {account.id}' in sql]),
+                1,
+            )
+        self.assertFalse(Project.objects.exclude(employee=None).exists())
+
+    def test_delete_set_null_by_tenant(self):
+        from .models import Business, Template, Tenant
+
+        tenants = [Tenant.objects.create(name=f"tenant {i}") for i in range(2)]
+        businesses = [
+            Business.objects.create(
+                tenant=tenant, bk_biz_id=tenant.id, bk_biz_name=tenant.name
+            )
+            for tenant in tenants
+        ]
+        for business in businesses:
+            for i in range(3):
+                Template.objects.create(
+                    tenant=business.tenant, business=business, name=f"template {i}"
+                )
+
+        # The templates are set to NULL in the tenant of their business, whether they
+        # are fetched by the collector or updated by a queryset, from Django 4.2
+        with CaptureQueriesContext(connection) as captured_queries:
+            Business.objects.filter(tenant=tenants[0]).delete()
+        updates = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith('UPDATE "tests_template"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertIn(f'"tests_template"."tenant_id" = {tenants[0].id}', updates[0])
+        self.assertEqual(Template.objects.filter(business=None).count(), 3)
+        self.assertEqual(Template.objects.filter(business=businesses[1]).count(), 3)
+
+    def test_update_batch(self):
+        from .models import Project
+
+        projects = self.projects
+        set_current_tenant(self.account_fr)
+        query = UpdateQuery(Project)
+        with override_settings(TENANT_UPDATE_BATCH_SIZE=4):
+            with CaptureQueriesContext(connection) as captured_queries:
+                query.update_batch(
+                    [project.pk for project in projects[:10]],
+                    {"name": "renamed"},
+                    "default",
+                )
+        self.assertEqual(len(captured_queries), 3)
+        for captured_query in captured_queries:
+            self.assertIn('"tests_project"."account_id" = 1', captured_query["sql"])
+        unset_current_tenant()
+        self.assertEqual(Project.objects.filter(name="renamed").count(), 10)
+
 
 class MultipleTenantModelTest(BaseTestCase):
     def test_filter_without_joins(self):
@@ -682,7 +1158,8 @@ class MultipleTenantModelTest(BaseTestCase):
 
         set_current_tenant(accounts)
 
-        query_count = 10 if django.VERSION >= (4, 2) else 8
+        # The accounts queryset is evaluated by set_current_tenant
+        query_count = 9 if django.VERSION >= (4, 2) else 7
         with self.assertNumQueries(query_count) as captured_queries:
             Project.objects.all().delete()
 
@@ -799,6 +1276,78 @@ class MultipleTenantModelTest(BaseTestCase):
         project = Project.objects.filter(account=account).first()
         self.assertEqual(project.name, "test update name")
 
+    def test_save_tenant_set_different_than_object_queries(self):
+        unset_current_tenant()
+        from .models import Project
+
+        account = self.account_fr
+        Project.objects.create(account=account, name="test save fr")
+        project = Project.objects.get(name="test save fr")
+
+        set_current_tenant(self.account_us)
+
+        # The account of the project is not loaded to be set as current tenant
+        project.name = "test update name"
+        with self.assertNumQueries(1):
+            project.save()
+
+        self.assertEqual(get_current_tenant(), self.account_us)
+        unset_current_tenant()
+        self.assertEqual(Project.objects.get(pk=project.pk).name, "test update name")
+
+    def test_save_tenant_context(self):
+        unset_current_tenant()
+        from .models import Project
+
+        account = self.account_fr
+        project = Project.objects.create(account=account, name="test save fr")
+        saved_in = []
+
+        def receiver(**kwargs):
+            saved_in.append(get_current_tenant_value())
+
+        signals.pre_save.connect(receiver, sender=Project)
+        try:
+            # The current tenant is left as is when the object is in it
+            set_current_tenant(account)
+            snapshot = get_current_tenant_snapshot()
+            project.save()
+            Project(name="test create fr").save()
+            self.assertIs(get_current_tenant_snapshot(), snapshot)
+
+            # The tenant of the object is the current tenant during the save only
+            set_current_tenant(self.account_us)
+            snapshot = get_current_tenant_snapshot()
+            project.save()
+            self.assertIs(get_current_tenant_snapshot(), snapshot)
+        finally:
+            signals.pre_save.disconnect(receiver, sender=Project)
+
+        self.assertEqual(saved_in, [account.id, account.id, account.id])
+        unset_current_tenant()
+
+    def test_tenant_field_assignment_queries(self):
+        unset_current_tenant()
+        from .models import Project
+
+        Project.objects.create(account=self.account_fr, name="test save fr")
+        project = Project.objects.get(name="test save fr")
+
+        with self.assertNumQueries(0):
+            project.account = self.account_fr
+            project.account_id = self.account_fr.pk
+            project.name = "test update name"
+
+        self.assertFalse(hasattr(project, "_try_update_tenant"))
+
+        account_in = self.account_in
+        project = Project.objects.get(name="test save fr")
+        with self.assertNumQueries(0):
+            project.account = account_in
+
+        with self.assertRaises(NotSupportedError):
+            project.save()
+
     def test_aggregate(self):
         from .models import ProjectManager
 
@@ -846,6 +1395,132 @@ class MultipleTenantModelTest(BaseTestCase):
 
         self.assertEqual(StoreStaff.objects.get(store=store, staff=staff).store, store)
 
+    def test_many_to_many_tenant_scoped(self):
+        from .models import Project, ProjectManager
+
+        unset_current_tenant()
+        account = self.account_fr
+        project = Project.objects.create(account=account, name="project")
+        managers = [
+            manager for manager in self.managers if manager.account_id == account.id
+        ]
+
+        # Without a current tenant, the queries are filtered on the tenant of the project
+        with CaptureQueriesContext(connection) as captured_queries:
+            project.managers.add(managers[0], managers[1])
+            project.managers.remove(managers[0])
+            self.assertEqual(project.managers.count(), 1)
+            self.assertEqual(list(project.managers.all()), [managers[1]])
+            project.managers.clear()
+        statements = [
+            query["sql"]
+            for query in captured_queries.captured_queries
+            if query["sql"] not in ("BEGIN", "COMMIT")
+        ]
+        self.assertEqual(len(statements), 6)
+        self.assertIn('("project_id", "manager_id", "account_id")', statements[1])
+        for statement in statements[:1] + statements[2:]:
+            self.assertRegex(
+                statement, r'"tests_(projectmanager|manager)"."account_id" = 1'
+            )
+        self.assertIsNone(get_current_tenant())
+
+        # set() reads the through table once, and deletes and inserts the differences
+        project.managers.add(managers[0], managers[1])
+        with CaptureQueriesContext(connection) as captured_queries:
+            project.managers.set([managers[1], managers[2], managers[3].pk])
+        statements = [
+            query["sql"]
+            for query in captured_queries.captured_queries
+            if query["sql"] not in ("BEGIN", "COMMIT")
+        ]
+        self.assertEqual(
+            [statement.split()[0] for statement in statements],
+            ["SELECT", "DELETE", "INSERT"],
+        )
+        for statement in statements[:2]:
+            self.assertIn('"tests_projectmanager"."account_id" = 1', statement)
+        self.assertEqual(
+            set(
+                ProjectManager.objects.filter(project=project).values_list(
+                    "manager_id", "account_id"
+                )
+            ),
+            {(manager.pk, account.id) for manager in managers[1:4]},
+        )
+
+        # Unchanged relations don't issue any write
+        with CaptureQueriesContext(connection) as captured_queries:
+            project.managers.set(managers[1:4])
+        self.assertEqual(
+            [
+                query["sql"].split()[0]
+                for query in captured_queries.captured_queries
+                if query["sql"] not in ("BEGIN", "COMMIT")
+            ],
+            ["SELECT"],
+        )
+
+    def test_many_to_many_other_tenant(self):
+        from .models import Project
+
+        account = self.account_fr
+        project = Project.objects.create(account=account, name="project")
+        managers = [
+            manager for manager in self.managers if manager.account_id == account.id
+        ]
+        project.managers.add(*managers)
+
+        # The current tenant is kept, the relations of the project are not visible
+        set_current_tenant(self.account_in)
+        with CaptureQueriesContext(connection) as captured_queries:
+            self.assertEqual(project.managers.count(), 0)
+        self.assertIn(
+            f'"tests_manager"."account_id" = {self.account_in.id}',
+            captured_queries.captured_queries[0]["sql"],
+        )
+        self.assertNotIn(
+            f'"account_id" = {account.id}', captured_queries.captured_queries[0]["sql"]
+        )
+        self.assertEqual(get_current_tenant(), self.account_in)
+        unset_current_tenant()
+        self.assertEqual(project.managers.count(), len(managers))
+
+    def test_many_to_many_set_signals(self):
+        from .models import Project, ProjectManager
+
+        unset_current_tenant()
+        account = self.account_fr
+        project = Project.objects.create(account=account, name="project")
+        managers = [
+            manager for manager in self.managers if manager.account_id == account.id
+        ]
+        project.managers.add(managers[0], managers[1])
+        changes = []
+
+        def receiver(action, pk_set, **kwargs):
+            changes.append((action, pk_set))
+
+        signals.m2m_changed.connect(receiver, sender=ProjectManager)
+        try:
+            project.managers.set(managers[1:3])
+        finally:
+            signals.m2m_changed.disconnect(receiver, sender=ProjectManager)
+
+        self.assertEqual(
+            changes,
+            [
+                ("pre_remove", {managers[0].pk}),
+                ("post_remove", {managers[0].pk}),
+                ("pre_add", {managers[2].pk}),
+                ("post_add", {managers[2].pk}),
+            ],
+        )
+        self.assertEqual(
+            set(project.managers.values_list("pk", flat=True)),
+            {managers[1].pk, managers[2].pk},
+        )
+
     def test_tenant_id_columns(self):
         from .models import Template, Tenant, Business
 
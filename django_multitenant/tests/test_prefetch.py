@@ -0,0 +1,187 @@
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext, isolate_apps
+
+from django_multitenant.models import TenantModel
+from django_multitenant.prefetch import TenantPrefetch
+from django_multitenant.utils import set_current_tenant, unset_current_tenant
+
+from .base import BaseTestCase
+
+
+class TenantPrefetchTest(BaseTestCase):
+    def setUp(self):
+        unset_current_tenant()
+
+    def assertTenantQueries(self, captured_queries, table, tenant_column, tenant_ids):
+        queries = [
+            query["sql"]
+            for query in captured_queries
+            if query["sql"].startswith("SELECT") and f'FROM "{table}"' in query["sql"]
+        ]
+        self.assertEqual(len(queries), len(tenant_ids))
+        for sql, tenant_id in zip(queries, tenant_ids):
+            self.assertIn(f'"{table}"."{tenant_column}" = {tenant_id}', sql)
+
+    def test_reverse_foreign_key(self):
+        from .models import Account
+
+        tasks = self.tasks
+        account_ids = [account.pk for account in self.accounts]
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            accounts = list(
+                Account.objects.order_by("pk").prefetch_related(
+                    TenantPrefetch("projects__tasks")
+                )
+            )
+        # One query per tenant at every level
+        self.assertEqual(len(captured_queries), 7)
+        self.assertTenantQueries(
+            captured_queries, "tests_project", "account_id", account_ids
+        )
+        self.assertTenantQueries(
+            captured_queries, "tests_task", "account_id", account_ids
+        )
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                sorted(
+                    task.pk
+                    for account in accounts
+                    for project in account.projects.all()
+                    for task in project.tasks.all()
+                ),
+                sorted(task.pk for task in tasks),
+            )
+            for account in accounts:
+                self.assertEqual(len(account.projects.all()), 10)
+                for project in account.projects.all():
+                    self.assertEqual(project.account_id, account.pk)
+
+    def test_forward_foreign_key(self):
+        from .models import Task
+
+        tasks = self.tasks
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            prefetched_tasks = list(
+                Task.objects.prefetch_related(TenantPrefetch("project"))
+            )
+        self.assertEqual(len(captured_queries), 4)
+        self.assertTenantQueries(
+            captured_queries,
+            "tests_project",
+            "account_id",
+            sorted({task.account_id for task in tasks}),
+        )
+
+        with self.assertNumQueries(0):
+            for task in prefetched_tasks:
+                self.assertEqual(task.project.pk, task.project_id)
+
+    def test_many_to_many(self):
+        from .models import Project
+
+        project_managers = self.project_managers
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            projects = list(
+                Project.objects.order_by("pk").prefetch_related(
+                    TenantPrefetch("managers")
+                )
+            )
+        self.assertEqual(len(captured_queries), 4)
+        self.assertTenantQueries(
+            captured_queries,
+            "tests_manager",
+            "account_id",
+            [account.pk for account in self.accounts],
+        )
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                sum(len(project.managers.all()) for project in projects),
+                len(project_managers),
+            )
+
+    @isolate_apps("django_multitenant.tests")
+    def test_other_tenant_model(self):
+        class Shop(TenantModel):
+            name = models.CharField(max_length=255)
+
+            tenant_id = "id"
+
+            class Meta:
+                app_label = "tests"
+
+        class Team(TenantModel):
+            org_id = models.IntegerField()
+            shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+
+            tenant_id = "org_id"
+
+            class Meta:
+                app_label = "tests"
+
+        with connection.schema_editor() as editor:
+            editor.create_model(Shop)
+            editor.create_model(Team)
+        try:
+            shops = [Shop.objects.create(name=f"shop {i}") for i in range(3)]
+            Team.objects.bulk_create(
+                Team(org_id=shops[-1 - i].pk, shop=shop) for i, shop in enumerate(shops)
+            )
+
+            # The shops are not filtered on the tenants of the teams, which are
+            # not shops
+            with self.assertNumQueries(4):
+                teams = list(Team.objects.prefetch_related(TenantPrefetch("shop")))
+
+            with self.assertNumQueries(0):
+                self.assertEqual([team.shop for team in teams], shops)
+        finally:
+            with connection.schema_editor() as editor:
+                editor.delete_model(Team)
+                editor.delete_model(Shop)
+
+    def test_queryset_and_to_attr(self):
+        from .models import Account, Project
+
+        projects = self.projects
+
+        accounts = Account.objects.order_by("pk").prefetch_related(
+            TenantPrefetch(
+                "projects",
+                queryset=Project.objects.filter(name="project 1"),
+                to_attr="first_projects",
+            )
+        )
+        with self.assertNumQueries(4):
+            for account in accounts:
+                self.assertEqual(
+                    [project.name for project in account.first_projects],
+                    ["project 1"],
+                )
+
+    def test_with_current_tenant(self):
+        from .models import Account
+
+        projects = self.projects
+        set_current_tenant(self.account_fr)
+
+        with self.assertNumQueries(2):
+            accounts = list(
+                Account.objects.prefetch_related(TenantPrefetch("projects"))
+            )
+            self.assertEqual(len(accounts), 1)
+            self.assertEqual(len(accounts[0].projects.all()), 10)
+
+        unset_current_tenant()
+
+    def test_plain_lookups_unchanged(self):
+        from .models import Account
+
+        projects = self.projects
+
+        with self.assertNumQueries(2):
+            list(Account.objects.prefetch_related("projects"))
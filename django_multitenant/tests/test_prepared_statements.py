@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+
+from django.db import NotSupportedError, connection, transaction
+
+from django_multitenant.backends.postgresql.prepared import to_positional_parameters
+from django_multitenant.utils import set_current_tenant, unset_current_tenant
+
+from .base import BaseTestCase
+
+
+@contextmanager
+def prepared_statements(cache_size):
+    options = connection.settings_dict["OPTIONS"]
+    connection.close()
+    options["prepared_statements_cache_size"] = cache_size
+    try:
+        connection.ensure_connection()
+        yield connection.prepared_statements
+    finally:
+        del options["prepared_statements_cache_size"]
+        connection.close()
+
+
+class PreparedStatementsTest(BaseTestCase):
+    def setUp(self):
+        unset_current_tenant()
+
+    def test_to_positional_parameters(self):
+        self.assertEqual(
+            to_positional_parameters(
+                "SELECT * FROM t WHERE a = %s AND b LIKE 'x%%' AND c = ANY(%s)"
+            ),
+            ("SELECT * FROM t WHERE a = $1 AND b LIKE 'x%' AND c = ANY($2)", 2),
+        )
+        self.assertEqual(to_positional_parameters("SELECT 1"), ("SELECT 1", 0))
+        self.assertEqual(
+            to_positional_parameters("SELECT * FROM t WHERE a = %(a)s"), (None, 0)
+        )
+
+    def test_disabled_by_default(self):
+        connection.ensure_connection()
+        self.assertIsNone(connection.prepared_statements)
+
+    def test_tenant_queries_share_statements(self):
+        from .models import Project
+
+        projects = self.projects
+
+        with prepared_statements(10) as cache:
+            for account in self.accounts:
+                set_current_tenant(account)
+                with self.assertNumQueries(1):
+                    self.assertEqual(
+                        list(Project.objects.filter(name="project 1")),
+                        [
+                            project
+                            for project in projects
+                            if project.account_id == account.id
+                            and project.name == "project 1"
+                        ],
+                    )
+
+            self.assertEqual((cache.misses, cache.hits), (1, 2))
+            self.assertEqual(len(cache), 1)
+
+            with transaction.atomic():
+                Project.objects.filter(name="project 1").update(name="renamed")
+            self.assertEqual(Project.objects.filter(name="renamed").count(), 1)
+            unset_current_tenant()
+
+    def test_lru_eviction(self):
+        from .models import Project
+
+        with prepared_statements(2) as cache:
+            list(Project.objects.filter(name="a"))
+            list(Project.objects.filter(id=1))
+            list(Project.objects.filter(name="b"))
+            list(Project.objects.exclude(name="a"))
+            self.assertEqual(len(cache), 2)
+
+            # The least recently used statement, filtering on id, was evicted
+            list(Project.objects.filter(id=2))
+            self.assertEqual((cache.misses, cache.hits), (4, 1))
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_prepared_statements")
+                self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_unpreparable_statement_in_transaction(self):
+        with prepared_statements(10) as cache:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for _ in range(2):
+                        # The type of the parameter can't be determined by PREPARE
+                        cursor.execute("SELECT %s IS NULL", [None])
+                        self.assertEqual(cursor.fetchone(), (True,))
+
+            self.assertEqual((cache.misses, cache.hits, len(cache)), (0, 0, 0))
+
+    def test_invalidation(self):
+        from .models import Project
+
+        with prepared_statements(10) as cache:
+            list(Project.objects.filter(name="a"))
+            self.assertEqual(len(cache), 1)
+
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE TEMPORARY TABLE prepared_test (id int)")
+                self.assertEqual(len(cache), 0)
+                cursor.execute("SELECT count(*) FROM pg_prepared_statements")
+                self.assertEqual(cursor.fetchone()[0], 0)
+
+            list(Project.objects.filter(name="a"))
+            self.assertEqual(len(cache), 1)
+
+            # A new connection has no prepared statements
+            connection.close()
+            connection.ensure_connection()
+            self.assertEqual(len(connection.prepared_statements), 0)
+            list(Project.objects.filter(name="a"))
+            self.assertEqual(connection.prepared_statements.misses, 1)
+
+    def test_altered_table(self):
+        def count_prepared_statements():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_prepared_statements")
+                return cursor.fetchone()[0]
+
+        with prepared_statements(10) as cache:
+            # The table is altered without the cache knowing, as by another connection
+            raw_cursor = connection.connection.cursor()
+            raw_cursor.execute("CREATE TEMPORARY TABLE prepared_test (id int)")
+            sql = "SELECT * FROM prepared_test WHERE id = %s"
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [1])
+                raw_cursor.execute("ALTER TABLE prepared_test ADD COLUMN name text")
+
+                # The statement is deallocated and the SQL is run as is
+                cursor.execute(sql, [1])
+                self.assertEqual(cursor.fetchall(), [])
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(count_prepared_statements(), 0)
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [1])
+            raw_cursor.execute("ALTER TABLE prepared_test ADD COLUMN code text")
+            with self.assertRaises(NotSupportedError):
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(sql, [1])
+            # Deallocated once the transaction is rolled back
+            self.assertEqual(count_prepared_statements(), 0)
+            raw_cursor.close()
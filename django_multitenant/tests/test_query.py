@@ -0,0 +1,441 @@
+import re
+
+from django.db import models
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.test.utils import isolate_apps, override_settings
+
+from django_multitenant.models import TenantModel
+from django_multitenant.utils import (
+    set_current_tenant,
+    set_current_tenant_id,
+    unset_current_tenant,
+)
+
+from .base import BaseTestCase
+
+PROJECT_COLUMNS = (
+    '"tests_project"."id", "tests_project"."name", '
+    '"tests_project"."account_id", "tests_project"."employee_id"'
+)
+# Column of another table, in parentheses from Django 4.1
+OUTER_COLUMN_RE = re.compile(r'\(((?:"\w+"|U\d+)\."\w+")\)')
+
+
+class TenantPredicateTest(BaseTestCase):
+    def assertQueries(self, func, *expected_sql):
+        with self.assertNumQueries(len(expected_sql)) as captured_queries:
+            func()
+        self.assertEqual(
+            [query["sql"] for query in captured_queries.captured_queries],
+            list(expected_sql),
+        )
+
+    def assertTenantPredicates(self, func, *expected_predicates):
+        # Checks that each query run by func has every predicate of its item of
+        # expected_predicates exactly once, and returns the SQL of the queries. The rest
+        # of the SQL is not compared, its formatting depends on the Django version.
+        with self.assertNumQueries(len(expected_predicates)) as captured_queries:
+            func()
+        queries = [
+            OUTER_COLUMN_RE.sub(r"\1", query["sql"])
+            for query in captured_queries.captured_queries
+        ]
+        for sql, predicates in zip(queries, expected_predicates):
+            for predicate in predicates:
+                self.assertEqual(sql.count(predicate), 1, sql)
+        return queries
+
+    def test_manager_does_not_clone(self):
+        from .models import Project
+
+        set_current_tenant(self.account_fr)
+        queryset = Project.objects.all()
+
+        # The predicate is only added when the query is compiled
+        self.assertEqual(queryset.query.where.children, [])
+        self.assertTrue(queryset.query.tenant_scoped)
+        self.assertTrue(queryset.filter(name="project").query.tenant_scoped)
+        unset_current_tenant()
+
+    def test_tenant_read_when_compiled(self):
+        from .models import Project
+
+        projects = self.projects
+        account = self.account_fr
+
+        queryset = Project.objects.filter(name__startswith="project")
+        set_current_tenant(account)
+        with self.assertNumQueries(1) as captured_queries:
+            self.assertEqual(queryset.count(), 10)
+
+        self.assertIn(
+            f'"tests_project"."account_id" = {account.id}',
+            captured_queries.captured_queries[0]["sql"],
+        )
+        unset_current_tenant()
+
+    def test_predicate_not_duplicated(self):
+        from .models import Project
+
+        projects = self.projects
+        account = self.account_fr
+        set_current_tenant(account)
+
+        for queryset in [
+            Project.objects.filter(account=account),
+            Project.objects.filter(account_id=account.id),
+        ]:
+            with self.subTest(query=str(queryset.query)):
+                with self.assertNumQueries(1) as captured_queries:
+                    list(queryset)
+                sql = captured_queries.captured_queries[0]["sql"]
+                self.assertEqual(sql.count('"tests_project"."account_id" ='), 1)
+
+        set_current_tenant([self.account_fr, self.account_in])
+        with self.assertNumQueries(1) as captured_queries:
+            list(Project.objects.filter(account__in=[self.account_in, account]))
+        self.assertEqual(
+            captured_queries.captured_queries[0]["sql"].count(
+                '"tests_project"."account_id" IN'
+            ),
+            1,
+        )
+        unset_current_tenant()
+
+    def test_update_and_aggregate(self):
+        from .models import Project
+
+        projects = self.projects
+        account = self.account_fr
+        set_current_tenant(account)
+
+        with self.assertNumQueries(1) as captured_queries:
+            Project.objects.filter(name__startswith="project").update(name="renamed")
+        self.assertIn(
+            f'"tests_project"."account_id" = {account.id}',
+            captured_queries.captured_queries[0]["sql"],
+        )
+
+        with self.assertNumQueries(1) as captured_queries:
+            result = Project.objects.aggregate(count=Count("id"))
+        self.assertEqual(result["count"], 10)
+        self.assertIn(
+            f'"tests_project"."account_id" = {account.id}',
+            captured_queries.captured_queries[0]["sql"],
+        )
+
+        unset_current_tenant()
+        self.assertEqual(Project.objects.filter(name="renamed").count(), 10)
+
+    def test_union(self):
+        from .models import Project
+
+        projects = self.projects
+        set_current_tenant(self.account_fr)
+
+        queryset = Project.objects.filter(name="project 0").union(
+            Project.objects.filter(name="project 1")
+        )
+        self.assertEqual(len(queryset), 2)
+        unset_current_tenant()
+
+    def test_unscoped_query(self):
+        from .models import Project
+
+        projects = self.projects
+        set_current_tenant(self.account_fr)
+
+        # The base manager is not scoped
+        # pylint: disable=protected-access
+        with self.assertNumQueries(1) as captured_queries:
+            self.assertEqual(Project._base_manager.count(), 30)
+        self.assertNotIn("account_id", captured_queries.captured_queries[0]["sql"])
+        unset_current_tenant()
+
+    def test_sql_select(self):
+        from .models import Project
+
+        account = self.account_fr
+        set_current_tenant(account)
+
+        predicate = f'"tests_project"."account_id" = {account.id}'
+        self.assertTenantPredicates(lambda: list(Project.objects.all()), [predicate])
+        self.assertTenantPredicates(
+            lambda: list(Project.objects.filter(name="project 1")),
+            [predicate, '"tests_project"."name" = \'project 1\''],
+        )
+        unset_current_tenant()
+
+    def test_sql_count_then_fetch(self):
+        from .models import Project
+
+        account = self.account_fr
+        set_current_tenant(account)
+
+        queryset = Project.objects.filter(name="project 1")
+        predicates = [f'"tests_project"."account_id" = {account.id}']
+        self.assertTenantPredicates(
+            lambda: (queryset.count(), list(queryset)), predicates, predicates
+        )
+        unset_current_tenant()
+
+    def test_sql_repeated_tenant_filters(self):
+        from .models import Project
+
+        account = self.account_fr
+        set_current_tenant(account)
+
+        predicates = [f'"tests_project"."account_id" = {account.id}']
+        self.assertTenantPredicates(lambda: list(account.projects.all()), predicates)
+        self.assertTenantPredicates(
+            lambda: list(
+                Project.objects.filter(account=account).filter(account_id=account.id)
+            ),
+            predicates,
+        )
+
+        # Not scoped, the repeated condition is removed all the same
+        unset_current_tenant()
+        self.assertTenantPredicates(
+            lambda: list(
+                Project.objects.filter(account_id=account.id).filter(account=account)
+            ),
+            predicates,
+        )
+
+    def test_sql_related_objects(self):
+        from .models import Task
+
+        tasks = self.tasks
+        account = self.account_fr
+        set_current_tenant(account)
+
+        task = Task.objects.first()
+        project = task.project
+        self.assertTenantPredicates(
+            lambda: list(project.tasks.all()),
+            [
+                f'"tests_task"."account_id" = {account.id}',
+                f'"tests_task"."project_id" = {project.id}',
+            ],
+        )
+
+        task = Task.objects.get(pk=task.pk)
+        self.assertTenantPredicates(
+            lambda: task.project,
+            [
+                f'"tests_project"."account_id" = {account.id}',
+                f'"tests_project"."id" = {project.id}',
+            ],
+        )
+
+        # The joined table is filtered on the tenant by the join condition
+        (sql,) = self.assertTenantPredicates(
+            lambda: list(Task.objects.filter(project__name="project 1")),
+            [
+                '"tests_task"."account_id" = "tests_project"."account_id"',
+                f'"tests_task"."account_id" = {account.id}',
+            ],
+        )
+        self.assertNotIn(f'"tests_project"."account_id" = {account.id}', sql)
+        unset_current_tenant()
+
+    def test_sql_subqueries(self):
+        from .models import Account, Project, Record, Store, Task
+
+        tasks = self.tasks
+
+        # The subqueries are correlated with the tenant of the outer query
+        correlation = 'U0."account_id" = "tests_project"."account_id"'
+        self.assertTenantPredicates(
+            lambda: list(
+                Project.objects.annotate(
+                    task_name=Subquery(
+                        Task.objects.filter(project=OuterRef("pk")).values("name")[:1]
+                    )
+                )
+            ),
+            [correlation, 'U0."project_id" = "tests_project"."id"'],
+        )
+        self.assertTenantPredicates(
+            lambda: list(
+                Project.objects.filter(
+                    pk__in=Task.objects.filter(name=OuterRef("name")).values(
+                        "project_id"
+                    )
+                )
+            ),
+            [correlation, 'U0."name" = "tests_project"."name"'],
+        )
+
+        # Nothing is added when the tenants are already correlated
+        (sql,) = self.assertTenantPredicates(
+            lambda: list(
+                Account.objects.filter(
+                    Exists(Project.objects.filter(account=OuterRef("pk")))
+                )
+            ),
+            ['U0."account_id" = "tests_account"."id"'],
+        )
+        self.assertEqual(sql.count('"account_id"'), 1)
+
+        # The tables of the models of other tenants are not correlated
+        organization = self.organization
+        Record.objects.create(name="project 1", organization=organization)
+        (sql,) = self.assertTenantPredicates(
+            lambda: self.assertEqual(
+                Record.objects.filter(
+                    Exists(Project.objects.filter(name=OuterRef("name")))
+                ).count(),
+                1,
+            ),
+            ['U0."name" = "tests_record"."name"'],
+        )
+        self.assertNotIn('"account_id"', sql)
+        store = Store.objects.create(name="project 1")
+        self.assertEqual(
+            Store.objects.filter(
+                Exists(Project.objects.filter(name=OuterRef("name")))
+            ).get(),
+            store,
+        )
+
+        account = self.account_fr
+        set_current_tenant(account)
+        self.assertTenantPredicates(
+            lambda: list(
+                Project.objects.filter(
+                    Exists(Task.objects.filter(project=OuterRef("pk"), opened=True))
+                )
+            ),
+            [
+                f'"tests_project"."account_id" = {account.id}',
+                f'U0."account_id" = {account.id}',
+                correlation,
+            ],
+        )
+        self.assertEqual(
+            Project.objects.filter(
+                Exists(Task.objects.filter(project=OuterRef("pk"), opened=True))
+            ).count(),
+            10,
+        )
+        unset_current_tenant()
+
+    def test_sql_update(self):
+        from .models import Project
+
+        projects = self.projects
+        account = self.account_fr
+        set_current_tenant(account)
+
+        predicate = f'"tests_project"."account_id" = {account.id}'
+        self.assertTenantPredicates(
+            lambda: Project.objects.filter(name="project 1").update(name="renamed"),
+            [predicate],
+        )
+
+        project = Project.objects.get(name="renamed")
+        project.name = "saved"
+        self.assertTenantPredicates(
+            project.save, [predicate, f'"tests_project"."id" = {project.id}']
+        )
+        unset_current_tenant()
+
+    @isolate_apps("django_multitenant.tests")
+    def test_sql_inherited_tenant_column(self):
+        from .models import Account
+
+        class Document(TenantModel):
+            account_id = models.IntegerField()
+            name = models.CharField(max_length=255)
+
+            tenant_id = "account_id"
+
+            class Meta:
+                app_label = "tests"
+
+        class Invoice(Document):
+            number = models.IntegerField()
+
+            class Meta:
+                app_label = "tests"
+
+        # The tenant column of the model inheriting it is read from the parent table
+        set_current_tenant_id(Account, 1)
+        self.assertEqual(
+            str(Invoice.objects.filter(number=1).query),
+            'SELECT "tests_document"."id", "tests_document"."account_id", '
+            '"tests_document"."name", "tests_invoice"."document_ptr_id", '
+            '"tests_invoice"."number" FROM "tests_invoice" '
+            'INNER JOIN "tests_document" '
+            'ON ("tests_invoice"."document_ptr_id" = "tests_document"."id") '
+            'WHERE ("tests_document"."account_id" = 1 '
+            'AND "tests_invoice"."number" = 1)',
+        )
+        unset_current_tenant()
+
+    def test_sql_multiple_tenants(self):
+        from .models import Project
+
+        account = self.account_fr
+        set_current_tenant([account, self.account_in])
+
+        # Restricted to one of the current tenants, the IN condition is redundant
+        (sql,) = self.assertTenantPredicates(
+            lambda: list(Project.objects.filter(account=account)),
+            [f'"tests_project"."account_id" = {account.id}'],
+        )
+        self.assertNotIn(" IN (", sql)
+        self.assertTenantPredicates(
+            lambda: list(Project.objects.filter(name="project 1")),
+            [
+                '"tests_project"."account_id" '
+                f"IN ({account.id}, {self.account_in.id})"
+            ],
+        )
+        unset_current_tenant()
+
+    @override_settings(TENANT_USE_ARRAY_PARAMETER=True)
+    def test_sql_multiple_tenants_array_parameter(self):
+        from .models import Project, Task
+
+        tasks = self.tasks
+        account = self.account_fr
+        set_current_tenant([account, self.account_in])
+
+        self.assertQueries(
+            lambda: list(Project.objects.filter(name="project 1")),
+            f'SELECT {PROJECT_COLUMNS} FROM "tests_project" '
+            f'WHERE ("tests_project"."account_id" = ANY(ARRAY[{account.id},{self.account_in.id}]) '
+            'AND "tests_project"."name" = \'project 1\')',
+        )
+        self.assertEqual(Project.objects.count(), 20)
+        self.assertEqual(Project.objects.filter(account=account).count(), 10)
+
+        # The same SQL is used whatever the number of tenants
+        with self.assertNumQueries(2) as captured_queries:
+            Project.objects.count()
+            set_current_tenant([account])
+            Project.objects.count()
+        self.assertEqual(
+            *[
+                query["sql"].split("ARRAY")[0]
+                for query in captured_queries.captured_queries
+            ]
+        )
+
+        task = Task.objects.first()
+        self.assertQueries(
+            lambda: task.project,
+            f'SELECT {PROJECT_COLUMNS} FROM "tests_project" '
+            f'WHERE ("tests_project"."id" = {task.project_id} '
+            f'AND "tests_project"."account_id" = ANY(ARRAY[{account.id}])) LIMIT 21',
+        )
+
+        set_current_tenant([account, self.account_in])
+        Project.objects.filter(name="project 1").update(name="renamed")
+        Project.objects.filter(name="project 2").delete()
+        unset_current_tenant()
+        self.assertEqual(Project.objects.filter(name="renamed").count(), 2)
+        self.assertEqual(Project.objects.filter(name="project 2").count(), 1)
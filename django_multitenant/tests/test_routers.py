@@ -0,0 +1,207 @@
+from collections import Counter
+
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import override_settings
+
+from django_multitenant.routers import (
+    ExplicitPlacement,
+    HashRingPlacement,
+    TenantDatabaseRouter,
+)
+from django_multitenant.utils import (
+    set_current_tenant_id,
+    unset_current_tenant,
+)
+
+
+class ShardRouter(TenantDatabaseRouter):
+    placement = ExplicitPlacement({1: "shard1", 2: "shard2"})
+    # The countries and employees are replicated in every shard
+    route_reference_models = True
+
+
+class PlacementTest(SimpleTestCase):
+    def test_hash_ring_placement(self):
+        placement = HashRingPlacement(["shard1", "shard2", "shard3"])
+        aliases = [placement.get_alias(tenant_id) for tenant_id in range(3000)]
+
+        # The placement is stable and spreads the tenants over all the aliases
+        self.assertEqual(
+            aliases,
+            [
+                HashRingPlacement(["shard1", "shard2", "shard3"]).get_alias(tenant_id)
+                for tenant_id in range(3000)
+            ],
+        )
+        self.assertEqual(set(aliases), {"shard1", "shard2", "shard3"})
+        self.assertTrue(all(count > 500 for count in Counter(aliases).values()))
+
+        # Adding an alias only moves the tenants it takes over
+        placement = HashRingPlacement(["shard1", "shard2", "shard3", "shard4"])
+        for tenant_id, alias in enumerate(aliases):
+            self.assertIn(placement.get_alias(tenant_id), {alias, "shard4"})
+
+    def test_explicit_placement(self):
+        placement = ExplicitPlacement({1: "shard1", 2: "shard2"})
+        self.assertEqual(placement.get_alias(1), "shard1")
+        self.assertEqual(placement.get_alias(2), "shard2")
+        self.assertIsNone(placement.get_alias(3))
+
+        placement = ExplicitPlacement({1: "shard1"}, default="shard2")
+        self.assertEqual(placement.get_alias(3), "shard2")
+
+    def test_placement_required(self):
+        from .models import Project
+
+        set_current_tenant_id(Project, 1)
+        try:
+            with self.assertRaises(ValueError):
+                TenantDatabaseRouter().db_for_read(Project)
+        finally:
+            unset_current_tenant()
+
+
+@override_settings(DATABASE_ROUTERS=[ShardRouter()])
+class TenantDatabaseRouterTest(TransactionTestCase):
+    databases = {"default", "shard1", "shard2"}
+
+    def setUp(self):
+        unset_current_tenant()
+
+    def tearDown(self):
+        unset_current_tenant()
+
+    def create_account(self, account_id):
+        from .models import Account, Country, Employee, Project
+
+        set_current_tenant_id(Account, account_id)
+        try:
+            country = Country.objects.create(name=f"Country {account_id}")
+            account = Account.objects.create(
+                pk=account_id, name=f"Account {account_id}", country=country
+            )
+            employee = Employee.objects.create(name="Employee", account=account)
+            for i in range(2):
+                Project.objects.create(
+                    name=f"Project {i}", account=account, employee=employee
+                )
+        finally:
+            unset_current_tenant()
+        return account
+
+    def test_routes_to_current_tenant(self):
+        from .models import Account, Project
+
+        self.create_account(1)
+        self.create_account(2)
+
+        for account_id, alias in ((1, "shard1"), (2, "shard2")):
+            unset_current_tenant()
+            self.assertEqual(Account.objects.using(alias).get().pk, account_id)
+            self.assertEqual(
+                set(Project.objects.using(alias).values_list("account_id", flat=True)),
+                {account_id},
+            )
+
+            set_current_tenant_id(Account, account_id)
+            self.assertEqual(Project.objects.all().db, alias)
+            self.assertEqual(Project.objects.count(), 2)
+            project = Project.objects.first()
+            # The database the instance was read from, as known by Django
+            # pylint: disable=protected-access
+            self.assertEqual(project._state.db, alias)
+            # The related objects are read from the database of the instance
+            self.assertEqual(project.account.pk, account_id)
+
+        self.assertFalse(Account.objects.using("default").exists())
+
+    def test_routes_without_tenant(self):
+        from .models import Country, Project
+
+        self.assertIsNone(ShardRouter().db_for_read(Project))
+        self.assertEqual(Project.objects.all().db, "default")
+
+        # The reference models are only routed with route_reference_models
+        set_current_tenant_id(Project, 1)
+        self.assertEqual(Country.objects.all().db, "shard1")
+        with override_settings(DATABASE_ROUTERS=[TenantDatabaseRouter()]):
+            self.assertEqual(Country.objects.all().db, "default")
+
+    def test_routes_instances(self):
+        from .models import Account, Project
+
+        self.create_account(2)
+        project = Project.objects.using("shard2").first()
+
+        # The instance hint wins over the current tenant
+        set_current_tenant_id(Account, 1)
+        router = ShardRouter()
+        self.assertEqual(router.db_for_write(Project, instance=project), "shard2")
+        self.assertEqual(router.db_for_read(Project), "shard1")
+
+    def test_multiple_tenants(self):
+        from .models import Account, Project
+
+        router = ShardRouter()
+        router.placement = ExplicitPlacement({1: "shard1", 2: "shard2", 3: "shard1"})
+
+        set_current_tenant_id(Account, [1, 3])
+        self.assertEqual(router.db_for_read(Project), "shard1")
+
+        # A list of tenants must be placed in a single database
+        set_current_tenant_id(Account, [1, 2])
+        with self.assertRaises(ValueError):
+            router.db_for_read(Project)
+
+    def test_delete(self):
+        from .models import Account, Project, Task
+
+        account = self.create_account(1)
+        self.create_account(2)
+
+        set_current_tenant_id(Account, 1)
+        project = Project.objects.first()
+        Task.objects.create(name="Task", project=project, account=account)
+
+        project.delete()
+        self.assertEqual(Project.objects.count(), 1)
+        self.assertFalse(Task.objects.exists())
+
+        # The cascades run in the database of the deleted account
+        Account.objects.get().delete()
+        unset_current_tenant()
+        self.assertFalse(Project.objects.using("shard1").exists())
+        self.assertEqual(Project.objects.using("shard2").count(), 2)
+
+    def test_delete_set_null(self):
+        from .models import Account, Employee, Project
+
+        self.create_account(1)
+        self.create_account(2)
+
+        # The projects of the deleted employee are updated with update_batch
+        set_current_tenant_id(Account, 1)
+        Employee.objects.get().delete()
+        self.assertEqual(
+            list(Project.objects.values_list("employee_id", flat=True)), [None, None]
+        )
+
+        unset_current_tenant()
+        self.assertEqual(
+            Project.objects.using("shard2").exclude(employee=None).count(), 2
+        )
+
+    def test_rejects_cross_database_relations(self):
+        from .models import Account, Project
+
+        self.create_account(1)
+        account_2 = self.create_account(2)
+
+        set_current_tenant_id(Account, 1)
+        project = Project.objects.first()
+        with self.assertRaises(ValueError):
+            project.account = account_2
+
+        router = ShardRouter()
+        self.assertFalse(router.allow_relation(project, account_2))
+        self.assertIsNone(router.allow_relation(project, project.account))
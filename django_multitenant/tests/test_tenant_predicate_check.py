@@ -0,0 +1,156 @@
+from django.db import connection
+from django.test.utils import override_settings
+
+from django_multitenant.backends.postgresql.base import DatabaseWrapper
+from django_multitenant.backends.postgresql.predicates import (
+    TenantPredicateChecker,
+    get_fingerprint,
+)
+from django_multitenant.exceptions import MissingTenantPredicate
+from django_multitenant.utils import set_current_tenant, unset_current_tenant
+
+from .base import BaseTestCase
+
+
+class TenantPredicateCheckTest(BaseTestCase):
+    def setUp(self):
+        unset_current_tenant()
+
+    def tearDown(self):
+        unset_current_tenant()
+
+    def test_fingerprint(self):
+        normalized_sql, fingerprint = get_fingerprint(
+            'SELECT * FROM "t" WHERE "t"."a" = 1 AND "t"."b" IN (%s, %s)\n'
+            "AND \"t\".\"c\" = 'it''s'"
+        )
+        self.assertEqual(
+            normalized_sql,
+            'SELECT * FROM "t" WHERE "t"."a" = ? AND "t"."b" IN (...) AND "t"."c" = ?',
+        )
+        self.assertEqual(
+            fingerprint,
+            get_fingerprint(
+                'SELECT * FROM "t" WHERE "t"."a" = 2 AND "t"."b" IN (%s) '
+                'AND "t"."c" = \'x\''
+            )[1],
+        )
+
+    def test_missing_tenant_predicate(self):
+        from .models import Project
+
+        projects = self.projects
+        records = []
+        checker = TenantPredicateChecker(callback=records.append, strict=False)
+
+        with self.assertLogs(
+            "django_multitenant.backends.postgresql.predicates", "WARNING"
+        ) as logs:
+            with connection.execute_wrapper(checker):
+                list(Project.objects.filter(name="project 1"))
+                list(Project.objects.filter(name="project 2"))
+
+        self.assertEqual(checker.checked, 2)
+        self.assertEqual(checker.missing, 2)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(len(records), 2)
+
+        record = records[0]
+        self.assertEqual(record.alias, connection.alias)
+        self.assertEqual(record.tables, ["tests_project"])
+        self.assertIn('"tests_project"."name" = ?', record.normalized_sql)
+        self.assertIn("test_tenant_predicate_check.py", record.call_site)
+        self.assertIn("test_missing_tenant_predicate", record.call_site)
+        # Same statement with other values
+        self.assertEqual(records[1].fingerprint, record.fingerprint)
+        self.assertEqual(
+            logs.records[0].tenant_predicate["fingerprint"], record.fingerprint
+        )
+
+    def test_tenant_predicate(self):
+        from .models import Country, Project, Task
+
+        tasks = self.tasks
+        account = self.account_fr
+        records = []
+        checker = TenantPredicateChecker(callback=records.append, strict=False)
+
+        with connection.execute_wrapper(checker):
+            # The tables of the models which are not tenant models are not checked
+            list(Country.objects.all())
+
+            set_current_tenant(account)
+            list(Project.objects.all())
+            list(Task.objects.filter(project__name="project 1"))
+            Project.objects.filter(name="project 1").update(name="renamed")
+
+            set_current_tenant([account, self.account_in])
+            list(Project.objects.all())
+            unset_current_tenant()
+
+            list(Project.objects.filter(account=account))
+            list(account.projects.all())
+            list(Project.objects.filter(account__any=[account.id]))
+
+        self.assertEqual(checker.checked, 8)
+        self.assertEqual(records, [])
+
+    def test_strict(self):
+        from .models import Project
+
+        projects = self.projects
+        checker = TenantPredicateChecker(strict=True)
+
+        with self.assertLogs("django_multitenant.backends.postgresql.predicates"):
+            with connection.execute_wrapper(checker):
+                with self.assertRaises(MissingTenantPredicate) as context:
+                    Project.objects.filter(name="project 1").update(name="renamed")
+        self.assertEqual(context.exception.record.tables, ["tests_project"])
+
+        # The statement was not executed
+        self.assertFalse(Project.objects.filter(name="renamed").exists())
+
+    def test_strict_default(self):
+        from .models import Project
+
+        projects = self.projects
+        checker = TenantPredicateChecker(callback=lambda record: None)
+
+        # The setting is read when a statement is reported, not when the checker is
+        # created, and the strict mode of the checker doesn't follow TENANT_STRICT_MODE
+        with connection.execute_wrapper(checker):
+            with override_settings(TENANT_STRICT_MODE=True):
+                self.assertEqual(Project.objects.count(), 30)
+            with override_settings(TENANT_PREDICATE_CHECK_STRICT=True):
+                with self.assertRaises(MissingTenantPredicate):
+                    Project.objects.count()
+        self.assertEqual(checker.missing, 2)
+
+        checker = TenantPredicateChecker(strict=False)
+        with connection.execute_wrapper(checker):
+            with override_settings(TENANT_PREDICATE_CHECK_STRICT=True):
+                self.assertEqual(Project.objects.count(), 30)
+
+    def test_sampling(self):
+        from .models import Project
+
+        checker = TenantPredicateChecker(sample_rate=0, strict=True)
+        with connection.execute_wrapper(checker):
+            list(Project.objects.all())
+        self.assertEqual(checker.checked, 0)
+
+    def test_database_option(self):
+        settings_dict = {
+            **connection.settings_dict,
+            "OPTIONS": {"tenant_predicate_check": {"sample_rate": 0.5}},
+        }
+        wrapper = DatabaseWrapper(settings_dict, "checked")
+        self.assertEqual(wrapper.tenant_predicate_checker.sample_rate, 0.5)
+        self.assertEqual(wrapper.tenant_predicate_checker.alias, "checked")
+        self.assertIn(wrapper.tenant_predicate_checker, wrapper.execute_wrappers)
+        self.assertNotIn("tenant_predicate_check", wrapper.get_connection_params())
+
+        settings_dict["OPTIONS"] = {}
+        self.assertIsNone(
+            DatabaseWrapper(settings_dict, "unchecked").tenant_predicate_checker
+        )
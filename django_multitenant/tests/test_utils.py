@@ -1,15 +1,28 @@
+import asyncio
 import sys
 import importlib
 from asgiref.sync import async_to_sync
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+
+from django_multitenant.patches import (
+    install_patches,
+    patches_installed,
+    uninstall_patches,
+)
 from django_multitenant.utils import (
     set_current_tenant,
+    set_current_tenant_id,
     get_current_tenant,
     unset_current_tenant,
     get_tenant_column,
     get_current_tenant_value,
+    get_current_tenant_snapshot,
     get_tenant_filters,
+    get_model_by_db_table,
+    tenant_context,
 )
 
 from .base import BaseTestCase
@@ -30,50 +43,98 @@ class UtilsTest(BaseTestCase):
         self.assertEqual(get_current_tenant(), account)
         unset_current_tenant()
 
+    def reload_utils(self, **settings):
+        with self.settings(**settings):
+            importlib.reload(sys.modules["django_multitenant.settings"])
+            importlib.reload(sys.modules["django_multitenant.utils"])
+
+    def tearDown(self):
+        # Restores the context backend configured in the test settings
+        importlib.reload(sys.modules["django_multitenant.settings"])
+        importlib.reload(sys.modules["django_multitenant.utils"])
+        super().tearDown()
+
     def test_tenant_persists_from_thread_to_async_task(self):
         projects = self.projects
         account = projects[0].account
 
-        # Set the tenant in main thread
-        set_current_tenant(account)
-
-        with self.settings(TENANT_USE_ASGIREF=True):
-            importlib.reload(sys.modules["django_multitenant.utils"])
-
-            # Check the tenant within an async task when asgiref enabled
-            tenant = async_to_sync(self.async_get_current_tenant)()
-            self.assertEqual(get_current_tenant(), tenant)
-            unset_current_tenant()
+        for settings, propagates in [
+            ({"TENANT_USE_ASGIREF": True}, True),
+            ({"TENANT_CONTEXT_BACKEND": "asgiref"}, True),
+            ({"TENANT_CONTEXT_BACKEND": "contextvars"}, True),
+            ({"TENANT_CONTEXT_BACKEND": "threading"}, False),
+        ]:
+            with self.subTest(**settings):
+                self.reload_utils(**settings)
 
-        with self.settings(TENANT_USE_ASGIREF=False):
-            importlib.reload(sys.modules["django_multitenant.utils"])
+                # Set the tenant in main thread
+                set_current_tenant(account)
 
-            # Check the tenant within an async task when asgiref is disabled
-            tenant = async_to_sync(self.async_get_current_tenant)()
-            self.assertIsNone(get_current_tenant())
-            unset_current_tenant()
+                # Check the tenant within an async task
+                tenant = async_to_sync(self.async_get_current_tenant)()
+                self.assertEqual(tenant, account if propagates else None)
+                unset_current_tenant()
 
     def test_tenant_persists_from_async_task_to_thread(self):
         projects = self.projects
         account = projects[0].account
 
-        with self.settings(TENANT_USE_ASGIREF=True):
-            importlib.reload(sys.modules["django_multitenant.settings"])
-            importlib.reload(sys.modules["django_multitenant.utils"])
-
-            # Set the tenant in task
-            async_to_sync(self.async_set_current_tenant)(account)
-            self.assertEqual(get_current_tenant(), account)
-            unset_current_tenant()
-
-        with self.settings(TENANT_USE_ASGIREF=False):
-            importlib.reload(sys.modules["django_multitenant.settings"])
-            importlib.reload(sys.modules["django_multitenant.utils"])
-
-            # Set the tenant in task
-            async_to_sync(self.async_set_current_tenant)(account)
-            self.assertIsNone(get_current_tenant())
-            unset_current_tenant()
+        for settings, propagates in [
+            ({"TENANT_USE_ASGIREF": True}, True),
+            ({"TENANT_CONTEXT_BACKEND": "asgiref"}, True),
+            ({"TENANT_CONTEXT_BACKEND": "contextvars"}, True),
+            ({"TENANT_CONTEXT_BACKEND": "threading"}, False),
+        ]:
+            with self.subTest(**settings):
+                self.reload_utils(**settings)
+
+                # Set the tenant in task
+                async_to_sync(self.async_set_current_tenant)(account)
+                self.assertEqual(get_current_tenant(), account if propagates else None)
+                unset_current_tenant()
+
+    def test_invalid_context_backend(self):
+        with self.assertRaises(ValueError):
+            self.reload_utils(TENANT_CONTEXT_BACKEND="invalid")
+
+    def test_tenant_follows_asyncio_tasks(self):
+        accounts = self.accounts
+
+        async def get_tenant_in_task(tenant):
+            # Overrides the tenant inherited from the parent
+            if tenant is not None:
+                set_current_tenant(tenant)
+            await asyncio.sleep(0)
+            return get_current_tenant()
+
+        async def main():
+            set_current_tenant(accounts[0])
+            results = await asyncio.gather(
+                get_tenant_in_task(None),
+                get_tenant_in_task(accounts[1]),
+                get_tenant_in_task(accounts[2]),
+            )
+            return results, get_current_tenant()
+
+        results, parent_tenant = asyncio.run(main())
+
+        self.assertEqual(results, [accounts[0], accounts[1], accounts[2]])
+        # Children don't leak their tenant to the parent task
+        self.assertEqual(parent_tenant, accounts[0])
+        # Nor to the caller of asyncio.run
+        self.assertIsNone(get_current_tenant())
+
+    def test_tenant_context(self):
+        account_fr, account_in = self.account_fr, self.account_in
+
+        set_current_tenant(account_fr)
+        with tenant_context(account_in):
+            self.assertEqual(get_current_tenant(), account_in)
+            with tenant_context(None):
+                self.assertIsNone(get_current_tenant())
+            self.assertEqual(get_current_tenant(), account_in)
+        self.assertEqual(get_current_tenant(), account_fr)
+        unset_current_tenant()
 
     def test_get_tenant_column(self):
         from .models import Project
@@ -164,3 +225,206 @@ class UtilsTest(BaseTestCase):
             {"account_id__in": list(accounts.values_list("id", flat=True))},
         )
         unset_current_tenant()
+
+    def test_tenant_model_info(self):
+        from django_multitenant import registry
+        from .models import Account, Country, Project, Record
+
+        info = registry.get_tenant_model_info(Project)
+        self.assertEqual(info.tenant_column, "account_id")
+        self.assertEqual(info.tenant_field, Project._meta.get_field("account"))
+        self.assertEqual(info.tenant_attname, "account_id")
+        self.assertFalse(info.is_tenant_model)
+        self.assertEqual(info.tenant_attrs, frozenset(["account_id", "account"]))
+
+        self.assertTrue(registry.get_tenant_model_info(Account).is_tenant_model)
+        self.assertEqual(
+            registry.get_tenant_model_info(Record).tenant_column, "organization_id"
+        )
+        self.assertIsNone(registry.get_tenant_model_info(Country))
+
+        # Instances and classes share the same entry
+        self.assertIs(registry.get_tenant_model_info(Project()), info)
+
+    def test_get_tenant_column_does_not_instantiate_model(self):
+        from unittest import mock
+        from .models import Project
+
+        with mock.patch.object(
+            Project, "__init__", side_effect=AssertionError("instantiated")
+        ):
+            self.assertEqual(get_tenant_column(Project), "account_id")
+
+    def test_get_tenant_column_not_tenant_model(self):
+        from .models import Country
+
+        with self.assertRaises(ValueError):
+            get_tenant_column(Country)
+
+    def test_get_model_by_db_table(self):
+        from .models import Project
+
+        self.assertIs(get_model_by_db_table("tests_project"), Project)
+        with self.assertRaises(ValueError):
+            get_model_by_db_table("tests_does_not_exist")
+
+    def test_get_model_by_db_table_app_registry_changes(self):
+        from django.db import models
+        from django.test.utils import isolate_apps
+
+        with isolate_apps("django_multitenant.tests") as test_apps:
+
+            class FirstModel(models.Model):
+                class Meta:
+                    app_label = "tests"
+                    db_table = "tests_first_model"
+
+            self.assertIs(
+                get_model_by_db_table("tests_first_model", test_apps), FirstModel
+            )
+            with self.assertRaises(ValueError):
+                get_model_by_db_table("tests_second_model", test_apps)
+
+            class SecondModel(models.Model):
+                class Meta:
+                    app_label = "tests"
+                    db_table = "tests_second_model"
+
+            self.assertIs(
+                get_model_by_db_table("tests_second_model", test_apps), SecondModel
+            )
+
+        # The global registry is not affected by the isolated one
+        with self.assertRaises(ValueError):
+            get_model_by_db_table("tests_first_model")
+
+    def test_tenant_snapshot(self):
+        from unittest import mock
+        from .models import Account, Project
+
+        accounts = self.accounts
+
+        with mock.patch.object(
+            Account, "tenant_value", new_callable=mock.PropertyMock
+        ) as tenant_value:
+            tenant_value.return_value = accounts[0].pk
+            set_current_tenant(accounts[0])
+
+            get_current_tenant_value()
+            get_tenant_filters(Project)
+            list(Project.objects.all())
+
+            # The value is read once, when the tenant is set
+            self.assertEqual(tenant_value.call_count, 1)
+
+        snapshot = get_current_tenant_snapshot()
+        self.assertEqual(snapshot.tenant, accounts[0])
+        self.assertEqual(snapshot.value, accounts[0].pk)
+        self.assertFalse(snapshot.is_multi)
+        with self.assertRaises(AttributeError):
+            snapshot.value = accounts[1].pk
+
+        set_current_tenant(accounts[:2])
+        snapshot = get_current_tenant_snapshot()
+        self.assertEqual(snapshot.value, (accounts[0].pk, accounts[1].pk))
+        self.assertTrue(snapshot.is_multi)
+
+        unset_current_tenant()
+        self.assertIsNone(get_current_tenant_snapshot())
+
+    def test_tenant_snapshot_unsaved_tenant(self):
+        from .models import Product, Store
+
+        for i in range(3):
+            store = Store.objects.create(name=f"store {i}")
+            Product.objects.create(store=store, name=f"product {i}")
+        store = Store(name="new store")
+        set_current_tenant(store)
+        self.assertIsNone(get_current_tenant_value())
+
+        # The value of the tenant is read again once it's saved
+        store.save()
+        self.assertEqual(get_current_tenant_value(), store.pk)
+        self.assertEqual(Product.objects.count(), 0)
+        self.assertFalse(get_current_tenant_snapshot().unresolved)
+
+        unset_current_tenant()
+
+    def test_set_current_tenant_id(self):
+        from .models import Account, Project, Task
+
+        projects = self.projects
+        tasks = self.tasks
+        account = self.account_fr
+
+        with self.assertNumQueries(0):
+            set_current_tenant_id(Account, account.pk)
+            tenant = get_current_tenant()
+            self.assertEqual(get_current_tenant_value(), account.pk)
+            self.assertEqual(tenant.pk, account.pk)
+            self.assertEqual(tenant, account)
+            self.assertEqual(account, tenant)
+
+        # Only the query itself is executed, the account is not loaded
+        with self.assertNumQueries(1):
+            self.assertEqual(Project.objects.count(), 10)
+
+        task = Task.objects.first()
+        with self.assertNumQueries(1) as captured_queries:
+            # pylint: disable=pointless-statement
+            task.project
+            self.assertIn(
+                f'AND "tests_project"."account_id" = {account.pk}',
+                captured_queries.captured_queries[0]["sql"],
+            )
+
+        with self.assertNumQueries(1):
+            Project.objects.create(name="project ref")
+        self.assertEqual(Project.objects.count(), 11)
+
+        # Other attributes load the account once
+        with self.assertNumQueries(1):
+            self.assertEqual(tenant.name, account.name)
+            self.assertEqual(tenant.subdomain, account.subdomain)
+
+        set_current_tenant_id(Account, [self.account_fr.pk, self.account_in.pk])
+        self.assertEqual(Project.objects.count(), 21)
+
+        unset_current_tenant()
+
+    def test_install_uninstall_patches(self):
+        # The base manager deletes the revenues without the tenant filter of the
+        # managers, only the patches add it
+        # pylint: disable=protected-access
+        from django.db.models.deletion import Collector
+        from django.db.models.sql import Query
+        from .models import Revenue
+
+        self.assertTrue(patches_installed())
+        self.assertTrue(hasattr(Query.get_compiler, "_sign"))
+        self.assertTrue(hasattr(Collector.delete, "_sign"))
+
+        uninstall_patches()
+        try:
+            self.assertFalse(patches_installed())
+            self.assertFalse(hasattr(Query.get_compiler, "_sign"))
+            self.assertFalse(hasattr(Collector.delete, "_sign"))
+
+            set_current_tenant(self.account_fr)
+            with CaptureQueriesContext(connection) as captured_queries:
+                Revenue._base_manager.filter(value="no such revenue").delete()
+            self.assertNotIn(
+                "acc_id", " ".join(query["sql"] for query in captured_queries)
+            )
+        finally:
+            install_patches()
+
+        # Installing twice doesn't wrap the methods twice
+        get_compiler = Query.get_compiler
+        install_patches()
+        self.assertIs(Query.get_compiler, get_compiler)
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            Revenue._base_manager.filter(value="no such revenue").delete()
+        self.assertIn("acc_id", " ".join(query["sql"] for query in captured_queries))
+        unset_current_tenant()
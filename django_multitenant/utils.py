@@ -1,33 +1,98 @@
-import inspect
+import contextvars
+from contextlib import contextmanager
 
-from django.apps import apps
-from .settings import TENANT_USE_ASGIREF
+from django.conf import settings
+from django.db.models import Model
 
+# Registers the any lookup used by the tenant filters
+from . import lookups  # pylint: disable=unused-import
+from . import registry
+from .registry import get_tenant_model_info
+from .settings import TENANT_CONTEXT_BACKEND, TENANT_USE_ASGIREF
 
-if TENANT_USE_ASGIREF:
-    # asgiref must be installed, its included with Django >= 3.0
-    from asgiref.local import Local as local
-else:
-    try:
-        from threading import local
-    except ImportError:
-        from django.utils._threading_local import local
 
+class ContextVarTenantStorage:
+    """
+    Stores the current tenant in a ContextVar.
+    The tenant follows asyncio tasks: a task inherits the tenant of the code
+    that created it, and setting the tenant in a task doesn't leak to its parent.
+    """
+
+    def __init__(self):
+        self._var = contextvars.ContextVar("django_multitenant_tenant", default=None)
+
+    def get(self):
+        return self._var.get()
+
+    def set(self, tenant):
+        return self._var.set(tenant)
 
-_thread_locals = _context = local()
+    def reset(self, token):
+        self._var.reset(token)
 
 
-def get_model_by_db_table(db_table):
+class LocalTenantStorage:
     """
-    Gets django model using db_table name
+    Stores the current tenant in a threading.local or an asgiref Local.
+    The token returned by set is the previously set tenant.
     """
-    for model in apps.get_models():
-        if model._meta.db_table == db_table:
-            return model
 
-    # here you can do fallback logic if no model with db_table found
-    raise ValueError(f"No model found with db_table {db_table}!")
-    # or return None
+    def __init__(self, local_class):
+        self._local = local_class()
+
+    def get(self):
+        return getattr(self._local, "tenant", None)
+
+    def set(self, tenant):
+        token = self.get()
+        self._local.tenant = tenant
+        return token
+
+    def reset(self, token):
+        self._local.tenant = token
+
+
+def create_tenant_storage(backend):
+    """
+    Creates the storage of the current tenant for the given backend:
+    "contextvars", "threading" or "asgiref".
+    """
+    if backend == "contextvars":
+        return ContextVarTenantStorage()
+    if backend == "asgiref":
+        # asgiref must be installed, its included with Django >= 3.0
+        from asgiref.local import Local
+
+        return LocalTenantStorage(Local)
+    if backend == "threading":
+        try:
+            from threading import local
+        except ImportError:
+            from django.utils._threading_local import local
+
+        return LocalTenantStorage(local)
+
+    raise ValueError(
+        f'Unknown TENANT_CONTEXT_BACKEND "{backend}". '
+        'Valid values are "contextvars", "threading" and "asgiref".'
+    )
+
+
+_thread_locals = _context = create_tenant_storage(
+    "asgiref" if TENANT_USE_ASGIREF else TENANT_CONTEXT_BACKEND
+)
+
+
+def get_model_by_db_table(db_table, app_registry=None):
+    """
+    Gets django model using db_table name.
+    app_registry defaults to the global app registry. The apps of a migration
+    state (from_state.apps) can be given to look up historical models.
+    """
+    model = registry.get_model_by_db_table(db_table, app_registry)
+    if model is None:
+        raise ValueError(f"No model found with db_table {db_table}!")
+    return model
 
 
 def get_current_tenant():
@@ -39,74 +104,265 @@ def get_current_tenant():
     ```
     Will return None if the tenant is not set
     """
-    return getattr(_context, "tenant", None)
+    snapshot = _context.get()
+    if snapshot is None:
+        return None
+    return snapshot.tenant
 
 
-def get_tenant_column(model_class_or_instance):
+def get_current_tenant_snapshot():
     """
-    Get the tenant field from the model object or class
+    Returns the TenantSnapshot taken when the current tenant was set, or None
+    if the tenant is not set.
+    The snapshot of a tenant which had no value when it was set, e.g. a tenant
+    not saved yet, is taken again until it has one.
     """
-    if inspect.isclass(model_class_or_instance):
-        model_class_or_instance = model_class_or_instance()
+    snapshot = _context.get()
+    if snapshot is not None and snapshot.unresolved:
+        snapshot = TenantSnapshot(snapshot.tenant)
+        _context.set(snapshot)
+    return snapshot
+
 
+def _get_tenant_model_info(model_class_or_instance):
+    """
+    Same as registry.get_tenant_model_info but raises ValueError for models
+    which are not tenant models.
+    """
+    not_a_tenant_model_message = (
+        f"{_model_name(model_class_or_instance)} is not an instance or a subclass of TenantModel "
+        "or does not inherit from TenantMixin"
+    )
     try:
-        return model_class_or_instance.tenant_field
+        info = get_tenant_model_info(model_class_or_instance)
+    except ValueError:
+        raise
     except Exception as not_a_tenant_model:
-        raise ValueError(
-            f"{model_class_or_instance.__class__.__name__} is not an instance or a subclass of TenantModel or does not inherit from TenantMixin"
-        ) from not_a_tenant_model
+        raise ValueError(not_a_tenant_model_message) from not_a_tenant_model
+
+    if info is None:
+        raise ValueError(not_a_tenant_model_message)
+    return info
+
+
+def get_tenant_column(model_class_or_instance):
+    """
+    Get the tenant field from the model object or class
+    """
+    return _get_tenant_model_info(model_class_or_instance).tenant_column
 
 
 def get_tenant_field(model_class_or_instance):
     """
     Gets the tenant field object from the model
     """
-    tenant_column = get_tenant_column(model_class_or_instance)
-    all_fields = model_class_or_instance._meta.fields
-    try:
-        return next(field for field in all_fields if field.column == tenant_column)
-    except StopIteration as no_field_found:
-        raise ValueError(
-            f'No field found in {type(model_class_or_instance).name} with column name "{tenant_column}"'
-        ) from no_field_found
+    return _get_tenant_model_info(model_class_or_instance).tenant_field
 
 
-def get_object_tenant(instance):
+def get_object_tenant(instance, fetch=True):
     """
     Gets the tenant value from the object. If the object itself is a tenant, it will return the same object
+
+    If the tenant field is a foreign key whose related object isn't loaded yet, reading it
+    runs a query. With fetch=False, a TenantRef holding the id of the tenant is returned
+    instead, the tenant row is then only loaded if one of its other attributes is read.
     """
-    field = get_tenant_field(instance)
+    info = _get_tenant_model_info(instance)
 
-    if field.primary_key:
+    if info.is_tenant_model:
         return instance
 
+    field = info.tenant_field
+    if not fetch and field.is_relation and not field.is_cached(instance):
+        ref = _get_tenant_ref(field, getattr(instance, info.tenant_attname))
+        if ref is not None:
+            return ref
+
     return getattr(instance, field.name, None)
 
 
+def _get_tenant_ref(field, value):
+    # The id stored in the foreign key is the tenant value of the related model only
+    # if the foreign key targets its tenant column.
+    if value is None:
+        return None
+    related_info = get_tenant_model_info(field.related_model)
+    if related_info is None or related_info.tenant_field != field.target_field:
+        return None
+    return TenantRef(field.related_model, value)
+
+
+def get_tenant_id(value):
+    """
+    Returns the id of a tenant given as a model instance or a TenantRef, or value
+    itself if it is already an id. Used to compare tenants without loading them.
+    """
+    if isinstance(value, TenantRef):
+        return value.tenant_value
+    if isinstance(value, Model):
+        return value.pk
+    return value
+
+
 def set_object_tenant(instance, value):
     if instance.tenant_value is None and value and not isinstance(value, list):
         setattr(instance, instance.tenant_field, value)
 
 
+class TenantSnapshot:
+    """
+    Tenant values computed once when the current tenant is set, so that the
+    queries don't have to read them from the tenant objects again.
+
+    - tenant: the object given to set_current_tenant
+    - value: the tenant value, or a tuple of values if a list of tenants is set
+    - is_multi: True if a list of tenants is set
+    - filter_suffix, filter_value: lookup suffix appended to the tenant column
+      and the value of the lookup, used to build the tenant filters. When the
+      tenant has no value, filter_value is None and no filter is added.
+      The suffix of a list of tenants is "__in", or "__any" to bind the values
+      as a single array parameter if TENANT_USE_ARRAY_PARAMETER is enabled.
+    - unresolved: True if a tenant has no value yet, i.e. it is not saved
+    """
+
+    __slots__ = (
+        "tenant",
+        "value",
+        "is_multi",
+        "filter_suffix",
+        "filter_value",
+        "unresolved",
+    )
+
+    def __init__(self, tenant):
+        is_multi = False
+        value = None
+
+        if tenant:
+            try:
+                tenants = list(tenant)
+            except TypeError:
+                value = tenant.tenant_value
+            else:
+                is_multi = True
+                value = tuple(t.tenant_value for t in tenants)
+
+        if not value:
+            filter_suffix = filter_value = None
+        elif is_multi:
+            filter_suffix = (
+                "__any"
+                if getattr(settings, "TENANT_USE_ARRAY_PARAMETER", False)
+                else "__in"
+            )
+            filter_value = value
+        else:
+            filter_suffix, filter_value = "", value
+
+        for name, attr_value in (
+            ("tenant", tenant),
+            ("value", value),
+            ("is_multi", is_multi),
+            ("filter_suffix", filter_suffix),
+            ("filter_value", filter_value),
+            (
+                "unresolved",
+                bool(tenant) and (not value or (is_multi and None in value)),
+            ),
+        ):
+            object.__setattr__(self, name, attr_value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TenantSnapshot is immutable")
+
+    def get_filters(self, model_class_or_instance, filters=None):
+        """
+        Returns filters with the tenant column of the model added to it.
+        """
+        filters = filters or {}
+        if self.filter_value is None:
+            return filters
+
+        column = get_tenant_column(model_class_or_instance)
+        if self.is_multi:
+            filters[column + self.filter_suffix] = list(self.filter_value)
+        else:
+            filters[column] = self.filter_value
+        return filters
+
+
+class TenantRef:
+    """
+    Lightweight handle on a tenant that only holds its model class and its
+    tenant value. It can be given to set_current_tenant instead of a tenant
+    instance, which avoids loading the tenant row just to read its value.
+
+    The tenant row is loaded lazily, the first time an attribute that is not
+    known without it is read.
+    """
+
+    def __init__(self, model, value):
+        self.model = model
+        self.value = value
+        self._instance = None
+
+    @property
+    def tenant_value(self):
+        return self.value
+
+    @property
+    def tenant_field(self):
+        return get_tenant_column(self.model)
+
+    @property
+    def pk(self):
+        if _get_tenant_model_info(self.model).is_tenant_model:
+            return self.value
+        return self.instance.pk
+
+    @property
+    def instance(self):
+        """
+        The tenant instance, loaded from the database on first access.
+        """
+        if self._instance is None:
+            attname = _get_tenant_model_info(self.model).tenant_attname
+            # pylint: disable=protected-access
+            self._instance = self.model._base_manager.get(**{attname: self.value})
+        return self._instance
+
+    def __getattr__(self, name):
+        # Only called for attributes not defined above
+        if name.startswith("__") or name == "_instance":
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        if isinstance(other, TenantRef):
+            return self.model is other.model and self.value == other.value
+        if isinstance(other, self.model):
+            return self.value == other.tenant_value
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.model, self.value))
+
+    def __repr__(self):
+        return f"<TenantRef: {self.model.__name__} {self.value!r}>"
+
+
 def get_current_tenant_value():
     """
     Returns current set tenant value if exists
     If tenant is a list, it will return a list of tenant values
     If there is no tenant set, it will return None
     """
-    current_tenant = get_current_tenant()
-    if not current_tenant:
+    snapshot = get_current_tenant_snapshot()
+    if snapshot is None or not snapshot.tenant:
         return None
-
-    try:
-        current_tenant = list(current_tenant)
-    except TypeError:
-        return current_tenant.tenant_value
-
-    values = []
-    for t in current_tenant:
-        values.append(t.tenant_value)
-    return values
+    if snapshot.is_multi:
+        return list(snapshot.value)
+    return snapshot.value
 
 
 def get_tenant_filters(table, filters=None):
@@ -114,19 +370,10 @@ def get_tenant_filters(table, filters=None):
     Returns filter with tenant column added to it if exists.
     If there is more than one tenant column, it will return fiter with in statement.
     """
-    filters = filters or {}
-
-    current_tenant_value = get_current_tenant_value()
-
-    if not current_tenant_value:
-        return filters
-
-    if isinstance(current_tenant_value, list):
-        filters[f"{get_tenant_column(table)}__in"] = current_tenant_value
-    else:
-        filters[get_tenant_column(table)] = current_tenant_value
-
-    return filters
+    snapshot = get_current_tenant_snapshot()
+    if snapshot is None:
+        return filters or {}
+    return snapshot.get_filters(table, filters)
 
 
 def set_current_tenant(tenant):
@@ -138,12 +385,53 @@ def set_current_tenant(tenant):
     ```
         get_current_tenant(my_class_object)
     ```
+    The tenant values are read once here, see TenantSnapshot.
     """
-    setattr(_context, "tenant", tenant)
+    _context.set(_create_snapshot(tenant))
+
+
+def set_current_tenant_id(model, value):
+    """
+    Sets the current tenant from its model class and tenant value, without
+    loading the tenant from the database. value can be a list of values to set
+    multiple tenants.
+    Can be used by doing:
+    ```
+        set_current_tenant_id(Account, request.session["account_id"])
+    ```
+    """
+    if isinstance(value, (list, tuple)):
+        set_current_tenant([TenantRef(model, v) for v in value])
+    else:
+        set_current_tenant(TenantRef(model, value))
 
 
 def unset_current_tenant():
-    setattr(_context, "tenant", None)
+    _context.set(None)
+
+
+@contextmanager
+def tenant_context(tenant):
+    """
+    Sets the current tenant for the duration of the block, and restores the
+    previous one when the block exits. Blocks can be nested.
+    Can be used by doing:
+    ```
+        with tenant_context(my_class_object):
+            ...
+    ```
+    """
+    token = _context.set(_create_snapshot(tenant))
+    try:
+        yield tenant
+    finally:
+        _context.reset(token)
+
+
+def _create_snapshot(tenant):
+    if tenant is None:
+        return None
+    return TenantSnapshot(tenant)
 
 
 def is_distributed_model(model):
@@ -151,7 +439,12 @@ def is_distributed_model(model):
     If model has tenant_field, it is distributed model and returns True
     """
     try:
-        get_tenant_field(model)
-        return True
-    except ValueError:
+        return get_tenant_model_info(model) is not None
+    except (AttributeError, ValueError):
         return False
+
+
+def _model_name(model_class_or_instance):
+    if isinstance(model_class_or_instance, type):
+        return model_class_or_instance.__name__
+    return model_class_or_instance.__class__.__name__